@@ -1,123 +1,637 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import (
+    Flask, Request, render_template, request, redirect, url_for, flash, jsonify, session, g,
+    before_render_template, template_rendered, send_file
+)
+from markupsafe import Markup
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
 import os
-import json
 import uuid
+import random
+import math
+import hashlib
+import time
+import atexit
+import signal
+import threading
+import click
 from functools import wraps
 
+from catalog import (
+    MINOR_UNITS, CatalogCache, CatalogJSON, FragmentCache, assign_product_ids, build_product_index, format_money, image_refs,
+    migrate_product_prices, name_key, new_product_id, parse_price_input, price_cart
+)
+from storage import create_storage, migrate, JSONStorage, UNCHANGED
+from writebehind import WriteBehindStorage
+from orders import OrderJournal, StorageOrderStore, decode_cursor, encode_cursor
+from users import EMAIL_TAKEN, StorageUserStore, UserJournal
+from passwords import HasherBusy, PasswordHasher
+from ratelimit import TokenBucketLimiter
+from carts import (
+    CartStore, add_item, cart_count, cart_items, remove_item, set_quantity, ANONYMOUS_PREFIX
+)
+from images import (
+    CONTENT_NAME, VARIANTS_DIR, ImagePipeline, UploadSpool, content_filename, discard_upload, place_upload,
+    remove_variants, rename_to_content, srcset_entries
+)
+from search import SearchIndex
+import fastjson
+from fastjson import FastJSONProvider
+import metrics
+from metrics import MetricsRegistry
+from profiling import ProfileStore, start_profile
+from catalog_io import (
+    FORMATS as CATALOG_FORMATS, MIMETYPES as CATALOG_MIMETYPES, apply_import, detect_format, export_chunks,
+    read_import
+)
+
+class ShopRequest(Request):
+    """Запрос, у которого загружаемые файлы пишутся потоком на диск (см. UploadSpool)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_spools = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Проверка сигнатуры изображения нужна только загрузке фото товара
+        if self.endpoint != 'upload_file':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        spool = UploadSpool(app.config['UPLOAD_SPOOL_FOLDER'], app.config['UPLOAD_MAX_BYTES'])
+        self.upload_spools.append(spool)
+        return spool
+
+    def close(self):
+        super().close()
+        # Файлы, разбор которых оборвался, не попадают в request.files - удаляем их здесь
+        for spool in self.upload_spools:
+            spool.close()
+
+
 app = Flask(__name__)
+app.request_class = ShopRequest
+# jsonify на orjson, если он установлен
+app.json = FastJSONProvider(app)
 app.config['SECRET_KEY'] = 'your-secret-key-here-change-in-production'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Предел для одного файла: проверяется по мере записи, без буферизации запроса
+app.config['UPLOAD_MAX_BYTES'] = 16 * 1024 * 1024
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+# Недописанные и еще не проверенные загрузки лежат вне static (их нельзя скачать) и
+# переносятся в uploads только после проверки. Папка instance - в каталоге приложения,
+# на том же диске, что и static, поэтому перенос атомарный (os.replace)
+app.config['UPLOAD_SPOOL_FOLDER'] = os.path.join(app.instance_path, 'upload-spool')
+
 # Создаем папку для загрузок, если её нет
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['UPLOAD_SPOOL_FOLDER'], exist_ok=True)
 
 # Файлы для хранения данных
 PRODUCTS_FILE = 'products_data.json'
 USERS_FILE = 'users_data.json'
 CARTS_FILE = 'carts_data.json'
 ORDERS_FILE = 'orders_data.json'
+ORDERS_JOURNAL_FILE = 'orders_journal.jsonl'
+USERS_JOURNAL_FILE = 'users_journal.jsonl'
+
+# Бэкенд хранилища: 'json' (файлы выше) или 'sqlite' (одна БД в режиме WAL)
+app.config['STORAGE_BACKEND'] = os.environ.get('KENZO_STORAGE', 'json')
+app.config['SQLITE_PATH'] = os.environ.get('KENZO_SQLITE_PATH', 'kenzo_store.db')
+# Компактный JSON (без отступов): файлы меньше, запись и разбор быстрее
+app.config['JSON_COMPACT'] = os.environ.get('KENZO_JSON_COMPACT', '0') == '1'
+
+# Отложенная запись (write-behind) для коллекций из KENZO_WRITE_BEHIND ('carts', 'orders'):
+# изменения копятся в памяти процесса и пишутся группой раз в WRITE_BEHIND_INTERVAL
+# секунд или при WRITE_BEHIND_MAX_PENDING изменениях, остальные пишутся сразу. По
+# умолчанию (пусто) все пишется до ответа. Накопленное дописывается при остановке
+# (close_stores), но при kill -9 или падении процесса теряются изменения последних
+# WRITE_BEHIND_INTERVAL секунд - включайте ('carts' для кликов "в корзину"), если
+# это допустимо
+app.config['WRITE_BEHIND'] = {
+    name for name in os.environ.get('KENZO_WRITE_BEHIND', '').split(',') if name in ('carts', 'orders')
+}
+app.config['WRITE_BEHIND_INTERVAL'] = 0.2
+app.config['WRITE_BEHIND_MAX_PENDING'] = 100
+
+DATA_FILES = {'users': USERS_FILE, 'carts': CARTS_FILE, 'orders': ORDERS_FILE}
+
+
+def exit_on_sigterm(signum, frame):
+    """SIGTERM - обычный выход: выполняются atexit, накопленные изменения дописываются"""
+    raise SystemExit(128 + signum)
+
+
+# Заказы в JSON режиме пишутся в журнал событий, orders_data.json служит его снимком.
+# ORDERS_FSYNC: 'always' - fsync на каждый заказ, 'interval' - не чаще раза в
+# ORDERS_FSYNC_INTERVAL секунд, 'never' - на усмотрение ОС
+app.config['ORDERS_FSYNC'] = os.environ.get('KENZO_ORDERS_FSYNC', 'interval')
+app.config['ORDERS_FSYNC_INTERVAL'] = 1.0
+app.config['ORDERS_COMPACT_EVERY'] = 1000       # событий в журнале до компакции
+app.config['ORDERS_COMPACT_INTERVAL'] = 60.0    # секунд между плановыми компакциями
+app.config['ORDERS_PAGE_SIZE'] = 20
+app.config['ORDERS_PAGE_SIZE_MAX'] = 100
+
+# Анонимные корзины: срок жизни без изменений, максимум штук и период очистки
+app.config['CART_ANONYMOUS_TTL'] = 30 * 24 * 3600
+app.config['CART_MAX_ANONYMOUS'] = 10000
+app.config['CART_EVICT_INTERVAL'] = 3600.0
+
+# Статусы заказа в порядке выполнения
+ORDER_STATUSES = ['Оформлен', 'В обработке', 'Отправлен', 'Доставлен']
+
+# Пользователи в JSON режиме - как заказы: представление в памяти с индексами по
+# имени и email, регистрация дописывает строку в журнал, users_data.json - его снимок
+app.config['USERS_COMPACT_EVERY'] = 1000
+app.config['USERS_COMPACT_INTERVAL'] = 60.0
+
+# Пароли хешируются в пуле процессов: не больше PASSWORD_HASH_WORKERS хешей одновременно
+# и PASSWORD_HASH_QUEUE в очереди, сверх того вход и регистрация получают 503.
+# PASSWORD_HASH_METHOD - метод werkzeug с параметрами ('scrypt', 'scrypt:65536:8:1',
+# 'pbkdf2:sha256:1000000'); хеши, посчитанные по-другому, пересчитываются при входе
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('KENZO_PASSWORD_HASH', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('KENZO_PASSWORD_WORKERS', min(2, os.cpu_count() or 1)))
+app.config['PASSWORD_HASH_QUEUE'] = 16
+app.config['PASSWORD_HASH_TIMEOUT'] = 10.0
+
+# Попытки входа и регистрации ограничиваются до хеширования: token bucket на IP (вход и
+# регистрация) и на имя пользователя (вход) - попыток в минуту и сколько можно подряд
+app.config['AUTH_RATE_LIMIT'] = os.environ.get('KENZO_AUTH_RATE_LIMIT', '1') == '1'
+app.config['AUTH_IP_PER_MINUTE'] = 20
+app.config['AUTH_IP_BURST'] = 10
+app.config['AUTH_USERNAME_PER_MINUTE'] = 5
+app.config['AUTH_USERNAME_BURST'] = 5
+
+ip_limiter = TokenBucketLimiter(app.config['AUTH_IP_PER_MINUTE'] / 60, app.config['AUTH_IP_BURST'])
+username_limiter = TokenBucketLimiter(app.config['AUTH_USERNAME_PER_MINUTE'] / 60,
+                                      app.config['AUTH_USERNAME_BURST'])
+
+# Варианты загруженных изображений (миниатюра, карточка, модальное окно) строятся
+# в фоне; без Pillow каталог показывает оригиналы
+app.config['IMAGE_WORKERS'] = 2
+# Загрузки названы по хешу содержимого и никогда не меняются - кэшируем их на год
+app.config['UPLOADS_MAX_AGE'] = 365 * 24 * 3600
+# Варианты названы по оригиналу и пересобираются (backfill-images --force) под теми же
+# именами - их кэшируем ненадолго и без immutable
+app.config['UPLOADS_VARIANTS_MAX_AGE'] = 24 * 3600
+
+
+def attach_image_variants(image, variants):
+    """Сохраняет готовые варианты у всех товаров с этим изображением (вызывается из пула)"""
+    def apply(products):
+        users = [
+            product
+            for category_data in products.values()
+            for product in category_data['items']
+            if product.get('image') == image
+        ]
+        if not users:
+            # Пока шла обработка, изображение заменили или удалили
+            remove_variants('static', variants)
+            return UNCHANGED
+        for product in users:
+            product['image_variants'] = variants
+        return products
+
+    update_products(apply)
+
+
+
+def init_stores():
+    """Создает хранилища и пулы и запускает фоновые потоки приложения.
+
+    Вызывается при импорте модуля, кроме импорта под именем __mp_main__: так
+    multiprocessing загружает главный модуль (python app.py) в процессах пула
+    хеширования паролей, и журналы, потоки и обработчик SIGTERM там не нужны.
+    """
+    global storage, cart_store, order_store, user_store, password_hasher, image_pipeline, catalog_cache
+    storage = WriteBehindStorage(
+        create_storage(app.config['STORAGE_BACKEND'], PRODUCTS_FILE, DATA_FILES,
+                       app.config['SQLITE_PATH'], compact=app.config['JSON_COMPACT']),
+        app.config['WRITE_BEHIND'],
+        interval=app.config['WRITE_BEHIND_INTERVAL'],
+        max_pending=app.config['WRITE_BEHIND_MAX_PENDING']
+    )
+    storage.start()
+
+    # Без обработчика SIGTERM (Waitress, перезагрузчик Flask, kill от менеджера процессов)
+    # убивает процесс мимо atexit, и отложенные изменения корзин пропали бы. Чужие
+    # обработчики не трогаем: Gunicorn после плавной остановки завершает воркер через
+    # sys.exit, и atexit выполняется. Uvicorn после плавной остановки возвращает прежний
+    # обработчик и посылает SIGTERM заново: если приложение загружено уже под его
+    # обработчиком, прежним был SIG_DFL, и процесс умирает мимо atexit - поэтому asgi.py
+    # вызывает close_stores сам в lifespan.shutdown. SIGINT по умолчанию и так завершает
+    # процесс через KeyboardInterrupt.
+    if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, exit_on_sigterm)
+
+    cart_store = CartStore(
+        storage,
+        anonymous_ttl=app.config['CART_ANONYMOUS_TTL'],
+        max_anonymous=app.config['CART_MAX_ANONYMOUS'],
+        evict_interval=app.config['CART_EVICT_INTERVAL']
+    )
+    cart_store.start()
+
+    if app.config['STORAGE_BACKEND'] == 'json':
+        order_store = OrderJournal(
+            ORDERS_FILE, ORDERS_JOURNAL_FILE,
+            fsync=app.config['ORDERS_FSYNC'],
+            fsync_interval=app.config['ORDERS_FSYNC_INTERVAL'],
+            compact_every=app.config['ORDERS_COMPACT_EVERY'],
+            compact_interval=app.config['ORDERS_COMPACT_INTERVAL'],
+            compact_json=app.config['JSON_COMPACT'],
+            write_behind='orders' in app.config['WRITE_BEHIND'],
+            flush_interval=app.config['WRITE_BEHIND_INTERVAL'],
+            flush_every=app.config['WRITE_BEHIND_MAX_PENDING']
+        )
+    else:
+        order_store = StorageOrderStore(storage)
+    order_store.start()
+
+    if app.config['STORAGE_BACKEND'] == 'json':
+        user_store = UserJournal(
+            USERS_FILE, USERS_JOURNAL_FILE,
+            fsync=app.config['ORDERS_FSYNC'],
+            fsync_interval=app.config['ORDERS_FSYNC_INTERVAL'],
+            compact_every=app.config['USERS_COMPACT_EVERY'],
+            compact_interval=app.config['USERS_COMPACT_INTERVAL'],
+            compact_json=app.config['JSON_COMPACT']
+        )
+    else:
+        user_store = StorageUserStore(storage)
+    user_store.start()
+
+    password_hasher = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_QUEUE'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT']
+    )
+    image_pipeline = ImagePipeline('static', attach_image_variants, workers=app.config['IMAGE_WORKERS'])
+
+    # Разобранный каталог держим в памяти, файл перечитываем только при изменении
+    catalog_cache = CatalogCache(load_products, storage.products_stamp)
+
+    atexit.register(close_stores)
+
+
+def close_stores():
+    """Останавливает фоновые потоки и пулы и дописывает накопленные изменения на диск.
+
+    Вызывается при выходе (atexit) и при остановке ASGI-сервера (lifespan.shutdown в
+    asgi.py). Хранилище закрывается последним: корзины и заказы сбрасывают в него свое.
+    Повторный вызов ничего не делает.
+    """
+    for close in (image_pipeline.close, password_hasher.close, user_store.close,
+                  order_store.close, cart_store.close, storage.close):
+        try:
+            close()
+        except Exception:
+            app.logger.exception("Ошибка при закрытии %r", close)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def load_products():
-    """Загружает данные о товарах из JSON файла"""
-    if os.path.exists(PRODUCTS_FILE):
-        with open(PRODUCTS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {
-        "headphones": {
-            "emoji": "🎧",
-            "name": "НАУШНИКИ",
-            "name_en": "HEADPHONES",
-            "items": [
-                {"name": "AirPods 4", "price": "3.290", "image": ""},
-                {"name": "AirPods Pro 2", "price": "3.490", "image": ""},
-                {"name": "AirPods Max", "price": "11.490", "image": ""},
-                {"name": "Marshall Major V", "price": "5.490", "image": ""}
-            ]
-        },
-        "watches": {
-            "emoji": "⌚",
-            "name": "ЧАСЫ",
-            "name_en": "WATCHES",
-            "items": [
-                {"name": "Apple Watch Series 10 I Black Titanium", "price": "3.990", "image": ""},
-                {"name": "Apple Watch Series 10 I Natural Titanium", "price": "3.990", "image": ""},
-                {"name": "Apple Watch Ultra 2", "price": "3.990", "image": ""}
-            ]
-        },
-        "charging": {
-            "emoji": "⚡",
-            "name": "ЗАРЯДНЫЕ УСТРОЙСТВА",
-            "name_en": "CHARGING DEVICES",
-            "items": [
-                {"name": "Комплект зарядки Apple 25W I USB-C, Lightning", "price": "790", "image": ""}
-            ]
-        },
-        "haircare": {
-            "emoji": "💇‍♀️",
-            "name": "УХОД ЗА ВОЛОСАМИ",
-            "name_en": "HAIR CARE",
-            "items": [
-                {"name": "Dyson Supersonic HD-08 1:1", "price": "3.490", "image": ""}
-            ]
-        },
-        "speakers": {
-            "emoji": "🎵",
-            "name": "КОЛОНКИ",
-            "name_en": "SPEAKERS",
-            "items": [
-                {"name": "JBL Flip 6", "price": "2.190", "image": ""},
-                {"name": "JBL Clip 5", "price": "2.190", "image": ""}
-            ]
-        }
-    }
+def release_image(products, image, variants):
+    """Удаляет файл изображения и его варианты, если на него больше не ссылается ни один товар.
+
+    Вызывать внутри update_products, уже убрав ссылку у товара: одинаковые загрузки
+    хранятся одним файлом, и решение должно приниматься под блокировкой каталога.
+    """
+    if not image or image_refs(products)[image]:
+        return
+    try:
+        os.remove(os.path.join('static', image))
+    except OSError:
+        pass
+    remove_variants('static', variants)
+
+@app.after_request
+def cache_uploads(response):
+    """Загруженные изображения неизменяемы: браузеры и CDN не перезапрашивают их.
+
+    Только успешные ответы: 404 на файл, который еще не записан, кэшировать нельзя.
+    """
+    if response.status_code not in (200, 304) or request.endpoint != 'static':
+        return response
+    filename = (request.view_args or {}).get('filename', '')
+    if not filename.startswith('uploads/'):
+        return response
+    variant = filename.startswith(f"uploads/{VARIANTS_DIR}/")
+    max_age = app.config['UPLOADS_VARIANTS_MAX_AGE' if variant else 'UPLOADS_MAX_AGE']
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = not variant
+    response.expires = int(time.time() + max_age)
+    return response
+
+# Метрики запросов: время по маршрутам, обращения к хранилищу, разбор JSON и
+# рендеринг шаблонов. /metrics отдает гистограммы в формате Prometheus
+app.config['METRICS_ENABLED'] = os.environ.get('KENZO_METRICS', '1') == '1'
+# Server-Timing показывает тайминги любому клиенту (DevTools) - включать для отладки
+app.config['SERVER_TIMING'] = os.environ.get('KENZO_SERVER_TIMING', '0') == '1'
+metrics_registry = MetricsRegistry()
+
+@app.before_request
+def start_request_metrics():
+    if app.config['METRICS_ENABLED']:
+        g.metrics = metrics.begin()
+
+@app.after_request
+def add_server_timing(response):
+    stats = g.get('metrics')
+    if stats is not None:
+        g.metrics_status = response.status_code
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = metrics.server_timing(stats)
+    return response
+
+@app.teardown_request
+def record_request_metrics(exc):
+    """Пишет счетчики запроса в гистограммы маршрута (после отправки ответа или ошибки)"""
+    stats = g.pop('metrics', None)
+    if stats is None:
+        return
+    metrics.finish(stats)
+    # Метка - шаблон маршрута, а не путь: /product/<id> не плодит отдельных серий
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics_registry.observe(route, request.method, g.get('metrics_status', 500), stats)
+
+@before_render_template.connect_via(app)
+def start_render_metrics(sender, **extra):
+    metrics.render_started()
+
+@template_rendered.connect_via(app)
+def finish_render_metrics(sender, **extra):
+    metrics.render_finished()
+
+# Профилирование запросов (cProfile) по требованию. Пока оно выключено, хуки
+# не регистрируются и запросы ничего за него не платят
+app.config['PROFILING_ENABLED'] = os.environ.get('KENZO_PROFILING', '0') == '1'
+# Доля запросов, профилируемых без флага (0.01 - каждый сотый)
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('KENZO_PROFILE_RATE', '0'))
+app.config['PROFILES_FOLDER'] = 'profiles'
+app.config['PROFILES_MAX_BYTES'] = 50 * 1024 * 1024
+app.config['PROFILES_MAX_FILES'] = 200
+# Администратор включает профиль запроса заголовком X-Profile: 1 или параметром ?_profile=1
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ARG = '_profile'
+profile_store = ProfileStore(app.config['PROFILES_FOLDER'], app.config['PROFILES_MAX_BYTES'],
+                             app.config['PROFILES_MAX_FILES'])
+
+def profile_trigger():
+    """Почему запрос нужно профилировать: 'flag', 'sample' или None"""
+    if session.get('is_admin') and (request.headers.get(PROFILE_HEADER) == '1'
+                                    or request.args.get(PROFILE_ARG) == '1'):
+        return 'flag'
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        return 'sample'
+    return None
+
+if app.config['PROFILING_ENABLED']:
+    @app.before_request
+    def start_request_profile():
+        trigger = profile_trigger()
+        if trigger:
+            profiler = start_profile()
+            if profiler is not None:
+                g.profile = {'profiler': profiler, 'trigger': trigger, 'started': time.perf_counter()}
+
+    @app.after_request
+    def remember_profile_status(response):
+        if 'profile' in g:
+            g.profile['status'] = response.status_code
+        return response
+
+    @app.teardown_request
+    def save_request_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile['profiler'].disable()
+        profile_store.save(profile['profiler'], {
+            'endpoint': request.endpoint,
+            'route': request.url_rule.rule if request.url_rule is not None else None,
+            'method': request.method,
+            'path': request.path,
+            'status': profile.get('status', 500),
+            'duration_ms': round((time.perf_counter() - profile['started']) * 1000, 2),
+            'trigger': profile['trigger'],
+            'user': session.get('username'),
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        })
 
-def save_products(products):
-    """Сохраняет данные о товарах в JSON файл"""
-    with open(PRODUCTS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(products, f, ensure_ascii=False, indent=2)
+@app.template_filter('money')
+def money_filter(minor):
+    """Сумма в копейках для показа: {{ item.price_minor|money }}₽"""
+    return format_money(minor)
 
-def load_users():
-    """Загружает данные о пользователях"""
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
+@app.template_filter('srcset')
+def srcset_filter(variants, fmt):
+    """Значение srcset из вариантов изображения в формате fmt ('' если их нет)"""
+    return ', '.join(
+        f"{url_for('static', filename=path)} {width}w" for path, width in srcset_entries(variants, fmt)
+    )
 
-def save_users(users):
-    """Сохраняет данные о пользователях"""
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+def load_products():
+    """Загружает данные о товарах из хранилища"""
+    products = storage.load_products()
+    if products is None:
+        products = {
+            "headphones": {
+                "emoji": "🎧",
+                "name": "НАУШНИКИ",
+                "name_en": "HEADPHONES",
+                "items": [
+                    {"name": "AirPods 4", "price_minor": 329000, "image": ""},
+                    {"name": "AirPods Pro 2", "price_minor": 349000, "image": ""},
+                    {"name": "AirPods Max", "price_minor": 1149000, "image": ""},
+                    {"name": "Marshall Major V", "price_minor": 549000, "image": ""}
+                ]
+            },
+            "watches": {
+                "emoji": "⌚",
+                "name": "ЧАСЫ",
+                "name_en": "WATCHES",
+                "items": [
+                    {"name": "Apple Watch Series 10 I Black Titanium", "price_minor": 399000, "image": ""},
+                    {"name": "Apple Watch Series 10 I Natural Titanium", "price_minor": 399000, "image": ""},
+                    {"name": "Apple Watch Ultra 2", "price_minor": 399000, "image": ""}
+                ]
+            },
+            "charging": {
+                "emoji": "⚡",
+                "name": "ЗАРЯДНЫЕ УСТРОЙСТВА",
+                "name_en": "CHARGING DEVICES",
+                "items": [
+                    {"name": "Комплект зарядки Apple 25W I USB-C, Lightning", "price_minor": 79000, "image": ""}
+                ]
+            },
+            "haircare": {
+                "emoji": "💇‍♀️",
+                "name": "УХОД ЗА ВОЛОСАМИ",
+                "name_en": "HAIR CARE",
+                "items": [
+                    {"name": "Dyson Supersonic HD-08 1:1", "price_minor": 349000, "image": ""}
+                ]
+            },
+            "speakers": {
+                "emoji": "🎵",
+                "name": "КОЛОНКИ",
+                "name_en": "SPEAKERS",
+                "items": [
+                    {"name": "JBL Flip 6", "price_minor": 219000, "image": ""},
+                    {"name": "JBL Clip 5", "price_minor": 219000, "image": ""}
+                ]
+            }
+        }
+    # Товарам без ID (старые данные) выдаем постоянные ID, цены старого формата переводим в копейки
+    assign_product_ids(products)
+    migrate_product_prices(products)
+    return products
+
+def update_products(mutate):
+    """Атомарно изменяет каталог: mutate(products) получает свежую изменяемую копию под
+    блокировкой хранилища и возвращает ее же или UNCHANGED. Возвращает итог mutate."""
+    def apply(products):
+        if products is None:
+            products = load_products()
+        else:
+            assign_product_ids(products)
+            migrate_product_prices(products)
+        return mutate(products)
+
+    products, stamp = storage.update_products(apply)
+    if products is not UNCHANGED:
+        catalog_cache.update(products, stamp)
+    return products
+
+def import_catalog(stream, fmt):
+    """Массовый импорт товаров из потока CSV/JSONL одной записью каталога.
+
+    Возвращает (число добавленных, ошибки по строкам [{'line', 'error'}]).
+    """
+    rows, errors = read_import(stream, fmt)
+    result = {'added': 0, 'errors': []}
+
+    def apply(products):
+        result['added'], result['errors'] = apply_import(products, rows)
+        return products if result['added'] else UNCHANGED
+
+    if rows:
+        update_products(apply)
+    errors = sorted(errors + result['errors'], key=lambda error: error['line'] or 0)
+    return result['added'], errors
+
+def get_products():
+    """Возвращает каталог из кэша (только для чтения, для изменений - load_products)"""
+    return catalog_cache.get()
+
+def get_product_index():
+    """Индекс товаров по ID и названию, пересобирается только при изменении каталога"""
+    return catalog_cache.derived('product_index', build_product_index)
+
+def get_search_index():
+    """Поисковый индекс; при изменении каталога переиндексируются только измененные товары"""
+    return catalog_cache.derived('search_index', search_index.sync)
+
+def get_catalog_json():
+    """Каталог, сериализованный для API; пересобирается только при изменении каталога.
+
+    URL картинок в JSON зависят от префикса приложения, поэтому он входит в ключ.
+    """
+    return catalog_cache.derived(
+        ('catalog_json', request.script_root),
+        lambda products: CatalogJSON(build_product_index(products), product_payload, fastjson.dumps)
+    )
+
+def search_products(index, query, limit):
+    """Найденные товары: [(запись индекса товаров, релевантность)] от лучших к худшим"""
+    results = []
+    for product_id, score in get_search_index().search(query, limit):
+        entry = index.by_id.get(product_id)
+        if entry is not None:
+            results.append((entry, score))
+    return results
+
+def search_limit():
+    limit = request.args.get('limit', app.config['SEARCH_RESULTS'], type=int)
+    return max(1, min(limit, app.config['SEARCH_RESULTS_MAX']))
+
+def find_product_entry(product_id=None, category_key=None, product_index=None):
+    """Находит товар по ID, а для старых ссылок - по категории и позиции в списке"""
+    index = get_product_index()
+    if product_id:
+        return index.by_id.get(product_id)
+    try:
+        product_index = int(product_index)
+    except (TypeError, ValueError):
+        return None
+    return index.at(category_key, product_index)
+
+def find_product_in_form():
+    """Товар из полей формы: product_id или устаревшие category + product_index"""
+    return find_product_entry(
+        request.form.get('product_id'),
+        request.form.get('category'),
+        request.form.get('product_index')
+    )
+
+def locate_product(products, entry):
+    """Тот же товар в изменяемой копии каталога (из load_products) или None"""
+    if entry is None:
+        return None
+    category_key, idx, product = entry[:3]
+    items = products.get(category_key, {}).get('items', [])
+    if idx < len(items) and items[idx].get('id') == product.get('id'):
+        return items[idx]
+    # Позиция сдвинулась (товар добавили или удалили в другом процессе) - ищем по ID
+    if product.get('id'):
+        for item in items:
+            if item.get('id') == product['id']:
+                return item
+    return None
+
+def orders_page(user_id=None):
+    """Страница заказов по параметрам запроса: status, date_from, date_to, cursor, limit"""
+    filters = {
+        'status': request.args.get('status') or None,
+        'date_from': request.args.get('date_from') or None,
+        'date_to': request.args.get('date_to') or None,
+    }
+    limit = request.args.get('limit', app.config['ORDERS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['ORDERS_PAGE_SIZE_MAX']))
+    rows, next_key = order_store.page(
+        user_id=user_id,
+        before=decode_cursor(request.args.get('cursor')),
+        limit=limit,
+        **filters
+    )
+    next_cursor = encode_cursor(next_key) if next_key else None
+    return rows, next_cursor, filters
+
+def order_payload(order):
+    """Заказ для JSON API: суммы в копейках плюс поля прежнего формата (цена строкой, итоги в рублях)"""
+    payload = dict(order, total=order['total_minor'] // MINOR_UNITS)
+    payload['items'] = [
+        dict(item, price=format_money(item['price_minor']), total=item['total_minor'] // MINOR_UNITS)
+        for item in order['items']
+    ]
+    return payload
 
 def load_carts():
     """Загружает данные о корзинах"""
-    if os.path.exists(CARTS_FILE):
-        with open(CARTS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
+    return storage.load_all('carts')
 
 def save_carts(carts):
     """Сохраняет данные о корзинах"""
-    with open(CARTS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(carts, f, ensure_ascii=False, indent=2)
+    storage.save_all('carts', carts)
 
 def load_orders():
-    """Загружает данные о заказах"""
-    if os.path.exists(ORDERS_FILE):
-        with open(ORDERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-def save_orders(orders):
-    """Сохраняет данные о заказах"""
-    with open(ORDERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(orders, f, ensure_ascii=False, indent=2)
+    """Загружает данные о заказах (представление только для чтения)"""
+    return order_store.all()
 
 def generate_order_number():
     """Генерирует уникальный номер заказа"""
@@ -126,32 +640,59 @@ def generate_order_number():
     random_part = str(uuid.uuid4().hex[:6]).upper()
     return f"ORD-{timestamp}-{random_part}"
 
-def get_cart_id():
-    """Получает ID корзины: user_id для авторизованных, session_id для неавторизованных"""
+def get_cart_id(create=True):
+    """Получает ID корзины: user_id для авторизованных, session_id для неавторизованных.
+
+    С create=False новому посетителю session_id не выдается и возвращается None.
+    """
     if 'user_id' in session:
         return session['user_id']
     else:
         if 'session_id' not in session:
+            if not create:
+                return None
             session['session_id'] = str(uuid.uuid4())
-        return f"session_{session['session_id']}"
+        return f"{ANONYMOUS_PREFIX}{session['session_id']}"
 
 def get_user_cart(cart_id=None):
-    """Получает корзину пользователя или сессии"""
+    """Получает корзину пользователя или сессии (без записи, если корзины еще нет)"""
     if cart_id is None:
-        cart_id = get_cart_id()
-    carts = load_carts()
-    if cart_id not in carts:
-        carts[cart_id] = []
-        save_carts(carts)
-    return carts[cart_id]
-
-def save_user_cart(cart, cart_id=None):
-    """Сохраняет корзину пользователя или сессии"""
+        cart_id = get_cart_id(create=False)
+        if cart_id is None:
+            return []
+    return cart_store.get(cart_id)
+
+def remember_cart_count(cart_id, items):
+    """Кэширует количество товаров корзины в сессии"""
+    session['cart_count'] = {'cart_id': cart_id, 'count': cart_count(items)}
+
+def get_cart_count():
+    """Количество товаров для значка корзины; к хранилищу обращается, только если его нет в сессии"""
+    cart_id = get_cart_id(create=False)
+    if cart_id is None:
+        return 0
+    cached = session.get('cart_count')
+    if cached and cached.get('cart_id') == cart_id:
+        return cached['count']
+    items = cart_store.get(cart_id)
+    remember_cart_count(cart_id, items)
+    return cart_count(items)
+
+def update_user_cart(mutate, cart_id=None):
+    """Изменяет корзину пользователя или сессии: одно чтение и не больше одной записи"""
     if cart_id is None:
         cart_id = get_cart_id()
-    carts = load_carts()
-    carts[cart_id] = cart
-    save_carts(carts)
+    items = cart_store.update(cart_id, mutate)
+    remember_cart_count(cart_id, items)
+    return items
+
+def merge_anonymous_cart(user_id):
+    """Переносит корзину неавторизованного посетителя в корзину пользователя"""
+    session_id = session.pop('session_id', None)
+    if session_id:
+        items = cart_store.merge(f"{ANONYMOUS_PREFIX}{session_id}", user_id)
+        if items is not None:
+            remember_cart_count(user_id, items)
 
 def login_required(f):
     """Декоратор для проверки авторизации"""
@@ -174,51 +715,114 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-PRODUCTS = load_products()
 
+# Служебные счетчики (/stats/*, /metrics) раскрывают объем трафика, тайминги маршрутов и
+# состояние очереди хеширования и ограничителей входа. Их видит администратор, а сборщик
+# метрик (Prometheus) - с адресов из KENZO_STATS_IPS (через запятую; по умолчанию ни с каких)
+app.config['STATS_ALLOWED_IPS'] = {
+    ip.strip() for ip in os.environ.get('KENZO_STATS_IPS', '').split(',') if ip.strip()
+}
 
-@app.route("/")
-def home():
-    # Загружаем актуальные данные
-    products = load_products()
-    # Преобразуем словарь в список для удобной работы в шаблоне
-    products_list = []
-    for key, value in products.items():
-        category = {
+
+def stats_access_required(f):
+    """Декоратор служебных счетчиков: администратор или адрес из STATS_ALLOWED_IPS"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not session.get('is_admin') and request.remote_addr not in app.config['STATS_ALLOWED_IPS']:
+            return 'Доступ запрещен', 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Отрендеренные фрагменты страниц (сетка каталога) по версии каталога
+app.config['FRAGMENT_CACHE_SIZE'] = 8
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+# Полнотекстовый поиск по каталогу (индекс один на процесс, обновляется вместе с каталогом)
+app.config['SEARCH_RESULTS'] = 20
+app.config['SEARCH_RESULTS_MAX'] = 50
+
+# Массовый импорт: сколько ошибок по строкам показывать в админ-панели
+app.config['IMPORT_ERRORS_SHOWN'] = 10
+search_index = SearchIndex()
+
+
+def templates_stamp():
+    """Отпечаток шаблонов: после их изменения старые ETag не должны совпадать"""
+    folder = os.path.join(app.root_path, app.template_folder)
+    return max((os.stat(os.path.join(folder, name)).st_mtime_ns for name in os.listdir(folder)), default=0)
+
+TEMPLATES_STAMP = templates_stamp()
+
+def make_etag(*parts):
+    """ETag из частей, от которых зависит ответ (одинаковый во всех воркерах)"""
+    stamp = templates_stamp() if app.debug else TEMPLATES_STAMP
+    return hashlib.sha1(repr((stamp,) + parts).encode('utf-8')).hexdigest()[:20]
+
+def conditional_response(etag, last_modified, render):
+    """Ответ с ETag/Last-Modified; render() вызывается, только если у клиента устаревшая версия"""
+    response = app.response_class(mimetype='text/html')
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Страница персональная: браузер хранит ее сам, но каждый раз сверяет с сервером
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    response.make_conditional(request)
+    if response.status_code != 304:
+        response.set_data(render())
+    return response
+
+def catalog_categories(products):
+    """Каталог списком категорий для шаблона"""
+    return [
+        {
             "key": key,
             "emoji": value["emoji"],
             "name": value["name"],
             "name_en": value["name_en"],
             "products": value["items"]
         }
-        products_list.append(category)
-    
-    # Получаем количество товаров в корзине
-    cart_count = 0
-    cart = get_user_cart()
-    cart_count = sum(item['quantity'] for item in cart)
-    
-    return render_template("index.html", products=products_list, cart_count=cart_count, user=session.get('username'), is_admin=session.get('is_admin', False))
+        for key, value in products.items()
+    ]
 
 
-@app.route("/product/<category_key>/<int:product_index>")
-def get_product(category_key, product_index):
-    """Получение информации о товаре"""
-    products = load_products()
-    
-    if category_key not in products:
-        return jsonify({'error': 'Категория не найдена'}), 404
-    
-    if product_index >= len(products[category_key]['items']):
-        return jsonify({'error': 'Товар не найден'}), 404
-    
-    product = products[category_key]['items'][product_index]
-    category = products[category_key]
-    
-    return jsonify({
+@app.route("/")
+def home():
+    catalog = catalog_cache.snapshot()
+    # Количество товаров в корзине берем из сессии, без чтения корзины
+    cart_count = get_cart_count()
+    user = session.get('username')
+    is_admin = session.get('is_admin', False)
+
+    def render():
+        # Сетка каталога одинакова для всех - рендерим ее один раз на версию каталога,
+        # а для каждого запроса только шапку
+        catalog_grid = fragment_cache.get_or_render(
+            ('catalog_grid', catalog.version),
+            lambda: Markup(render_template("_catalog_grid.html", products=catalog_categories(catalog.products)))
+        )
+        return render_template("index.html", catalog_grid=catalog_grid, cart_count=cart_count, user=user, is_admin=is_admin)
+
+    # Last-Modified отражает только каталог, поэтому отдаем его лишь тем, у кого
+    # шапка не персональная; персональную шапку учитывает ETag
+    personal = bool(user or cart_count)
+    etag = make_etag('home', catalog.stamp, user, is_admin, cart_count)
+    return conditional_response(etag, None if personal else catalog.modified, render)
+
+
+def product_payload(entry, index):
+    """Данные товара для модального окна"""
+    category_key, product_index, product, _ = entry
+    category = index.categories[category_key]
+    return {
+        'id': product.get('id', ''),
         'name': product['name'],
-        'price': product['price'],
+        # price - строка в прежнем формате ("3.490") для совместимости клиентов
+        'price': format_money(product['price_minor']),
+        'price_minor': product['price_minor'],
         'image': product.get('image', ''),
+        'image_srcset': srcset_filter(product.get('image_variants'), 'webp'),
         'description': product.get('description', ''),
         'specs': product.get('specs', []),
         'category_name': category['name'],
@@ -226,7 +830,151 @@ def get_product(category_key, product_index):
         'category_emoji': category['emoji'],
         'category_key': category_key,
         'product_index': product_index
-    })
+    }
+
+
+def json_payload_response(payload):
+    """Готовый JSON (JSONPayload) с ETag: 304, если у клиента та же версия.
+
+    Сжатое тело отдается клиентам, принимающим gzip; у сжатого ответа свой ETag.
+    """
+    compressed = payload.gzipped is not None and request.accept_encodings['gzip'] > 0
+    response = app.response_class(payload.gzipped if compressed else payload.body, mimetype='application/json')
+    if payload.gzipped is not None:
+        response.vary.add('Accept-Encoding')
+    if compressed:
+        response.content_encoding = 'gzip'
+    response.set_etag(f"{payload.etag}-gzip" if compressed else payload.etag)
+    response.last_modified = catalog_cache.modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def product_response(entry, index):
+    """JSON товара с ETag по содержимому: 304, если товар не менялся"""
+    payload = get_catalog_json().product(entry)
+    if payload is not None:
+        return json_payload_response(payload)
+    # Товар без ID (каталог еще не мигрирован) - сериализуем на месте
+    response = jsonify(product_payload(entry, index))
+    response.add_etag()
+    response.last_modified = catalog_cache.modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route("/product/<product_id>")
+def get_product_by_id(product_id):
+    """Получение информации о товаре по ID"""
+    index = get_product_index()
+    entry = index.by_id.get(product_id)
+    if entry is None:
+        return jsonify({'error': 'Товар не найден'}), 404
+    return product_response(entry, index)
+
+
+@app.route("/product/<category_key>/<int:product_index>")
+def get_product(category_key, product_index):
+    """Получение информации о товаре по позиции (для старых ссылок)"""
+    index = get_product_index()
+    
+    if category_key not in index.categories:
+        return jsonify({'error': 'Категория не найдена'}), 404
+    
+    entry = index.at(category_key, product_index)
+    if entry is None:
+        return jsonify({'error': 'Товар не найден'}), 404
+    
+    return product_response(entry, index)
+
+
+@app.route("/api/catalog")
+def catalog_api():
+    """Товары всего каталога (или категории: ?category=<ключ>) одним сжатым ответом.
+
+    Витрина загружает его один раз и открывает карточки товаров без запросов.
+    """
+    catalog_json = get_catalog_json()
+    category_key = request.args.get('category') or None
+    if category_key is not None and category_key not in catalog_json.categories:
+        return jsonify({'error': 'Категория не найдена'}), 404
+    return json_payload_response(catalog_json.bulk(category_key))
+
+
+@app.route("/search")
+def search():
+    """Страница результатов поиска"""
+    query = request.args.get('q', '').strip()
+    index = get_product_index()
+    results = [
+        (product, index.categories[category_key])
+        for (category_key, _, product, _), _ in search_products(index, query, search_limit())
+    ] if query else []
+    return render_template("search.html", query=query, results=results, cart_count=get_cart_count())
+
+
+@app.route("/api/search")
+def search_api():
+    """Поиск в JSON (в том числе для автодополнения): товары в формате /product/<id>"""
+    query = request.args.get('q', '').strip()
+    index = get_product_index()
+    results = [
+        dict(product_payload(entry, index), score=round(score, 3))
+        for entry, score in search_products(index, query, search_limit())
+    ] if query else []
+    return jsonify({'query': query, 'results': results})
+
+
+@app.route("/stats/catalog")
+@stats_access_required
+def catalog_stats():
+    """Счетчики попаданий/промахов кэша каталога, кэша фрагментов и размер поискового индекса"""
+    return jsonify(dict(catalog_cache.stats(), fragments=fragment_cache.stats(), search=search_index.stats()))
+
+
+@app.route("/stats/storage")
+@stats_access_required
+def storage_stats():
+    """Отложенная запись: какие коллекции, сколько изменений ждет и сколько групп записано"""
+    return jsonify(write_behind=storage.stats())
+
+
+@app.route("/stats/auth")
+@stats_access_required
+def auth_stats():
+    """Очередь хеширования паролей и отказы ограничителей попыток входа"""
+    return jsonify(hasher=password_hasher.stats(), ip_limiter=ip_limiter.stats(),
+                   username_limiter=username_limiter.stats())
+
+
+@app.route("/metrics")
+@stats_access_required
+def request_metrics():
+    """Метрики запросов этого процесса в текстовом формате Prometheus"""
+    if not app.config['METRICS_ENABLED']:
+        return 'Метрики отключены', 404
+    return app.response_class(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route("/admin/profiles")
+@login_required
+@admin_required
+def profiles():
+    """Последние профили запросов с самыми дорогими функциями"""
+    return render_template("profiles.html", profiles=profile_store.recent(), enabled=app.config['PROFILING_ENABLED'],
+                           sample_rate=app.config['PROFILE_SAMPLE_RATE'], header=PROFILE_HEADER, arg=PROFILE_ARG)
+
+
+@app.route("/admin/profiles/<name>")
+@login_required
+@admin_required
+def download_profile(name):
+    """Файл профиля в формате pstats (snakeviz, python -m pstats)"""
+    path = profile_store.path(name)
+    if path is None:
+        flash('Профиль не найден (возможно, удален ротацией)', 'error')
+        return redirect(url_for('profiles'))
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=os.path.basename(path))
 
 
 @app.route("/admin")
@@ -234,7 +982,7 @@ def get_product(category_key, product_index):
 @admin_required
 def admin():
     """Админ-панель для управления товарами и загрузки изображений"""
-    products = load_products()
+    products = get_products()
     products_list = []
     for key, value in products.items():
         category = {
@@ -261,41 +1009,43 @@ def add_product():
         flash('Выберите категорию для нового товара', 'error')
         return redirect(url_for('admin'))
 
-    products = load_products()
-
-    if category_key not in products:
-        flash('Выбранная категория не найдена', 'error')
-        return redirect(url_for('admin'))
-
     if not product_name or not product_price:
         flash('Введите название и цену товара', 'error')
         return redirect(url_for('admin'))
 
-    # Преобразуем цену в формат с разделением тысяч точкой (например, 3.490)
-    digits_only = ''.join(ch for ch in product_price if ch.isdigit())
-    if not digits_only:
+    # Цена хранится в копейках: "3490", "3 490 ₽" и "3.490" - это 349000
+    price_minor = parse_price_input(product_price)
+    if price_minor is None:
         flash('Неверный формат цены', 'error')
         return redirect(url_for('admin'))
 
-    if any(item['name'].strip().lower() == product_name.lower() for item in products[category_key]['items']):
-        flash('Товар с таким названием уже существует в этой категории', 'error')
-        return redirect(url_for('admin'))
+    error = []
+
+    def apply(products):
+        # Проверки - на свежей копии под блокировкой: параллельное добавление того же
+        # товара из другого процесса не пройдет проверку на дубликат
+        if category_key not in products:
+            error.append('Выбранная категория не найдена')
+            return UNCHANGED
+        if any(name_key(item['name']) == name_key(product_name) for item in products[category_key]['items']):
+            error.append('Товар с таким названием уже существует в этой категории')
+            return UNCHANGED
+        taken_ids = {item.get('id') for category in products.values() for item in category['items']}
+        products[category_key]['items'].append({
+            "id": new_product_id(category_key, product_name, taken_ids),
+            "name": product_name,
+            "price_minor": price_minor,
+            "image": "",
+            "description": "",
+            "specs": []
+        })
+        return products
 
-    if len(digits_only) > 3:
-        formatted_price = f"{digits_only[:-3]}.{digits_only[-3:]}"
+    update_products(apply)
+    if error:
+        flash(error[0], 'error')
     else:
-        formatted_price = digits_only
-
-    new_product = {
-        "name": product_name,
-        "price": formatted_price,
-        "image": "",
-        "description": "",
-        "specs": []
-    }
-    products[category_key]['items'].append(new_product)
-    save_products(products)
-    flash('Товар успешно добавлен', 'success')
+        flash('Товар успешно добавлен', 'success')
     return redirect(url_for('admin'))
 
 
@@ -304,39 +1054,70 @@ def add_product():
 @admin_required
 def upload_file():
     """Загружает изображение для товара"""
-    if 'file' not in request.files:
+    # Разбор формы пишет файл на диск по частям и обрывается на первом превышении
+    # размера или неверной сигнатуре, не дочитывая тело запроса
+    try:
+        files = request.files
+    except RequestEntityTooLarge:
+        flash(f"Файл слишком большой (максимум {app.config['UPLOAD_MAX_BYTES'] // (1024 * 1024)} МБ)", 'error')
+        return redirect(url_for('admin'))
+    except UnsupportedMediaType:
+        flash('Файл не является изображением PNG, JPG, GIF или WEBP', 'error')
+        return redirect(url_for('admin'))
+
+    if 'file' not in files:
         flash('Файл не выбран', 'error')
         return redirect(url_for('admin'))
     
-    file = request.files['file']
-    category_key = request.form.get('category')
-    product_index = request.form.get('product_index')
+    file = files['file']
+    entry = find_product_in_form()
     
     if file.filename == '':
         flash('Файл не выбран', 'error')
         return redirect(url_for('admin'))
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        # Создаем уникальное имя файла
-        unique_filename = f"{uuid.uuid4().hex}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(filepath)
-        
-        # Обновляем данные товара
-        products = load_products()
-        if category_key in products and int(product_index) < len(products[category_key]["items"]):
-            # Удаляем старое изображение, если оно есть
-            old_image = products[category_key]["items"][int(product_index)].get("image", "")
-            if old_image and os.path.exists(os.path.join('static', old_image)):
-                try:
-                    os.remove(os.path.join('static', old_image))
-                except:
-                    pass
-            
-            # Сохраняем путь к новому изображению
-            products[category_key]["items"][int(product_index)]["image"] = f"uploads/{unique_filename}"
-            save_products(products)
+        # Файл уже лежит во временном файле вне static; называется он по хешу
+        # содержимого, а расширение берется из сигнатуры, а не из имени
+        try:
+            tmp_path, digest, ext = file.stream.finish()
+        except UnsupportedMediaType:
+            flash('Файл не является изображением PNG, JPG, GIF или WEBP', 'error')
+            return redirect(url_for('admin'))
+        filename = content_filename(digest, ext)
+        image = f"uploads/{filename}"
+        found = []
+
+        def apply(products):
+            product = locate_product(products, entry)
+            if product is None:
+                return UNCHANGED
+            found.append(product)
+            # Ставим файл на место под блокировкой каталога, чтобы параллельное
+            # удаление того же содержимого не оставило товар без файла
+            place_upload(tmp_path, app.config['UPLOAD_FOLDER'], filename)
+            old_image = product.get("image", "")
+            if old_image == image:
+                return UNCHANGED
+            old_variants = product.pop("image_variants", None)
+            product["image"] = image
+            # Если это фото уже есть у другого товара, его варианты готовы
+            for category_data in products.values():
+                for other in category_data['items']:
+                    if other.get("image") == image and other.get("image_variants"):
+                        product["image_variants"] = other["image_variants"]
+            # Старое изображение удаляем, только если оно больше никому не нужно
+            release_image(products, old_image, old_variants)
+            return products
+
+        try:
+            update_products(apply)
+        finally:
+            discard_upload(tmp_path)
+        if found:
+            # Варианты подготовятся в фоне
+            if not found[0].get("image_variants"):
+                image_pipeline.submit(image)
             flash('Изображение успешно загружено!', 'success')
         else:
             flash('Товар не найден', 'error')
@@ -351,20 +1132,23 @@ def upload_file():
 @admin_required
 def delete_image():
     """Удаляет изображение товара"""
-    category_key = request.form.get('category')
-    product_index = request.form.get('product_index')
-    
-    products = load_products()
-    if category_key in products and int(product_index) < len(products[category_key]["items"]):
-        image_path = products[category_key]["items"][int(product_index)].get("image", "")
-        if image_path and os.path.exists(os.path.join('static', image_path)):
-            try:
-                os.remove(os.path.join('static', image_path))
-            except:
-                pass
-        
-        products[category_key]["items"][int(product_index)]["image"] = ""
-        save_products(products)
+    entry = find_product_in_form()
+    found = []
+
+    def apply(products):
+        product = locate_product(products, entry)
+        if product is None:
+            return UNCHANGED
+        found.append(product)
+        old_image = product.get("image", "")
+        old_variants = product.pop("image_variants", None)
+        product["image"] = ""
+        # Файл удаляется, только если это фото не используется другими товарами
+        release_image(products, old_image, old_variants)
+        return products
+
+    update_products(apply)
+    if found:
         flash('Изображение удалено', 'success')
     else:
         flash('Товар не найден', 'error')
@@ -377,34 +1161,100 @@ def delete_image():
 @admin_required
 def update_product():
     """Обновляет данные товара (описание, характеристики)"""
-    category_key = request.form.get('category')
-    product_index = int(request.form.get('product_index'))
     description = request.form.get('description', '').strip()
     specs_text = request.form.get('specs', '').strip()
     
-    products = load_products()
-    if category_key not in products or product_index >= len(products[category_key]["items"]):
-        flash('Товар не найден', 'error')
-        return redirect(url_for('admin'))
+    entry = find_product_in_form()
     
     # Парсим характеристики из текста (каждая строка - отдельная характеристика)
     specs = []
     if specs_text:
         specs = [spec.strip() for spec in specs_text.split('\n') if spec.strip()]
     
-    # Обновляем данные товара
-    products[category_key]["items"][product_index]["description"] = description
-    products[category_key]["items"][product_index]["specs"] = specs
-    
-    save_products(products)
+    found = []
+
+    def apply(products):
+        # Меняем только эти поля свежей копии: варианты изображения, добавленные
+        # фоновым пулом после открытия формы, сохраняются
+        product = locate_product(products, entry)
+        if product is None:
+            return UNCHANGED
+        found.append(product)
+        product["description"] = description
+        product["specs"] = specs
+        return products
+
+    update_products(apply)
+    if not found:
+        flash('Товар не найден', 'error')
+        return redirect(url_for('admin'))
     flash('Данные товара успешно обновлены', 'success')
     return redirect(url_for('admin'))
 
 
+@app.route("/import_products", methods=["POST"])
+@login_required
+@admin_required
+def import_products():
+    """Массовое добавление товаров из файла CSV или JSONL"""
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        flash('Файл не выбран', 'error')
+        return redirect(url_for('admin'))
+
+    fmt = request.form.get('format') or detect_format(file.filename)
+    if fmt not in CATALOG_FORMATS:
+        flash('Поддерживаются файлы CSV и JSONL', 'error')
+        return redirect(url_for('admin'))
+
+    added, errors = import_catalog(file.stream, fmt)
+    flash(f"Импортировано товаров: {added}, ошибок: {len(errors)}", 'success' if added else 'error')
+    shown = app.config['IMPORT_ERRORS_SHOWN']
+    for error in errors[:shown]:
+        flash(f"Строка {error['line']}: {error['error']}" if error['line'] else error['error'], 'error')
+    if len(errors) > shown:
+        flash(f"...и еще ошибок: {len(errors) - shown} (полный отчет - flask import-products)", 'error')
+    return redirect(url_for('admin'))
+
+
+@app.route("/export_products")
+@login_required
+@admin_required
+def export_products():
+    """Выгрузка каталога в CSV или JSONL потоком, по товару за раз"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in CATALOG_FORMATS:
+        flash('Поддерживаются форматы CSV и JSONL', 'error')
+        return redirect(url_for('admin'))
+    response = app.response_class(export_chunks(get_products(), fmt), mimetype=CATALOG_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f"attachment; filename=products.{fmt}"
+    return response
+
+
+def auth_retry_after(username=None):
+    """Через сколько секунд можно повторить вход или регистрацию с этого IP (и для этого имени); 0 - можно сейчас"""
+    if not app.config['AUTH_RATE_LIMIT']:
+        return 0
+    wait = ip_limiter.hit(request.remote_addr)
+    if not wait and username:
+        wait = username_limiter.hit(username.lower())
+    return wait
+
+
+def auth_rejected(template, message, status, retry_after):
+    """Отказ до проверки пароля: 429 (слишком много попыток) или 503 (очередь хеширования полна)"""
+    flash(message, 'error')
+    return render_template(template), status, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     """Регистрация нового пользователя"""
     if request.method == "POST":
+        wait = auth_retry_after()
+        if wait:
+            return auth_rejected("register.html", 'Слишком много попыток регистрации, попробуйте позже', 429, wait)
+
         username = request.form.get('username', '').strip()
         email = request.form.get('email', '').strip()
         password = request.form.get('password', '')
@@ -422,28 +1272,34 @@ def register():
             flash('Пароль должен содержать минимум 6 символов', 'error')
             return render_template("register.html")
         
-        users = load_users()
-        if username in users:
-            flash('Пользователь с таким именем уже существует', 'error')
-            return render_template("register.html")
-        
-        if any(u['email'] == email for u in users.values()):
-            flash('Пользователь с таким email уже существует', 'error')
+        # Занятость имени и email проверяем по индексам до дорогого хеширования пароля;
+        # create повторяет проверку атомарно с записью
+        conflict = user_store.conflict(username, email)
+        if conflict is None:
+            try:
+                password_hash = password_hasher.hash(password)
+            except HasherBusy:
+                return auth_rejected("register.html", 'Сервер перегружен, попробуйте через несколько секунд', 503, 5)
+            # Создаем нового пользователя
+            user = {
+                'email': email,
+                'password': password_hash,
+                'id': str(uuid.uuid4()),
+                'is_admin': username.lower() == 'admin'
+            }
+            conflict = user_store.create(username, user)
+        if conflict is not None:
+            if conflict == EMAIL_TAKEN:
+                flash('Пользователь с таким email уже существует', 'error')
+            else:
+                flash('Пользователь с таким именем уже существует', 'error')
             return render_template("register.html")
         
-        # Создаем нового пользователя
-        users[username] = {
-            'email': email,
-            'password': generate_password_hash(password),
-            'id': str(uuid.uuid4()),
-            'is_admin': username.lower() == 'admin'
-        }
-        save_users(users)
-        
         # Автоматически входим пользователя после регистрации
-        session['user_id'] = users[username]['id']
+        merge_anonymous_cart(user['id'])
+        session['user_id'] = user['id']
         session['username'] = username
-        session['is_admin'] = users[username].get('is_admin', False)
+        session['is_admin'] = user.get('is_admin', False)
         
         flash('Регистрация успешна! Добро пожаловать!', 'success')
         return redirect(url_for('home'))
@@ -462,15 +1318,25 @@ def login():
             flash('Введите имя пользователя и пароль', 'error')
             return render_template("login.html")
         
-        users = load_users()
-        if username not in users:
+        wait = auth_retry_after(username)
+        if wait:
+            return auth_rejected("login.html", 'Слишком много попыток входа, попробуйте позже', 429, wait)
+        
+        user = user_store.get(username)
+        if user is None:
             flash('Неверное имя пользователя или пароль', 'error')
             return render_template("login.html")
         
-        if check_password_hash(users[username]['password'], password):
-            session['user_id'] = users[username]['id']
+        try:
+            valid = password_hasher.verify(user['password'], password)
+        except HasherBusy:
+            return auth_rejected("login.html", 'Сервер перегружен, попробуйте через несколько секунд', 503, 5)
+        if valid:
+            rehash_password(username, user['password'], password)
+            merge_anonymous_cart(user['id'])
+            session['user_id'] = user['id']
             session['username'] = username
-            session['is_admin'] = users[username].get('is_admin', username.lower() == 'admin')
+            session['is_admin'] = user.get('is_admin', username.lower() == 'admin')
             flash(f'Добро пожаловать, {username}!', 'success')
             return redirect(url_for('home'))
         else:
@@ -480,6 +1346,24 @@ def login():
     return render_template("login.html")
 
 
+def rehash_password(username, old_hash, password):
+    """Пересчитывает хеш пароля после успешного входа, если метод или параметры хеширования сменились"""
+    try:
+        if not password_hasher.needs_rehash(old_hash):
+            return
+        new_hash = password_hasher.hash(password)
+    except HasherBusy:
+        return  # не страшно: пересчитаем при следующем входе
+
+    def apply(user):
+        if user['password'] != old_hash:
+            return UNCHANGED  # пароль уже сменили
+        user['password'] = new_hash
+        return user
+
+    user_store.update(username, apply)
+
+
 @app.route("/logout")
 def logout():
     """Выход из системы"""
@@ -491,36 +1375,10 @@ def logout():
 @app.route("/cart")
 def cart():
     """Просмотр корзины"""
-    cart_id = get_cart_id()
-    cart = get_user_cart(cart_id)
-    products = load_products()
+    cart = get_user_cart()
     
     # Получаем полную информацию о товарах в корзине
-    cart_items = []
-    total = 0
-    
-    for item in cart:
-        # Находим товар в каталоге
-        found = False
-        for category_key, category_data in products.items():
-            for idx, product in enumerate(category_data['items']):
-                if product['name'] == item['name']:
-                    price = int(product['price'].replace('.', ''))
-                    item_total = price * item['quantity']
-                    total += item_total
-                    cart_items.append({
-                        'name': product['name'],
-                        'price': product['price'],
-                        'quantity': item['quantity'],
-                        'total': item_total,
-                        'image': product.get('image', ''),
-                        'category': category_key,
-                        'index': idx
-                    })
-                    found = True
-                    break
-            if found:
-                break
+    cart_items, total = price_cart(cart, get_product_index())
     
     return render_template("cart.html", cart_items=cart_items, total=total, cart_count=len(cart_items))
 
@@ -528,47 +1386,28 @@ def cart():
 @app.route("/add_to_cart", methods=["POST"])
 def add_to_cart():
     """Добавление товара в корзину"""
-    category_key = request.form.get('category')
-    product_index = int(request.form.get('product_index'))
     quantity = int(request.form.get('quantity', 1))
     
     if quantity < 1:
         quantity = 1
     
-    products = load_products()
-    if category_key not in products or product_index >= len(products[category_key]['items']):
+    entry = find_product_in_form()
+    if entry is None:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return jsonify({'success': False, 'message': 'Товар не найден'}), 400
         flash('Товар не найден', 'error')
         return redirect(url_for('home'))
     
-    product = products[category_key]['items'][product_index]
-    cart_id = get_cart_id()
-    cart = get_user_cart(cart_id)
-    
-    # Проверяем, есть ли уже такой товар в корзине
-    found = False
-    for item in cart:
-        if item['name'] == product['name']:
-            item['quantity'] += quantity
-            found = True
-            break
-    
-    if not found:
-        cart.append({
-            'name': product['name'],
-            'quantity': quantity
-        })
-    
-    save_user_cart(cart, cart_id)
+    product = entry[2]
+    # Если товар уже в корзине, увеличиваем количество
+    cart = update_user_cart(lambda items: add_item(items, product, quantity))
     
     # Если это AJAX запрос, возвращаем JSON
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        cart_count = sum(item['quantity'] for item in cart)
         return jsonify({
             'success': True,
             'message': f'{product["name"]} добавлен в корзину!',
-            'cart_count': cart_count
+            'cart_count': cart_count(cart)
         })
     
     # Иначе обычный редирект
@@ -579,21 +1418,14 @@ def add_to_cart():
 @app.route("/update_cart", methods=["POST"])
 def update_cart():
     """Обновление количества товара в корзине"""
+    product_id = request.form.get('product_id')
     product_name = request.form.get('product_name')
     quantity = int(request.form.get('quantity', 1))
     
     if quantity < 1:
         return remove_from_cart()
     
-    cart_id = get_cart_id()
-    cart = get_user_cart(cart_id)
-    
-    for item in cart:
-        if item['name'] == product_name:
-            item['quantity'] = quantity
-            break
-    
-    save_user_cart(cart, cart_id)
+    update_user_cart(lambda items: set_quantity(items, product_id, product_name, quantity))
     flash('Корзина обновлена', 'success')
     return redirect(url_for('cart'))
 
@@ -601,12 +1433,9 @@ def update_cart():
 @app.route("/remove_from_cart", methods=["POST"])
 def remove_from_cart():
     """Удаление товара из корзины"""
+    product_id = request.form.get('product_id')
     product_name = request.form.get('product_name')
-    cart_id = get_cart_id()
-    cart = get_user_cart(cart_id)
-    
-    cart = [item for item in cart if item['name'] != product_name]
-    save_user_cart(cart, cart_id)
+    update_user_cart(lambda items: remove_item(items, product_id, product_name))
     
     flash('Товар удален из корзины', 'success')
     return redirect(url_for('cart'))
@@ -615,8 +1444,7 @@ def remove_from_cart():
 @app.route("/clear_cart", methods=["POST"])
 def clear_cart():
     """Очистка корзины"""
-    cart_id = get_cart_id()
-    save_user_cart([], cart_id)
+    update_user_cart(lambda items: [])
     flash('Корзина очищена', 'success')
     return redirect(url_for('cart'))
 
@@ -643,34 +1471,16 @@ def checkout():
             flash('Пожалуйста, заполните имя и телефон', 'error')
             return redirect(url_for('checkout'))
         
-        # Загружаем товары для расчета итоговой суммы
-        products = load_products()
-        cart_items = []
-        total = 0
-        
-        for item in cart:
-            found = False
-            for category_key, category_data in products.items():
-                for product in category_data['items']:
-                    if product['name'] == item['name']:
-                        price = int(product['price'].replace('.', ''))
-                        item_total = price * item['quantity']
-                        total += item_total
-                        cart_items.append({
-                            'name': product['name'],
-                            'price': product['price'],
-                            'quantity': item['quantity'],
-                            'total': item_total
-                        })
-                        found = True
-                        break
-                if found:
-                    break
+        # Считаем итоговую сумму по актуальным ценам каталога
+        priced_items, total = price_cart(cart, get_product_index())
+        cart_items = [
+            {key: row[key] for key in ('product_id', 'name', 'price_minor', 'quantity', 'total_minor')}
+            for row in priced_items
+        ]
         
         # Сохраняем заказ
         from datetime import datetime
         order_number = generate_order_number()
-        orders = load_orders()
         
         order_data = {
             'order_number': order_number,
@@ -684,41 +1494,19 @@ def checkout():
                 'address': address
             },
             'items': cart_items,
-            'total': total
+            'total_minor': total
         }
         
-        orders[order_number] = order_data
-        save_orders(orders)
+        order_store.create(order_data)
         
         # Очищаем корзину
-        save_user_cart([], cart_id)
+        update_user_cart(lambda items: [], cart_id)
         
-        flash(f'Заказ оформлен! Номер заказа: {order_number}. Сумма: {total:,}₽'.replace(',', '.'), 'success')
+        flash(f'Заказ оформлен! Номер заказа: {order_number}. Сумма: {format_money(total)}₽', 'success')
         return redirect(url_for('track_order', order_number=order_number))
     
     # GET запрос - показываем форму
-    products = load_products()
-    cart_items = []
-    total = 0
-    
-    for item in cart:
-        found = False
-        for category_key, category_data in products.items():
-            for product in category_data['items']:
-                if product['name'] == item['name']:
-                    price = int(product['price'].replace('.', ''))
-                    item_total = price * item['quantity']
-                    total += item_total
-                    cart_items.append({
-                        'name': product['name'],
-                        'price': product['price'],
-                        'quantity': item['quantity'],
-                        'total': item_total
-                    })
-                    found = True
-                    break
-            if found:
-                break
+    cart_items, total = price_cart(cart, get_product_index())
     
     return render_template("checkout.html", cart_items=cart_items, total=total)
 
@@ -727,37 +1515,34 @@ def checkout():
 @login_required
 def my_orders():
     """Страница с активными заказами пользователя"""
-    user_id = session.get('user_id')
-    orders = load_orders()
+    # Индекс по пользователю уже отсортирован по дате (новые первые)
+    user_orders, next_cursor, filters = orders_page(session.get('user_id'))
     
-    # Фильтруем заказы текущего пользователя
-    user_orders = {}
-    for order_number, order in orders.items():
-        if order.get('user_id') == user_id:
-            user_orders[order_number] = order
-    
-    # Сортируем по дате (новые первые)
-    sorted_orders = dict(sorted(user_orders.items(), key=lambda x: x[1]['created_at'], reverse=True))
-    
-    return render_template("my_orders.html", orders=sorted_orders)
+    return render_template("my_orders.html", orders=user_orders, next_cursor=next_cursor,
+                           filters=filters, statuses=ORDER_STATUSES)
+
+
+@app.route("/api/my_orders")
+@login_required
+def my_orders_api():
+    """Заказы пользователя постранично в JSON"""
+    user_orders, next_cursor, _ = orders_page(session.get('user_id'))
+    return jsonify({'orders': [order_payload(order) for _, order in user_orders], 'next_cursor': next_cursor})
 
 
 @app.route("/track/<order_number>")
 def track_order(order_number):
     """Страница отслеживания заказа"""
-    orders = load_orders()
+    order = order_store.get(order_number)
     
-    if order_number not in orders:
+    if order is None:
         flash('Заказ не найден', 'error')
         return redirect(url_for('home'))
     
-    order = orders[order_number]
-    
     # Определяем прогресс заказа
-    status_order_list = ['Оформлен', 'В обработке', 'Отправлен', 'Доставлен']
-    current_status_index = status_order_list.index(order['status']) if order['status'] in status_order_list else 0
+    current_status_index = ORDER_STATUSES.index(order['status']) if order['status'] in ORDER_STATUSES else 0
     
-    return render_template("track_order.html", order=order, status_order=status_order_list, current_status_index=current_status_index)
+    return render_template("track_order.html", order=order, status_order=ORDER_STATUSES, current_status_index=current_status_index)
 
 
 @app.route("/orders")
@@ -765,10 +1550,19 @@ def track_order(order_number):
 @admin_required
 def orders_list():
     """Список всех заказов для администратора"""
-    orders = load_orders()
-    # Сортируем заказы по дате создания (новые первые)
-    orders_list = sorted(orders.items(), key=lambda x: x[1].get('created_at', ''), reverse=True)
-    return render_template("orders_list.html", orders=orders_list)
+    # Общая лента заказов уже отсортирована по дате создания (новые первые)
+    orders_list, next_cursor, filters = orders_page()
+    return render_template("orders_list.html", orders=orders_list, next_cursor=next_cursor,
+                           filters=filters, statuses=ORDER_STATUSES)
+
+
+@app.route("/api/orders")
+@login_required
+@admin_required
+def orders_list_api():
+    """Все заказы постранично в JSON (для администратора)"""
+    orders_list, next_cursor, _ = orders_page()
+    return jsonify({'orders': [order_payload(order) for _, order in orders_list], 'next_cursor': next_cursor})
 
 
 @app.route("/update_order_status", methods=["POST"])
@@ -779,17 +1573,167 @@ def update_order_status():
     order_number = request.form.get('order_number')
     new_status = request.form.get('status')
     
-    orders = load_orders()
-    if order_number not in orders:
+    if order_store.set_status(order_number, new_status) is None:
         flash('Заказ не найден', 'error')
         return redirect(url_for('orders_list'))
     
-    orders[order_number]['status'] = new_status
-    save_orders(orders)
-    
     flash(f'Статус заказа {order_number} обновлен на "{new_status}"', 'success')
     return redirect(url_for('orders_list'))
 
 
+@app.cli.command("migrate-product-ids")
+def migrate_product_ids_command():
+    """Сохраняет постоянные ID товаров и проставляет product_id в старых корзинах"""
+    update_products(lambda products: products)
+    index = get_product_index()
+    carts = load_carts()
+    updated = 0
+    for record in carts.values():
+        for item in cart_items(record):
+            entry = index.by_name.get(item['name'])
+            if not item.get('product_id') and entry is not None:
+                item['product_id'] = entry[2]['id']
+                updated += 1
+    save_carts(carts)
+    print(f"products: {len(index.by_id)}")
+    print(f"cart lines: {updated}")
+
+
+@app.cli.command("migrate-prices")
+def migrate_prices_command():
+    """Сохраняет цены товаров и суммы заказов старого формата ("3.490", рубли) в копейках"""
+    # Читаем каталог в обход load_products: он переводит цены в копейки только в памяти
+    raw = storage.load_products() or {}
+    legacy = sum('price_minor' not in item for category in raw.values() for item in category['items'])
+    if legacy:
+        update_products(lambda products: products)
+    print(f"products: {legacy}")
+    print(f"orders: {order_store.rewrite()}")
+
+
+@app.cli.command("evict-carts")
+def evict_carts_command():
+    """Удаляет брошенные анонимные корзины"""
+    print(f"evicted: {cart_store.evict()}")
+
+
+@app.cli.command("compact-orders")
+def compact_orders_command():
+    """Переносит журнал заказов в снимок orders_data.json"""
+    if isinstance(order_store, OrderJournal) and order_store.compact():
+        print("orders journal compacted")
+    else:
+        print("nothing to compact")
+
+@app.cli.command("compact-users")
+def compact_users_command():
+    """Переносит журнал пользователей в снимок users_data.json"""
+    if isinstance(user_store, UserJournal) and user_store.compact():
+        print("users journal compacted")
+    else:
+        print("nothing to compact")
+
+
+@app.cli.command("backfill-images")
+@click.option('--force', is_flag=True, help='Пересобрать варианты и у товаров, где они уже есть')
+def backfill_images_command(force):
+    """Строит варианты для уже загруженных изображений"""
+    if not image_pipeline.enabled:
+        print("Pillow is not installed (or has no WebP/AVIF support)")
+        return
+    # Одинаковые загрузки хранятся одним файлом - обрабатываем каждый файл один раз
+    pending = sorted({
+        product['image']
+        for category_data in load_products().values()
+        for product in category_data['items']
+        if product.get('image') and (force or not product.get('image_variants'))
+        and os.path.exists(os.path.join('static', product['image']))
+    })
+    done = image_pipeline.process_many(pending)
+
+    def apply(products):
+        for category_data in products.values():
+            for product in category_data['items']:
+                # Изображение могли заменить, пока шла обработка
+                if product.get('image') in done:
+                    product['image_variants'] = done[product['image']]
+        return products
+
+    if done:
+        update_products(apply)
+    print(f"images: {len(done)} of {len(pending)}")
+
+
+@app.cli.command("import-products")
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(CATALOG_FORMATS), help='По умолчанию - по расширению файла')
+def import_products_command(source, fmt):
+    """Массово добавляет товары из CSV или JSONL (- читает stdin)"""
+    fmt = fmt or detect_format(source.name)
+    if fmt is None:
+        raise click.UsageError('Не удалось определить формат файла, укажите --format')
+    added, errors = import_catalog(source, fmt)
+    for error in errors:
+        print(f"line {error['line'] or '-'}: {error['error']}")
+    print(f"added: {added}, errors: {len(errors)}")
+
+
+@app.cli.command("export-products")
+@click.argument('target', type=click.File('wb'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(CATALOG_FORMATS), help='По умолчанию - по расширению файла или CSV')
+def export_products_command(target, fmt):
+    """Выгружает каталог в CSV или JSONL (по умолчанию в stdout)"""
+    fmt = fmt or detect_format(target.name) or 'csv'
+    for chunk in export_chunks(get_products(), fmt):
+        target.write(chunk.encode('utf-8'))
+
+
+@app.cli.command("rehash-images")
+def rehash_images_command():
+    """Переименовывает старые загрузки (uuid_имя) в имена по хешу содержимого, убирая дубликаты"""
+    renamed = {}
+
+    def apply(products):
+        for category_data in products.values():
+            for product in category_data['items']:
+                image = product.get('image', '')
+                if not image or CONTENT_NAME.match(os.path.basename(image)):
+                    continue
+                if image not in renamed:
+                    if not os.path.exists(os.path.join('static', image)):
+                        continue
+                    renamed[image] = rename_to_content('static', image, product.get('image_variants'))
+                product['image'], variants = renamed[image]
+                if variants:
+                    product['image_variants'] = variants
+                else:
+                    product.pop('image_variants', None)
+        return products if renamed else UNCHANGED
+
+    update_products(apply)
+    print(f"images: {len(renamed)} renamed, {len(set(new for new, _ in renamed.values()))} files")
+
+
+@app.cli.command("migrate-storage")
+def migrate_storage_command():
+    """Однократно импортирует *_data.json в хранилище SQLite"""
+    source = JSONStorage(PRODUCTS_FILE, DATA_FILES)
+    target = create_storage('sqlite', PRODUCTS_FILE, DATA_FILES, app.config['SQLITE_PATH'])
+    counts = migrate(source, target)
+    # Актуальные заказы и пользователи - снимок плюс журнал
+    orders = OrderJournal(ORDERS_FILE, ORDERS_JOURNAL_FILE).all()
+    target.save_all('orders', orders)
+    counts['orders'] = len(orders)
+    users = UserJournal(USERS_FILE, USERS_JOURNAL_FILE).all()
+    target.save_all('users', users)
+    counts['users'] = len(users)
+    for collection, count in counts.items():
+        print(f"{collection}: {count}")
+
+
+# Процессы пула хеширования паролей импортируют главный модуль как __mp_main__ (см. init_stores)
+if __name__ != '__mp_main__':
+    init_stores()
+
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=4444)
@@ -0,0 +1,181 @@
+"""ASGI-точка входа для продакшна: uvicorn asgi:application (или hypercorn asgi:application).
+
+Маршруты те же, что у app.py: Flask-приложение (WSGI) обернуто в ASGIAdapter.
+"""
+import io
+import os
+import sys
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, close_stores
+
+log = logging.getLogger(__name__)
+
+# Запросы, которые только читают данные; остальные методы выполняются в пуле записи
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+class _RequestBody(io.RawIOBase):
+    """wsgi.input: тело запроса приходит из ASGI receive по мере чтения view.
+
+    Читается из потока пула: каждая порция запрашивается у цикла событий, поэтому
+    загрузка файла не копится в памяти и не пишется на диск в цикле событий.
+    """
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            self._more = False  # клиент ушел: конец потока, werkzeug сочтет тело оборванным
+            return
+        self._buffer += message.get('body', b'')
+        self._more = message.get('more_body', False)
+
+    def readinto(self, target):
+        while not self._buffer and self._more:
+            self._fill()
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+
+class ASGIAdapter:
+    """WSGI-приложение за ASGI-сервером с отдельными пулами потоков для чтения и записи.
+
+    Цикл событий сервера держит соединения (keep-alive, медленные клиенты), а view
+    выполняются в пулах потоков. GET/HEAD идут в пул чтения, POST и прочие - в пул
+    записи: медленная запись на диск (checkout - журнал заказов с fsync и корзина)
+    занимает только потоки записи, и каталог продолжает отвечать, сколько бы заказов
+    ни ждало диска. Ответ передается серверу по частям с ожиданием отправки, поэтому
+    потоковые выгрузки не копятся в памяти.
+    """
+
+    def __init__(self, wsgi_app, read_threads=16, write_threads=4, on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.on_shutdown = on_shutdown or (lambda: None)
+        self.read_pool = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix='asgi-read')
+        self.write_pool = ThreadPoolExecutor(max_workers=write_threads, thread_name_prefix='asgi-write')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"неподдерживаемый тип соединения: {scope['type']}")
+        pool = self.read_pool if scope['method'] in READ_METHODS else self.write_pool
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(pool, self._run, scope, receive, send, loop)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Дожидаемся начатых запросов (заказы должны дописаться), потом дописываем
+                # отложенное и закрываем хранилища: Uvicorn после остановки убивает
+                # процесс повторным SIGTERM, и atexit не выполняется
+                await asyncio.to_thread(self.close)
+                await asyncio.to_thread(self.on_shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def close(self):
+        self.read_pool.shutdown(wait=True)
+        self.write_pool.shutdown(wait=True)
+
+    # --- в потоке пула ---
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            # Поток заканчивается вместе с телом запроса, в том числе без Content-Length
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if environ['PATH_INFO'].startswith(environ['SCRIPT_NAME']):
+            environ['PATH_INFO'] = environ['PATH_INFO'][len(environ['SCRIPT_NAME']):]
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f"HTTP_{name}"
+            if name in environ:
+                # Повторяющиеся заголовки склеиваются; cookie в HTTP/2 приходят по одной
+                value = f"{environ[name]}{'; ' if name == 'HTTP_COOKIE' else ','}{value}"
+            environ[name] = value
+        return environ
+
+    def _run(self, scope, receive, send, loop):
+        def sync_send(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started and started[0] is True:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [{
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            }]
+
+        def send_start():
+            if started[0] is not True:
+                sync_send(started[0])
+                started[0] = True
+
+        environ = self._environ(scope, _RequestBody(receive, loop))
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except Exception:
+            log.exception("Ошибка приложения: %s %s", scope['method'], scope['path'])
+            sync_send({'type': 'http.response.start', 'status': 500,
+                       'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+            sync_send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+            return
+        try:
+            for chunk in response:
+                if chunk:
+                    send_start()
+                    sync_send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_start()
+            sync_send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # close() запускает обработчики call_on_close и закрывает файлы send_file
+            if hasattr(response, 'close'):
+                response.close()
+
+
+app.config['ASGI_READ_THREADS'] = int(os.environ.get('KENZO_ASGI_READ_THREADS', '16'))
+app.config['ASGI_WRITE_THREADS'] = int(os.environ.get('KENZO_ASGI_WRITE_THREADS', '4'))
+
+application = ASGIAdapter(app, app.config['ASGI_READ_THREADS'], app.config['ASGI_WRITE_THREADS'],
+                          on_shutdown=close_stores)
@@ -0,0 +1,66 @@
+"""Общая обвязка замеров: копия данных во временной папке и приложение, работающее на ней.
+
+Приложение читает *_data.json относительно текущего каталога, поэтому замеры
+запускают его в копии данных и рабочие файлы не меняют. Перед удалением копии
+хранилища закрываются (как atexit): отложенная запись корзин и журналы дописываются,
+фоновые потоки останавливаются и не обращаются к уже удаленным файлам.
+"""
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILES = ('products_data.json', 'users_data.json', 'carts_data.json', 'orders_data.json')
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def copy_data(prefix):
+    """Временная папка с копией *_data.json из корня репозитория; возвращает ее путь"""
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    for name in DATA_FILES:
+        if os.path.exists(os.path.join(ROOT, name)):
+            shutil.copy(os.path.join(ROOT, name), workdir)
+    return workdir
+
+
+def load_app(workdir=None, **env):
+    """Импортирует app.py с данными из workdir (по умолчанию - текущей папки).
+
+    env - переменные окружения приложения (KENZO_STORAGE='sqlite' и т.п.).
+    """
+    if workdir is not None:
+        os.chdir(workdir)
+    os.environ.update(env)
+    import app
+    return app
+
+
+def close_app(kenzo):
+    """Закрывает хранилища и пулы приложения (app.close_stores, как при atexit).
+
+    Нужно и в процессах multiprocessing: они завершаются без atexit.
+    """
+    kenzo.close_stores()
+
+
+@contextlib.contextmanager
+def app_workdir(prefix, **env):
+    """with app_workdir('kenzo-x-') as kenzo: приложение на копии данных.
+
+    При выходе хранилища закрываются, текущий каталог восстанавливается, копия удаляется.
+    """
+    cwd = os.getcwd()
+    workdir = copy_data(prefix)
+    kenzo = None
+    try:
+        kenzo = load_app(workdir, **env)
+        yield kenzo
+    finally:
+        if kenzo is not None:
+            close_app(kenzo)
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
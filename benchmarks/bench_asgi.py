@@ -0,0 +1,68 @@
+"""Синхронный (WSGI) и ASGI-режим под одинаковой нагрузкой при медленном диске.
+
+Дважды запускает benchmarks/loadtest.py с одними данными, смесью и числом виртуальных
+пользователей: синхронный сервер (Gunicorn или Waitress, если установлены, иначе
+Werkzeug) с --threads + --write-threads потоками и Uvicorn с asgi.py - столько же
+потоков, но разделенных на пулы чтения и записи. Каждый fsync сервера задерживается
+на --disk-latency мс, поэтому оформление заказа долго ждет диска; смотреть стоит на
+задержки home и product - в синхронном режиме они стоят в очереди за заказами.
+
+Запуск: python benchmarks/bench_asgi.py [--concurrency 16] [--threads 4] [--write-threads 2] [--disk-latency 20]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadtest import available_server
+
+LOADTEST = os.path.join(ROOT, 'benchmarks', 'loadtest.py')
+
+
+def run(server, args, threads, extra=()):
+    command = [sys.executable, LOADTEST, '--server', server, '--workers', '1', '--threads', str(threads),
+               '--mix', args.mix, '--concurrency', str(args.concurrency), '--duration', str(args.duration),
+               '--disk-latency', str(args.disk_latency), '--products', str(args.products), '--json', '-', *extra]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--threads', type=int, default=4, help='потоков чтения (ASGI)')
+    parser.add_argument('--write-threads', type=int, default=2, help='потоков записи (ASGI)')
+    parser.add_argument('--disk-latency', type=float, default=20, metavar='MS')
+    parser.add_argument('--mix', default='home=40,product=40,checkout=20')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--sync-server', default=None, help='gunicorn, waitress или werkzeug')
+    args = parser.parse_args()
+
+    sync_server = args.sync_server or available_server()
+    total_threads = args.threads + args.write_threads
+    results = [
+        (f"{sync_server}, {total_threads} потоков", run(sync_server, args, total_threads)),
+        (f"uvicorn, {args.threads} чтение + {args.write_threads} запись",
+         run('uvicorn', args, args.threads, ('--write-threads', str(args.write_threads)))),
+    ]
+    if sync_server == 'werkzeug':
+        print('внимание: Werkzeug создает поток на каждое соединение, число потоков не ограничено')
+    print(f"{args.concurrency} пользователей, смесь {args.mix}, fsync +{args.disk_latency:g} мс, "
+          f"{os.cpu_count()} CPU")
+    print(f"{'режим':<32} {'операция':>10} {'запр/с':>8} {'p50':>8} {'p95':>8} {'p99':>8}  мс")
+    for label, result in results:
+        for name, row in dict(result['operations'], total=result['total']).items():
+            if not row['requests']:
+                continue
+            print(f"{label:<32} {name:>10} {row['throughput']:>8.1f} "
+                  f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+            label = ''
+
+
+if __name__ == '__main__':
+    main()
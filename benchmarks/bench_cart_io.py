@@ -0,0 +1,98 @@
+"""Чтения и записи хранилища на каждый маршрут корзины - с проверкой границ.
+
+Приложение запускается на копии *_data.json во временной папке (benchmarks/_common.py).
+Обращения считает слой метрик (metrics.count_read/count_write вызывают оба бэкенда),
+поэтому учитываются и атомарная запись JSON через mkstemp, и транзакции SQLite.
+Отложенная запись корзин (write-behind, KENZO_WRITE_BEHIND) сбрасывается после каждого
+шага вручную и считается отдельной колонкой; по умолчанию, как и в приложении,
+корзины пишутся сразу, --write-behind carts включает отложенную запись.
+
+Для каждого запроса задан предел: изменение корзины - не больше одного чтения и одной
+записи корзин, шаг без изменений - ни одной записи ни в запросе, ни при сбросе. Сброс -
+один update_many: не больше одного чтения и одной записи. Превышение - AssertionError.
+
+Запуск: python benchmarks/bench_cart_io.py [--storage json|sqlite] [--write-behind carts]
+"""
+import argparse
+
+from _common import app_workdir
+
+import metrics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--write-behind', default='', help="KENZO_WRITE_BEHIND (carts, orders)")
+    args = parser.parse_args()
+
+    with app_workdir('kenzo-io-', KENZO_STORAGE=args.storage, KENZO_METRICS='1',
+                     KENZO_WRITE_BEHIND=args.write_behind) as kenzo:
+        # Фоновый поток отложенной записи останавливаем: сбрасываем сами после каждого шага
+        kenzo.storage.close()
+        kenzo.app.config['TEMPLATES_AUTO_RELOAD'] = False
+        client = kenzo.app.test_client()
+        product_id = next(iter(kenzo.get_product_index().by_id))
+        ajax = {'X-Requested-With': 'XMLHttpRequest'}
+
+        with client.session_transaction() as sess:
+            sess['user_id'] = 'bench-user'
+            sess['username'] = 'bench'
+
+        observed = []
+        observe = kenzo.metrics_registry.observe
+
+        def capture(route, method, status, stats):
+            observed.append(stats)
+            observe(route, method, status, stats)
+
+        kenzo.metrics_registry.observe = capture
+
+        def add():
+            return client.post('/add_to_cart', data={'product_id': product_id}, headers=ajax)
+
+        def update(quantity):
+            return lambda: client.post('/update_cart', data={'product_id': product_id, 'quantity': quantity})
+
+        # (шаг, запрос, максимум чтений, максимум записей) - для самого запроса
+        steps = [
+            # Количества еще нет в сессии: одно чтение, дальше - из сессии
+            ('GET /', lambda: client.get('/'), 1, 0),
+            ('POST /add_to_cart', add, 1, 1),
+            ('POST /add_to_cart', add, 1, 1),
+            ('GET /', lambda: client.get('/'), 0, 0),
+            ('GET /cart', lambda: client.get('/cart'), 1, 0),
+            ('POST /update_cart', update(3), 1, 1),
+            ('POST /update_cart (no change)', update(3), 1, 0),
+            ('GET /checkout', lambda: client.get('/checkout'), 1, 0),
+            # Корзина читается и очищается после записи заказа (чтение + update), заказ -
+            # первое обращение к журналу (снимок + хвост) и одна запись
+            ('POST /checkout', lambda: client.post('/checkout', data={'name': 'Bench', 'phone': '1'}), 4, 2),
+            ('POST /add_to_cart', add, 1, 1),
+            ('POST /remove_from_cart', lambda: client.post('/remove_from_cart', data={'product_id': product_id}), 1, 1),
+            ('POST /clear_cart (empty)', lambda: client.post('/clear_cart'), 1, 0),
+        ]
+
+        print(f"{args.storage}, write-behind: {args.write_behind or '-'}")
+        print(f"{'route':32} {'reads':>5} {'writes':>6} {'flush r/w':>9}  limit")
+        failures = []
+        for title, call, max_reads, max_writes in steps:
+            observed.clear()
+            response = call()
+            assert response.status_code < 400, (title, response.status_code)
+            assert len(observed) == 1, (title, 'метрики запроса не записаны')
+            flush = metrics.begin()
+            kenzo.storage.flush()
+            metrics.finish(flush)
+            reads, writes = observed[0].reads, observed[0].writes
+            print(f"{title:32} {reads:>5} {writes:>6} {flush.reads:>5}/{flush.writes:<3}  {max_reads}/{max_writes}")
+            if reads > max_reads or writes > max_writes:
+                failures.append(f"{title}: {reads} чтений, {writes} записей (предел {max_reads}/{max_writes})")
+            if flush.reads > 1 or flush.writes > (1 if max_writes else 0):
+                failures.append(f"{title}: сброс - {flush.reads} чтений, {flush.writes} записей")
+        assert not failures, '\n'.join(failures)
+        print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Сравнение расчета корзины: вложенный перебор каталога против индекса по названию.
+
+Запуск: python benchmarks/bench_cart_pricing.py [--items 10000] [--cart 20]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import build_product_index, price_cart
+
+
+def make_catalog(n_items, n_categories=10):
+    """Синтетический каталог из n_items товаров"""
+    products = {}
+    for c in range(n_categories):
+        products[f"cat{c}"] = {"emoji": "", "name": f"CAT {c}", "name_en": f"CAT {c}", "items": []}
+    for i in range(n_items):
+        products[f"cat{i % n_categories}"]["items"].append(
+            {"name": f"Product {i}", "price_minor": ((1 + i % 20) * 1000 + i % 1000) * 100, "image": ""}
+        )
+    return products
+
+
+def price_cart_scan(cart, products):
+    """Прежний алгоритм: для каждой строки корзины перебираем весь каталог"""
+    cart_items = []
+    total = 0
+    for item in cart:
+        found = False
+        for category_key, category_data in products.items():
+            for idx, product in enumerate(category_data['items']):
+                if product['name'] == item['name']:
+                    price = product['price_minor']
+                    item_total = price * item['quantity']
+                    total += item_total
+                    cart_items.append({
+                        'name': product['name'],
+                        'price_minor': price,
+                        'quantity': item['quantity'],
+                        'total_minor': item_total,
+                        'image': product.get('image', ''),
+                        'category': category_key,
+                        'index': idx
+                    })
+                    found = True
+                    break
+            if found:
+                break
+    return cart_items, total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--cart', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    products = make_catalog(args.items)
+    rng = random.Random(42)
+    cart = [{'name': f"Product {rng.randrange(args.items)}", 'quantity': 1} for _ in range(args.cart)]
+
+    index = build_product_index(products)
+    indexed_items, indexed_total = price_cart(cart, index)
+    scan_items, scan_total = price_cart_scan(cart, products)
+    assert indexed_total == scan_total
+    assert [row['name'] for row in indexed_items] == [row['name'] for row in scan_items]
+
+    build = timeit.timeit(lambda: build_product_index(products), number=10) / 10
+    scan = timeit.timeit(lambda: price_cart_scan(cart, products), number=args.repeat) / args.repeat
+    indexed = timeit.timeit(lambda: price_cart(cart, index), number=args.repeat) / args.repeat
+
+    print(f"catalog={args.items} cart={args.cart}")
+    print(f"index build (once per catalog version): {build * 1000:.3f} ms")
+    print(f"nested scan: {scan * 1e6:.1f} us/request")
+    print(f"indexed:     {indexed * 1e6:.1f} us/request")
+    print(f"speedup:     {scan / indexed:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
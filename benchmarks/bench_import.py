@@ -0,0 +1,50 @@
+"""Добавление N товаров: по одному через /add_product против одного импорта CSV.
+
+Оба способа работают на копии данных во временной папке (приложение читает файлы
+относительно текущего каталога). /add_product на каждый товар перечитывает каталог
+и переписывает products_data.json, импорт делает одну запись.
+
+Запуск: python benchmarks/bench_import.py [--items 300]
+"""
+import argparse
+import io
+import time
+
+from _common import app_workdir
+
+
+def make_csv(n_items, prefix):
+    lines = ['category,name,price,description,specs']
+    for i in range(n_items):
+        lines.append(f'headphones,{prefix} {i},{1000 + i},Описание товара {i},"Цвет: черный\nВес: {i} г"')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=300)
+    args = parser.parse_args()
+
+    with app_workdir('kenzo-import-') as kenzo:
+        client = kenzo.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 'bench-admin'
+            sess['username'] = 'admin'
+            sess['is_admin'] = True
+
+        started = time.perf_counter()
+        for i in range(args.items):
+            client.post('/add_product', data={'category': 'headphones', 'name': f"По одному {i}", 'price': '1000'})
+        one_by_one = time.perf_counter() - started
+
+        started = time.perf_counter()
+        added, errors = kenzo.import_catalog(io.BytesIO(make_csv(args.items, 'Импорт').encode('utf-8')), 'csv')
+        bulk = time.perf_counter() - started
+
+        print(f"товаров: {args.items}")
+        print(f"  /add_product по одному: {one_by_one * 1000:.0f} мс")
+        print(f"  импорт CSV:             {bulk * 1000:.0f} мс (добавлено {added}, ошибок {len(errors)})")
+
+
+if __name__ == '__main__':
+    main()
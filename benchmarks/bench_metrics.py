@@ -0,0 +1,76 @@
+"""Накладные расходы метрик запросов: одни и те же запросы с KENZO_METRICS=1 и 0.
+
+Каждый режим запускается в отдельном процессе на копии данных во временной папке.
+Запросы - главная (рендеринг из кэша), поиск, карточка товара и добавление в корзину
+(чтение и запись хранилища).
+
+Запуск: python benchmarks/bench_metrics.py [--requests 2000]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from _common import close_app, copy_data, load_app
+
+
+def run(n_requests):
+    """Один прогон в текущем процессе (данные - в текущей папке): среднее время запроса по типам, мкс"""
+    kenzo = load_app()
+    client = kenzo.app.test_client()
+    product_id = next(iter(kenzo.get_products().values()))['items'][0]['id']
+    paths = {
+        'home': lambda: client.get('/'),
+        'search': lambda: client.get('/api/search?q=airpods'),
+        'product': lambda: client.get(f'/product/{product_id}'),
+        'add_to_cart': lambda: client.post('/add_to_cart', data={'product_id': product_id, 'quantity': '1'},
+                                           headers={'X-Requested-With': 'XMLHttpRequest'}),
+    }
+    results = {}
+    for name, call in paths.items():
+        call()
+        samples = []
+        for _ in range(n_requests // len(paths)):
+            started = time.perf_counter()
+            call()
+            samples.append((time.perf_counter() - started) * 1e6)
+        results[name] = statistics.median(samples)
+    close_app(kenzo)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        for name, value in run(args.requests).items():
+            print(f"{name} {value:.1f}")
+        return
+
+    medians = {}
+    for enabled in ('0', '1'):
+        workdir = copy_data('kenzo-metrics-')
+        try:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', '--requests', str(args.requests)],
+                cwd=workdir, env=dict(os.environ, KENZO_METRICS=enabled), check=True,
+                capture_output=True, text=True
+            ).stdout
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        medians[enabled] = dict((name, float(value)) for name, value in (line.split() for line in output.splitlines()))
+
+    print(f"{'запрос':>12}  {'без метрик':>11}  {'с метриками':>11}  разница")
+    for name, off in medians['0'].items():
+        on = medians['1'][name]
+        print(f"{name:>12}  {off:>8.0f} мкс  {on:>8.0f} мкс  {on - off:+.0f} мкс ({(on - off) / off * 100:+.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Всплеск входов: хеширование в потоках запросов против ограниченного пула процессов.
+
+Клиенты (потоки, как потоки сервера) непрерывно хешируют пароли, а отдельный поток
+в это время отдает "страницу каталога" - чистый Python на несколько мс. Без пула
+каждый вход считает scrypt в своем потоке (GIL отпускается, но ядра заняты все),
+с пулом одновременно считается не больше --workers хешей, лишние входы получают
+отказ (в приложении - 503), а страницы отвечают почти как без нагрузки.
+
+Запуск: python benchmarks/bench_passwords.py [--clients 16] [--seconds 5] [--workers 1] [--queue 4]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from passwords import HasherBusy, PasswordHasher
+
+
+def page():
+    """Примерно столько процессора занимает рендеринг страницы каталога"""
+    return sum(i * i for i in range(20000))
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+
+def run(label, hasher, clients, seconds):
+    stop = threading.Event()
+    hashed, rejected, page_ms = [], [], []
+
+    def client():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                hasher.hash('secret123')
+                hashed.append((time.perf_counter() - started) * 1000)
+            except HasherBusy:
+                rejected.append(1)
+                time.sleep(0.05)  # клиент повторяет попытку не сразу
+
+    def pages():
+        while not stop.is_set():
+            started = time.perf_counter()
+            page()
+            page_ms.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)] + [threading.Thread(target=pages)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    hasher.close()
+    print(f"{label}:")
+    print(f"  хешей {len(hashed) / seconds:6.1f}/с, отказов {len(rejected) / seconds:6.1f}/с, "
+          f"вход p50 {statistics.median(hashed or [0]):7.1f} мс  p99 {percentile(hashed, 0.99):7.1f} мс")
+    print(f"  страница p50 {statistics.median(page_ms or [0]):7.1f} мс  p99 {percentile(page_ms, 0.99):7.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--queue', type=int, default=4)
+    parser.add_argument('--method', default='scrypt')
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU, {args.clients} клиентов, метод {args.method}")
+    baseline = []
+    for _ in range(50):
+        started = time.perf_counter()
+        page()
+        baseline.append((time.perf_counter() - started) * 1000)
+    print(f"страница без нагрузки: p50 {statistics.median(baseline):.1f} мс")
+    # Без пула и без предела очереди - как register/login до PasswordHasher
+    run('в потоках запросов', PasswordHasher(args.method, workers=0, max_pending=args.clients),
+        args.clients, args.seconds)
+    run(f"пул процессов ({args.workers} + очередь {args.queue})",
+        PasswordHasher(args.method, workers=args.workers, max_pending=args.queue), args.clients, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
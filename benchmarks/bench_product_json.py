@@ -0,0 +1,90 @@
+"""JSON товаров для модального окна: сериализация на каждый запрос против готовых байтов.
+
+На копии каталога из --products товаров (как в loadtest.py) сравнивает:
+  - /product/<id> прежним способом (jsonify + ETag от хеша тела на каждый запрос)
+    и из CatalogJSON (готовые байты и ETag);
+  - сериализацию всего каталога стандартным json и fastjson (orjson, если установлен);
+  - сколько байт и запросов нужно витрине: по запросу на каждое открытое окно
+    против одного сжатого /api/catalog.
+
+Запуск: python benchmarks/bench_product_json.py [--products 2000] [--requests 2000] [--opens 20]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import time
+
+from _common import ROOT, close_app, copy_data, load_app
+from loadtest import make_products
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--opens', type=int, default=20, help='сколько карточек открывает покупатель')
+    args = parser.parse_args()
+
+    workdir = copy_data('kenzo-json-')
+    kenzo = None
+    try:
+        with open(os.path.join(workdir, 'products_data.json'), 'w', encoding='utf-8') as f:
+            json.dump(make_products(args.products, random.Random(1)), f, ensure_ascii=False)
+        kenzo = load_app(workdir)
+        import fastjson
+
+        client = kenzo.app.test_client()
+        index = kenzo.get_product_index()
+        ids = list(index.by_id)
+        rnd = random.Random(2)
+
+        def old_product():
+            entry = index.by_id[rnd.choice(ids)]
+            response = kenzo.jsonify(kenzo.product_payload(entry, index))
+            response.add_etag()
+            response.last_modified = kenzo.catalog_cache.modified
+            response.cache_control.no_cache = True
+            return response.make_conditional(kenzo.request)
+
+        with kenzo.app.test_request_context('/product/x'):
+            started = time.perf_counter()
+            catalog_json = kenzo.get_catalog_json()
+            build = time.perf_counter() - started
+            old = timed(old_product, args.requests)
+            new = timed(lambda: kenzo.json_payload_response(catalog_json.product(index.by_id[rnd.choice(ids)])),
+                        args.requests)
+
+        with kenzo.app.test_request_context('/'):
+            payloads = {product_id: kenzo.product_payload(entry, index) for product_id, entry in index.by_id.items()}
+        std = timed(lambda: json.dumps(payloads, ensure_ascii=False, sort_keys=True).encode('utf-8'), 20)
+        fast = timed(lambda: fastjson.dumps(payloads), 20)
+
+        opened = rnd.sample(ids, min(args.opens, len(ids)))
+        per_modal = sum(len(client.get(f"/product/{product_id}").data) for product_id in opened)
+        bulk = client.get('/api/catalog', headers={'Accept-Encoding': 'gzip'})
+        plain = client.get('/api/catalog')
+
+        print(f"{len(ids)} товаров, JSON: {'orjson' if fastjson.orjson is not None else 'json'}")
+        print(f"  сериализация каталога для API (раз на версию): {build * 1000:.1f} мс")
+        print(f"  /product/<id>: на каждый запрос {old * 1e6:7.1f} мкс, готовый {new * 1e6:7.1f} мкс")
+        print(f"  весь каталог: json {std * 1000:.1f} мс, fastjson {fast * 1000:.1f} мс")
+        print(f"  витрина: {len(opened)} карточек по запросу - {per_modal} байт, {len(opened)} запросов")
+        print(f"           /api/catalog - {len(bulk.data)} байт gzip ({len(plain.data)} без сжатия), 1 запрос")
+    finally:
+        if kenzo is not None:
+            close_app(kenzo)
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Скорость поиска по синтетическому каталогу: построение индекса, запросы, правка товара.
+
+Каталог строится из реального products_data.json, размноженного вариациями
+(бренды, модели, цвета, слова описаний), чтобы словарь был близок к живому.
+Цель - меньше 5 мс на запрос при 50 000 товаров.
+
+Запуск: python benchmarks/bench_search.py [--items 50000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from catalog import assign_product_ids
+from search import SearchIndex
+
+BRANDS = ['Apple', 'Samsung', 'Xiaomi', 'JBL', 'Sony', 'Dyson', 'Marshall', 'Huawei', 'Honor',
+          'Anker', 'Baseus', 'Ugreen', 'Bose', 'Sennheiser', 'Garmin', 'Amazfit', 'Philips', 'Braun']
+KINDS = ['наушники', 'колонка', 'часы', 'зарядка', 'кабель', 'фен', 'стайлер', 'чехол',
+         'headphones', 'speaker', 'watch', 'charger', 'cable', 'earbuds', 'powerbank', 'case']
+COLORS = ['черный', 'белый', 'синий', 'красный', 'титан', 'black', 'white', 'silver', 'midnight',
+          'starlight', 'graphite', 'gold']
+SYLLABLES = ['ка', 'ро', 'ми', 'на', 'ло', 'те', 'за', 'ви', 'су', 'по', 'ля', 'де',
+             'ta', 'ro', 'ni', 'ko', 'lu', 'ma', 'se', 'vo', 'pi', 're', 'da', 'zu']
+QUERIES = {
+    'exact': ['airpods', 'dyson', 'jbl flip', 'наушники', 'apple watch'],
+    'prefix': ['air', 'наушн', 'samsung gal', 'powerb', 'sennh'],
+    'translit': ['naushniki', 'kolonka', 'эирподс', 'самсунг'],
+    'typo': ['airpdos', 'sensheiser', 'наушнеки', 'dysn', 'grafite'],
+    'layout': ['фшкзщвы', 'вныщт', 'ctyyrtqpth'],
+    'miss': ['zzzzqqq', 'холодильник'],
+}
+
+
+def make_catalog(n_items, seed=1):
+    """Синтетический каталог: реальные товары плюс вариации до n_items штук"""
+    rnd = random.Random(seed)
+    with open(os.path.join(ROOT, 'products_data.json'), encoding='utf-8') as f:
+        base = json.load(f)
+    vocabulary = [''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))) for _ in range(20000)]
+    seeds = [(key, item) for key, category in base.items() for item in category['items']]
+    products = {key: dict(category, items=list(category['items'])) for key, category in base.items()}
+    for i in range(n_items - len(seeds)):
+        key, item = seeds[i % len(seeds)]
+        name = f"{rnd.choice(BRANDS)} {rnd.choice(KINDS)} {rnd.randint(1, 999)} {rnd.choice(COLORS)}"
+        # Слова описания по Ципфу: частые встречаются везде, редкие - в паре товаров
+        words = [vocabulary[min(int(rnd.paretovariate(1.0)) - 1, len(vocabulary) - 1)] for _ in range(25)]
+        products[key]['items'].append({
+            'name': name,
+            'price': item['price'],
+            'image': '',
+            'description': f"{item.get('description', '')[:80]} {' '.join(words)}",
+            'specs': [f"Модель: {name}", f"Цвет: {rnd.choice(COLORS)}"] + item.get('specs', [])[:2],
+        })
+    assign_product_ids(products)
+    return products
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    products = make_catalog(args.items)
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.sync(products)
+    print(f"построение индекса: {(time.perf_counter() - started) * 1000:.0f} мс, {index.stats()}")
+
+    all_samples = []
+    for kind, queries in QUERIES.items():
+        samples = []
+        for query in queries:
+            samples += timed(lambda: index.search(query), args.repeat)
+        all_samples += samples
+        hits = [len(index.search(query)) for query in queries]
+        print(f"{kind:>9}: p50 {statistics.median(samples):.2f} мс, max {max(samples):.2f} мс, результатов {hits}")
+    all_samples.sort()
+    p95 = all_samples[int(len(all_samples) * 0.95)]
+    print(f"все запросы: p50 {statistics.median(all_samples):.2f} мс, p95 {p95:.2f} мс, max {all_samples[-1]:.2f} мс")
+
+    # Инкрементальное обновление: правка одного товара (новый каталог, как после update_products)
+    edited = {key: dict(category, items=[dict(item) for item in category['items']])
+              for key, category in products.items()}
+    first = next(iter(edited.values()))['items'][0]
+    first['description'] = 'уникальноеслово для проверки'
+    started = time.perf_counter()
+    index.sync(edited)
+    print(f"sync после правки одного товара: {(time.perf_counter() - started) * 1000:.1f} мс, "
+          f"найден: {index.search('уникальноеслово')[0][0] == first['id']}")
+
+
+if __name__ == '__main__':
+    main()
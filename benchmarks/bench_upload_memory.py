@@ -0,0 +1,176 @@
+"""Память сервера при параллельных загрузках изображений по 16 МБ.
+
+Сервер (werkzeug, многопоточный) запускается отдельным процессом на копии данных во
+временной папке; клиент одновременно отправляет --concurrency загрузок и следит за
+VmRSS процесса сервера (Linux, /proc). Режимы:
+- streaming - текущий /upload: файл пишется на диск по частям (UploadSpool);
+- baseline - прежняя схема: стандартный Request Flask и file.save().
+
+Отдельно замеряется отказ: файл того же размера, но не изображение.
+
+Запуск: python benchmarks/bench_upload_memory.py [--concurrency 8] [--mode both] [--json]
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from _common import copy_data, load_app
+
+# Чуть меньше 16 МБ, чтобы запрос целиком прошел MAX_CONTENT_LENGTH
+FILE_SIZE = 16 * 1024 * 1024 - 64 * 1024
+BOUNDARY = 'kenzo-bench-boundary'
+
+
+def serve(mode):
+    """Процесс сервера: печатает порт и cookie администратора, затем обслуживает запросы"""
+    import uuid
+    from flask import Flask, request
+    from werkzeug.serving import make_server
+    kenzo = load_app()
+
+    # Построение вариантов не относится к замеру
+    kenzo.image_pipeline.submit = lambda image: None
+    if mode == 'baseline':
+        target = Flask('baseline')
+        target.config['MAX_CONTENT_LENGTH'] = kenzo.app.config['MAX_CONTENT_LENGTH']
+
+        @target.route('/upload', methods=['POST'])
+        def upload():
+            file = request.files['file']
+            if kenzo.allowed_file(file.filename):
+                file.save(os.path.join(kenzo.app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{file.filename}"))
+            return '', 302
+    else:
+        target = kenzo.app
+
+    client = kenzo.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 'bench-admin'
+        sess['username'] = 'admin'
+        sess['is_admin'] = True
+    cookie = client.get_cookie('session').value
+    product_id = next(iter(kenzo.get_product_index().by_id))
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, target, threaded=True)
+    print(json.dumps({'port': server.server_port, 'cookie': cookie, 'product_id': product_id}), flush=True)
+    server.serve_forever()
+
+
+def rss_kb(pid, field='VmRSS'):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def multipart(product_id, payload):
+    head = (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"product_id\"\r\n\r\n{product_id}\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"photo.jpg\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode()
+    return head + payload + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def post(port, cookie, body):
+    """Отправляет загрузку; возвращает (статус или имя ошибки, секунды)"""
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        conn.request('POST', '/upload', body=body, headers={
+            'Content-Type': f"multipart/form-data; boundary={BOUNDARY}",
+            'Cookie': f"session={cookie}",
+        })
+        status = conn.getresponse().status
+    except (BrokenPipeError, ConnectionResetError) as exc:
+        # Сервер ответил и закрыл соединение, не дочитав тело
+        status = type(exc).__name__
+    finally:
+        conn.close()
+    return status, time.perf_counter() - started
+
+
+def run(mode, concurrency):
+    workdir = copy_data('kenzo-upload-')
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', mode],
+        cwd=workdir, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        info = json.loads(server.stdout.readline())
+        port, cookie = info['port'], info['cookie']
+        noise = os.urandom(FILE_SIZE - 16)
+        bodies = [multipart(info['product_id'], b'\xff\xd8\xff\xe0' + os.urandom(12) + noise)
+                  for _ in range(concurrency)]
+        del noise
+
+        idle = rss_kb(server.pid)
+        peak = idle
+        results = []
+        threads = [threading.Thread(target=lambda body=body: results.append(post(port, cookie, body)))
+                   for body in bodies]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            peak = max(peak, rss_kb(server.pid))
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        peak = max(peak, rss_kb(server.pid, 'VmHWM'))
+
+        rejected_status, rejected_time = post(port, cookie, multipart(
+            info['product_id'], b'MZ' + b'\0' * (FILE_SIZE - 2)))
+        return {
+            'mode': mode,
+            'concurrency': concurrency,
+            'file_mb': round(FILE_SIZE / 1024 / 1024, 2),
+            'statuses': sorted({str(status) for status, _ in results}),
+            'elapsed_s': round(elapsed, 3),
+            'rss_idle_mb': round(idle / 1024, 1),
+            'rss_peak_mb': round(peak / 1024, 1),
+            'rss_growth_mb': round((peak - idle) / 1024, 1),
+            'invalid_upload_status': str(rejected_status),
+            'invalid_upload_s': round(rejected_time, 3),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mode', choices=('streaming', 'baseline', 'both'), default='both')
+    parser.add_argument('--json', action='store_true', help='вывести результат одной строкой JSON')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve)
+        return
+
+    modes = ('baseline', 'streaming') if args.mode == 'both' else (args.mode,)
+    reports = [run(mode, args.concurrency) for mode in modes]
+    if args.json:
+        print(json.dumps(reports))
+        return
+    for report in reports:
+        print(f"{report['mode']:>9}: {report['concurrency']} x {report['file_mb']} MB "
+              f"за {report['elapsed_s']} с, статусы {report['statuses']}")
+        print(f"           RSS {report['rss_idle_mb']} -> {report['rss_peak_mb']} MB "
+              f"(+{report['rss_growth_mb']} MB)")
+        print(f"           не изображение: {report['invalid_upload_status']} "
+              f"за {report['invalid_upload_s']} с")
+
+
+if __name__ == '__main__':
+    main()
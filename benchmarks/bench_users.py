@@ -0,0 +1,140 @@
+"""Регистрация и вход при большом числе пользователей: старый путь против индексов.
+
+Старый путь (как register/login до UserJournal): проверка email - полное чтение
+users_data.json и перебор, регистрация - перезапись всего файла, вход - снова
+полное чтение. Новый путь - UserJournal (JSON) и StorageUserStore (SQLite): поиск по
+словарям или индексам и дозапись одной строки журнала.
+
+Пользователи синтетические, хеш пароля у всех одинаковый (его длина как у настоящего).
+
+Запуск: python benchmarks/bench_users.py [--users 1000000] [--repeat 1000] [--legacy-repeat 3]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import JSONStorage, SQLiteStorage, email_key
+from users import StorageUserStore, UserJournal
+
+PASSWORD_HASH = 'scrypt:32768:8:1$' + 'x' * 16 + '$' + 'f' * 128
+
+
+def make_user(i):
+    return {'email': f"User{i}@Example.com", 'password': PASSWORD_HASH,
+            'id': f"{i:08x}-0000-4000-8000-000000000000", 'is_admin': False}
+
+
+def timed(fn, repeat):
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return samples
+
+
+def report(label, samples):
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"  {label:<28} p50 {statistics.median(samples):9.3f} мс   p99 {p99:9.3f} мс")
+
+
+def legacy(workdir, n_users, repeat):
+    """register/login до индексов: полный файл на каждую проверку и запись"""
+    users_file = os.path.join(workdir, 'users_data.json')
+    storage = JSONStorage(os.path.join(workdir, 'products_data.json'), {'users': users_file}, compact=True)
+
+    def register(i):
+        username, email = f"legacy{i}", f"legacy{i}@example.com"
+        if storage.get('users', username) is not None:
+            return
+        users = storage.load_all('users')
+        if any(u['email'] == email for u in users.values()):
+            return
+        storage.put('users', username, make_user(n_users + i))
+
+    print(f"старый путь (JSONStorage, {n_users} пользователей):")
+    report('вход (get)', timed(lambda i: storage.get('users', f"user{i}"), repeat))
+    report('регистрация', timed(register, repeat))
+
+
+def journal(workdir, n_users, repeat):
+    started = time.perf_counter()
+    store = UserJournal(os.path.join(workdir, 'users_data.json'), os.path.join(workdir, 'users_journal.jsonl'),
+                        fsync='never')
+    print(f"UserJournal: загрузка {n_users} пользователей {time.perf_counter() - started:.1f} с, "
+          f"пик памяти процесса {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} МБ")
+    report('вход (get)', timed(lambda i: store.get(f"user{i * 997 % n_users}"), repeat))
+    report('поиск по email', timed(lambda i: store.find_by_email(f"USER{i * 991 % n_users}@example.com"), repeat))
+    report('проверка дубликата', timed(lambda i: store.conflict(f"new{i}", f"user{i}@example.com"), repeat))
+    report('регистрация', timed(lambda i: store.create(f"new{i}", make_user(n_users + i)), repeat))
+    # Компакция пишет снимок без блокировки: вход и регистрация в это время не ждут
+    compaction = threading.Thread(target=store.compact)
+    started = time.perf_counter()
+    compaction.start()
+    during = []
+    i = 0
+    while compaction.is_alive():
+        t = time.perf_counter()
+        store.get(f"user{i * 997 % n_users}")
+        store.create(f"during{i}", make_user(2 * n_users + i))
+        during.append((time.perf_counter() - t) * 1000)
+        i += 1
+        time.sleep(0.01)
+    print(f"  компакция журнала в снимок: {time.perf_counter() - started:.1f} с, "
+          f"вход + регистрация во время нее: max {max(during or [0]):.1f} мс")
+
+
+def sqlite(workdir, n_users, repeat):
+    storage = SQLiteStorage(os.path.join(workdir, 'users.db'))
+    conn = storage._conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (key, value, email) VALUES (?, ?, ?)",
+            ((f"user{i}", json.dumps(make_user(i)), email_key(make_user(i)['email'])) for i in range(n_users))
+        )
+    store = StorageUserStore(storage)
+    print(f"StorageUserStore (SQLite, {n_users} пользователей):")
+    report('вход (get)', timed(lambda i: store.get(f"user{i * 997 % n_users}"), repeat))
+    report('поиск по email', timed(lambda i: store.find_by_email(f"USER{i * 991 % n_users}@example.com"), repeat))
+    report('регистрация', timed(lambda i: store.create(f"new{i}", make_user(n_users + i)), repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--legacy-repeat', type=int, default=3)
+    parser.add_argument('--skip-sqlite', action='store_true')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='kenzo-users-')
+    try:
+        started = time.perf_counter()
+        with open(os.path.join(workdir, 'users_data.json'), 'w', encoding='utf-8') as f:
+            json.dump({f"user{i}": make_user(i) for i in range(args.users)}, f, separators=(',', ':'))
+        size = os.path.getsize(os.path.join(workdir, 'users_data.json'))
+        print(f"users_data.json: {size / 1024 / 1024:.0f} МБ, создан за {time.perf_counter() - started:.1f} с")
+
+        # Новые пути - до старого: он дописывает пользователей в тот же файл
+        journal(workdir, args.users, args.repeat)
+        os.remove(os.path.join(workdir, 'users_journal.jsonl'))
+        if not args.skip_sqlite:
+            sqlite(workdir, args.users, args.repeat)
+        legacy(workdir, args.users, args.legacy_repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
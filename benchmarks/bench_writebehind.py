@@ -0,0 +1,109 @@
+"""Всплеск изменений корзин: запись на каждое изменение против отложенной групповой записи.
+
+Потоки (как потоки сервера) кликают "в корзину" по случайным корзинам из --carts
+существующих. Без write-behind каждый клик перезаписывает carts_data.json (или
+коммитит транзакцию SQLite), с WriteBehindStorage клики копятся в памяти и пишутся
+группой раз в --interval секунд.
+
+Запуск: python benchmarks/bench_writebehind.py [--carts 2000] [--clicks 400] [--threads 8] [--storage json]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from carts import CartStore, add_item
+from storage import create_storage
+from writebehind import WriteBehindStorage
+
+
+def open_storage(workdir, backend):
+    files = {name: os.path.join(workdir, f"{name}_data.json") for name in ('users', 'carts', 'orders')}
+    return create_storage(backend, os.path.join(workdir, 'products_data.json'), files,
+                          os.path.join(workdir, 'kenzo_store.db'), compact=True)
+
+
+def make_storage(workdir, backend, n_carts):
+    storage = open_storage(workdir, backend)
+    storage.save_all('carts', {
+        f"user{i}": {'items': [{'product_id': f"p{i % 100}", 'name': f"Товар {i % 100}", 'quantity': 1}],
+                     'touched': time.time()}
+        for i in range(n_carts)
+    })
+    return storage
+
+
+def run(label, storage, args):
+    carts = CartStore(storage)
+    samples = []
+    lock = threading.Lock()
+
+    def clicker(seed):
+        rnd = random.Random(seed)
+        local = []
+        for _ in range(args.clicks // args.threads):
+            cart_id = f"user{rnd.randrange(args.carts)}"
+            product = {'id': f"p{rnd.randrange(100)}", 'name': 'Товар'}
+            started = time.perf_counter()
+            carts.update(cart_id, lambda items: add_item(items, product, 1))
+            local.append((time.perf_counter() - started) * 1000)
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=clicker, args=(i,)) for i in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    flushed = 0
+    if isinstance(storage, WriteBehindStorage):
+        storage.close()  # дописываем остаток, как при остановке сервера
+        flushed = storage.flushes
+    samples.sort()
+    print(f"{label}:")
+    print(f"  {len(samples) / elapsed:8.0f} кликов/с, p50 {statistics.median(samples):7.3f} мс, "
+          f"p99 {samples[int(len(samples) * 0.99)]:7.3f} мс"
+          + (f", групповых записей: {flushed}" if flushed else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--carts', type=int, default=2000)
+    parser.add_argument('--clicks', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--interval', type=float, default=0.2)
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    args = parser.parse_args()
+
+    print(f"{args.storage}: {args.carts} корзин, {args.clicks} кликов в {args.threads} потоков")
+    for write_behind in (False, True):
+        workdir = tempfile.mkdtemp(prefix='kenzo-wb-')
+        try:
+            storage = make_storage(workdir, args.storage, args.carts)
+            if write_behind:
+                storage = WriteBehindStorage(storage, {'carts'}, interval=args.interval)
+                storage.start()
+                run(f"write-behind, группа раз в {args.interval:g} с", storage, args)
+                check = open_storage(workdir, args.storage)
+                total = sum(item['quantity'] for record in check.load_all('carts').values()
+                            for item in record['items'])
+                print(f"  на диске после остановки: {total - args.carts} добавленных единиц из "
+                      f"{args.clicks // args.threads * args.threads}")
+            else:
+                run('запись на каждый клик', storage, args)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
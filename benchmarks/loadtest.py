@@ -0,0 +1,513 @@
+"""Нагрузочный тест магазина под настоящим WSGI-сервером.
+
+Во временной папке создаются синтетические данные нужного масштаба (товары,
+пользователи, заказы, корзины), затем приложение запускается отдельным процессом
+(Gunicorn или Waitress, если установлены, иначе многопоточный сервер Werkzeug;
+--server uvicorn - ASGI-режим, asgi.py), и виртуальные пользователи гоняют по нему
+смесь сценариев:
+
+  home          главная страница
+  product       JSON товара для модального окна (/product/<id>)
+  add_to_cart   добавление в корзину через AJAX
+  checkout      оформление заказа и страница заказа, куда ведет редирект
+  admin_orders  список заказов в админке
+
+Каждый виртуальный пользователь входит под своим аккаунтом и держит keep-alive
+соединение. Итог - пропускная способность и задержки p50/p95/p99 по сценариям;
+--json сохраняет их для сравнения между релизами, --compare сверяет с прошлым
+результатом и завершается с кодом 1 при деградации. --disk-latency добавляет
+задержку к каждому fsync сервера - так выглядит медленный диск.
+
+Запуск:
+  python benchmarks/loadtest.py --mix shop --concurrency 8 --duration 20 --json result.json
+  python benchmarks/loadtest.py --products 20000 --orders 100000 --storage sqlite
+  python benchmarks/loadtest.py --mix home=50,checkout=50 --compare result.json
+  python benchmarks/loadtest.py --server uvicorn --threads 4 --write-threads 2 --disk-latency 20
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from catalog import MINOR_UNITS, assign_product_ids, migrate_product_prices
+
+PASSWORD = 'loadtest-password'
+ADMIN = 'admin'
+STATUSES = ['Оформлен', 'В обработке', 'Отправлен', 'Доставлен']
+BRANDS = ['Apple', 'Samsung', 'Xiaomi', 'JBL', 'Sony', 'Dyson', 'Marshall', 'Huawei', 'Anker', 'Bose']
+KINDS = ['наушники', 'колонка', 'часы', 'зарядка', 'кабель', 'фен', 'чехол', 'earbuds', 'powerbank']
+COLORS = ['черный', 'белый', 'синий', 'титан', 'silver', 'graphite']
+
+MIXES = {
+    'shop': {'home': 35, 'product': 35, 'add_to_cart': 20, 'checkout': 5, 'admin_orders': 5},
+    'browse': {'home': 50, 'product': 50},
+    'cart': {'add_to_cart': 70, 'checkout': 30},
+    'admin': {'admin_orders': 100},
+}
+
+
+# --- Данные ---
+
+def make_products(n_items, rnd):
+    """Реальный каталог, размноженный вариациями до n_items товаров"""
+    with open(os.path.join(ROOT, 'products_data.json'), encoding='utf-8') as f:
+        products = json.load(f)
+    seeds = [(key, item) for key, category in products.items() for item in category['items']]
+    for i in range(max(0, n_items - len(seeds))):
+        key, item = seeds[i % len(seeds)]
+        name = f"{rnd.choice(BRANDS)} {rnd.choice(KINDS)} {i} {rnd.choice(COLORS)}"
+        products[key]['items'].append({
+            'name': name,
+            'price_minor': rnd.randint(5, 500) * 100 * MINOR_UNITS,
+            'image': '',
+            'description': f"{item.get('description', '')[:120]}",
+            'specs': [f"Модель: {name}"] + item.get('specs', [])[:3],
+        })
+    assign_product_ids(products)
+    migrate_product_prices(products)
+    return products
+
+
+def seed(workdir, args):
+    """Пишет *_data.json в workdir; возвращает (id товаров, имена пользователей)"""
+    from werkzeug.security import generate_password_hash
+
+    rnd = random.Random(args.seed)
+    products = make_products(args.products, rnd)
+    catalog = [item for category in products.values() for item in category['items']]
+
+    # Хеш пароля считается долго - один на всех пользователей
+    password_hash = generate_password_hash(PASSWORD)
+    users = {ADMIN: {'email': 'admin@loadtest.local', 'password': password_hash,
+                     'id': str(uuid.UUID(int=rnd.getrandbits(128))), 'is_admin': True}}
+    for i in range(args.users):
+        users[f"user{i}"] = {'email': f"user{i}@loadtest.local", 'password': password_hash,
+                             'id': str(uuid.UUID(int=rnd.getrandbits(128))), 'is_admin': False}
+    user_ids = [user['id'] for user in users.values()]
+
+    orders = {}
+    now = datetime.now()
+    for i in range(args.orders):
+        created = now - timedelta(seconds=rnd.randint(0, 365 * 24 * 3600))
+        items = []
+        for product in rnd.sample(catalog, rnd.randint(1, 3)):
+            quantity = rnd.randint(1, 3)
+            items.append({'product_id': product['id'], 'name': product['name'],
+                          'price_minor': product['price_minor'], 'quantity': quantity,
+                          'total_minor': product['price_minor'] * quantity})
+        number = f"ORD-{created.strftime('%Y%m%d%H%M%S')}-{i:06X}"
+        orders[number] = {
+            'order_number': number,
+            'status': rnd.choice(STATUSES),
+            'created_at': created.strftime("%Y-%m-%d %H:%M:%S"),
+            'user_id': rnd.choice(user_ids),
+            'customer': {'name': 'Покупатель', 'phone': '+70000000000', 'email': '', 'address': ''},
+            'items': items,
+            'total_minor': sum(item['total_minor'] for item in items),
+        }
+
+    carts = {}
+    for user_id in rnd.sample(user_ids, min(args.carts, len(user_ids))):
+        product = rnd.choice(catalog)
+        carts[user_id] = {'items': [{'product_id': product['id'], 'name': product['name'], 'quantity': 1}],
+                          'touched': time.time()}
+
+    for name, data in (('products_data.json', products), ('users_data.json', users),
+                       ('orders_data.json', orders), ('carts_data.json', carts)):
+        with open(os.path.join(workdir, name), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+    if args.storage == 'sqlite':
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate-storage'], cwd=workdir,
+                       env=server_env(args), check=True, capture_output=True)
+    return [item['id'] for item in catalog], [name for name in users if name != ADMIN]
+
+
+# --- Сервер ---
+
+def available_server():
+    for name in ('gunicorn', 'waitress'):
+        try:
+            __import__(name)
+            return name
+        except ImportError:
+            continue
+    return 'werkzeug'
+
+
+def server_env(args):
+    # Все виртуальные пользователи входят с одного адреса - ограничение попыток входа выключаем;
+    # /stats/catalog (проверка готовности) доступен с локального адреса
+    return dict(os.environ, PYTHONPATH=ROOT, KENZO_STORAGE=args.storage,
+                KENZO_SQLITE_PATH='kenzo_store.db', KENZO_AUTH_RATE_LIMIT='0', KENZO_STATS_IPS='127.0.0.1')
+
+
+# sitecustomize в папке данных: процесс сервера импортирует его при старте
+SLOW_DISK = '''import os
+import time
+
+_fsync = os.fsync
+
+
+def fsync(fd):
+    time.sleep({delay})
+    _fsync(fd)
+
+
+os.fsync = fsync
+'''
+
+
+def start_server(workdir, port, args):
+    env = server_env(args)
+    if args.disk_latency:
+        with open(os.path.join(workdir, 'sitecustomize.py'), 'w', encoding='utf-8') as f:
+            f.write(SLOW_DISK.format(delay=args.disk_latency / 1000))
+        env['PYTHONPATH'] = os.pathsep.join((workdir, ROOT))
+    if args.server == 'uvicorn':
+        # Пулы ASGIAdapter: --threads на чтение, --write-threads на запись
+        env.update(KENZO_ASGI_READ_THREADS=str(args.threads), KENZO_ASGI_WRITE_THREADS=str(args.write_threads))
+        command = [sys.executable, '-m', 'uvicorn', '--workers', str(args.workers), '--host', '127.0.0.1',
+                   '--port', str(port), '--log-level', 'warning', 'asgi:application']
+    elif args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+                   '--bind', f"127.0.0.1:{port}", '--log-level', 'warning', 'app:app']
+    elif args.server == 'waitress':
+        command = [sys.executable, '-m', 'waitress', f"--threads={args.threads}", f"--listen=127.0.0.1:{port}",
+                   'app:app']
+    else:
+        command = [sys.executable, os.path.abspath(__file__), '--serve', str(port)]
+    # Лог в файл, а не в pipe: непрочитанный pipe переполнится и остановит сервер
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'wb') as log:
+        server = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=log)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            with open(log_path, encoding='utf-8', errors='replace') as log:
+                raise RuntimeError(f"сервер не запустился:\n{log.read()}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/stats/catalog')
+            conn.getresponse().read()
+            conn.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('сервер не ответил за 60 секунд')
+
+
+def serve(port):
+    """Многопоточный сервер Werkzeug с keep-alive (когда нет Gunicorn/Waitress)"""
+    import logging
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app as kenzo
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    make_server('127.0.0.1', port, kenzo.app, threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# --- Клиент ---
+
+class Client:
+    """Keep-alive соединение с cookie сессии одного посетителя"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+        self.cookie = None
+        # Отдельная сессия администратора для admin_orders
+        self.admin = None
+
+    def request(self, method, path, form=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            try:
+                self.conn.request(method, path, body, headers)
+                response = self.conn.getresponse()
+                response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # Сервер закрыл keep-alive соединение - повторяем на новом
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+        for header in response.msg.get_all('Set-Cookie') or []:
+            cookie = header.split(';', 1)[0]
+            if cookie.startswith('session='):
+                self.cookie = cookie if cookie != 'session=' else None
+        return response
+
+    def login(self, username):
+        response = self.request('POST', '/login', {'username': username, 'password': PASSWORD})
+        if response.status != 302:
+            raise RuntimeError(f"не удалось войти как {username}: HTTP {response.status}")
+
+
+class Scenarios:
+    """Операции смеси; каждая возвращает True при ожидаемом ответе"""
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+
+    def home(self, client, rnd):
+        return client.request('GET', '/').status == 200
+
+    def product(self, client, rnd):
+        return client.request('GET', f"/product/{rnd.choice(self.product_ids)}").status == 200
+
+    def add_to_cart(self, client, rnd):
+        response = client.request('POST', '/add_to_cart',
+                                  {'product_id': rnd.choice(self.product_ids), 'quantity': '1'},
+                                  {'X-Requested-With': 'XMLHttpRequest'})
+        return response.status == 200
+
+    def checkout(self, client, rnd):
+        # Корзина могла опустеть после прошлого заказа - сначала кладем товар
+        self.add_to_cart(client, rnd)
+        response = client.request('POST', '/checkout', {'name': 'Нагрузочный тест', 'phone': '+70000000000'})
+        location = response.getheader('Location', '')
+        if response.status != 302 or '/track/' not in location:
+            return False
+        # Как браузер - открываем страницу заказа (она же забирает flash-сообщение из сессии)
+        return client.request('GET', urlsplit(location).path).status == 200
+
+    def admin_orders(self, client, rnd):
+        status = rnd.choice([None] + STATUSES)
+        path = '/orders' + (f"?{urlencode({'status': status})}" if status else '')
+        return client.admin.request('GET', path).status == 200
+
+
+def parse_mix(value):
+    if value in MIXES:
+        return dict(MIXES[value])
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in MIXES['shop']:
+            raise argparse.ArgumentTypeError(f"неизвестная операция {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(samples, q):
+    """Перцентиль по ближайшему рангу из отсортированного списка"""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, int(round(q / 100 * len(samples))) - 1))]
+
+
+def summarize(samples, errors, duration):
+    samples = sorted(samples)
+    ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput': round(len(samples) / duration, 1),
+        'mean_ms': ms(sum(samples) / len(samples)) if samples else None,
+        'p50_ms': ms(percentile(samples, 50)),
+        'p95_ms': ms(percentile(samples, 95)),
+        'p99_ms': ms(percentile(samples, 99)),
+        'max_ms': ms(samples[-1]) if samples else None,
+    }
+
+
+def run_load(port, product_ids, usernames, args):
+    mix = args.mix
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    scenarios = Scenarios(product_ids)
+    results = {name: ([], [0]) for name in names}
+    lock = threading.Lock()
+    warmup_until = time.monotonic() + args.warmup
+    stop_at = warmup_until + args.duration
+
+    clients = []
+    for i in range(args.concurrency):
+        client = Client(port)
+        client.login(usernames[i % len(usernames)])
+        if 'admin_orders' in mix:
+            client.admin = Client(port)
+            client.admin.login(ADMIN)
+        clients.append(client)
+
+    def worker(i, client):
+        rnd = random.Random(args.seed * 1000 + i)
+        local = {name: ([], [0]) for name in names}
+        while True:
+            name = rnd.choices(names, weights)[0]
+            started = time.monotonic()
+            if started >= stop_at:
+                break
+            try:
+                ok = getattr(scenarios, name)(client, rnd)
+            except (http.client.HTTPException, OSError):
+                ok = False
+            elapsed = time.monotonic() - started
+            if started >= warmup_until:
+                local[name][0].append(elapsed)
+                if not ok:
+                    local[name][1][0] += 1
+        with lock:
+            for name, (samples, errors) in local.items():
+                results[name][0].extend(samples)
+                results[name][1][0] += errors[0]
+
+    threads = [threading.Thread(target=worker, args=(i, client)) for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    operations = {name: summarize(samples, errors[0], args.duration) for name, (samples, errors) in results.items()}
+    total = summarize([s for samples, _ in results.values() for s in samples],
+                      sum(errors[0] for _, errors in results.values()), args.duration)
+    return operations, total
+
+
+def compare(result, baseline_path, threshold):
+    """Сравнивает p95 и пропускную способность с прошлым результатом; возвращает список деградаций"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, current in dict(result['operations'], total=result['total']).items():
+        before = baseline['operations'].get(name) if name != 'total' else baseline.get('total')
+        if not before or not current['requests'] or not before['requests']:
+            continue
+        if before['p95_ms'] and current['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f} -> {current['p95_ms']:.1f} мс")
+        if current['throughput'] < before['throughput'] * (1 - threshold):
+            regressions.append(f"{name}: {before['throughput']:.0f} -> {current['throughput']:.0f} запр/с")
+    return regressions
+
+
+def print_report(result):
+    print(f"сервер: {result['config']['server']}, хранилище: {result['config']['storage']}, "
+          f"пользователей: {result['config']['concurrency']}, {result['config']['duration']} с")
+    print(f"{'операция':>13} {'запросов':>9} {'ошибок':>7} {'запр/с':>8} {'p50':>8} {'p95':>8} {'p99':>8}  мс")
+    for name, row in dict(result['operations'], total=result['total']).items():
+        if not row['requests']:
+            print(f"{name:>13} {0:>9} {row['errors']:>7}")
+            continue
+        print(f"{name:>13} {row['requests']:>9} {row['errors']:>7} {row['throughput']:>8.1f} "
+              f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--carts', type=int, default=500)
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'waitress', 'werkzeug', 'uvicorn'), default='auto')
+    parser.add_argument('--workers', type=int, default=2, help='процессов Gunicorn и Uvicorn')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='потоков на процесс (Gunicorn, Waitress; у Uvicorn - пул чтения)')
+    parser.add_argument('--write-threads', type=int, default=2, help='пул записи ASGI (Uvicorn)')
+    parser.add_argument('--disk-latency', type=float, default=0, metavar='MS', help='задержка каждого fsync сервера')
+    parser.add_argument('--mix', type=parse_mix, default='shop',
+                        help=f"{', '.join(MIXES)} или веса: home=50,product=30,checkout=20")
+    parser.add_argument('--concurrency', type=int, default=8, help='виртуальных пользователей')
+    parser.add_argument('--duration', type=float, default=20.0, help='секунд замера')
+    parser.add_argument('--warmup', type=float, default=3.0, help='секунд прогрева без учета')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH', help="сохранить результат в JSON ('-' - в stdout)")
+    parser.add_argument('--compare', metavar='PATH', help='прошлый результат для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимая деградация (0.2 = 20%%)')
+    parser.add_argument('--keep', action='store_true', help='не удалять папку с данными')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+    if args.server == 'auto':
+        args.server = available_server()
+
+    workdir = tempfile.mkdtemp(prefix='kenzo-load-')
+    server = None
+    try:
+        started = time.perf_counter()
+        product_ids, usernames = seed(workdir, args)
+        seed_seconds = time.perf_counter() - started
+        port = free_port()
+        server = start_server(workdir, port, args)
+        operations, total = run_load(port, product_ids, usernames, args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if args.keep:
+            print(f"данные: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        'config': {
+            'server': args.server, 'storage': args.storage, 'workers': args.workers, 'threads': args.threads,
+            'write_threads': args.write_threads if args.server == 'uvicorn' else None,
+            'disk_latency_ms': args.disk_latency,
+            'concurrency': args.concurrency, 'duration': args.duration, 'warmup': args.warmup,
+            'mix': args.mix, 'seed': args.seed,
+            'data': {'products': len(product_ids), 'users': len(usernames), 'orders': args.orders,
+                     'carts': min(args.carts, len(usernames) + 1)},
+        },
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'seed_seconds': round(seed_seconds, 2),
+                        'timestamp': datetime.now().isoformat(timespec='seconds')},
+        'operations': operations,
+        'total': total,
+    }
+    if args.json == '-':
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(result)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            if json.load(f).get('config') != result['config']:
+                print('внимание: параметры прогона отличаются от сравниваемого', file=sys.stderr)
+        regressions = compare(result, args.compare, args.threshold)
+        for line in regressions:
+            print(f"деградация: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
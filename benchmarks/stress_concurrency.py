@@ -0,0 +1,82 @@
+"""Стресс-тест параллельных воркеров: не теряются ли изменения корзин и заказы.
+
+Несколько процессов одновременно работают с одной копией данных:
+- все добавляют товар в одну общую корзину (итог должен быть workers * adds);
+- каждый оформляет свои заказы (итог должен быть workers * orders).
+
+Запуск: python benchmarks/stress_concurrency.py [--workers 4] [--adds 50] [--orders 10] [--storage json]
+"""
+import argparse
+import multiprocessing
+import shutil
+import sys
+
+from _common import close_app, copy_data, load_app
+
+SHARED_CART = 'stress-shared'
+
+
+def worker(workdir, storage, number, adds, orders, barrier):
+    kenzo = load_app(workdir, KENZO_STORAGE=storage)
+
+    product_id = next(iter(kenzo.get_product_index().by_id))
+    shared = kenzo.app.test_client()
+    own = kenzo.app.test_client()
+    with shared.session_transaction() as sess:
+        sess['user_id'] = SHARED_CART
+    with own.session_transaction() as sess:
+        sess['user_id'] = f"stress-worker-{number}"
+
+    barrier.wait()
+    for i in range(max(adds, orders)):
+        if i < adds:
+            response = shared.post('/add_to_cart', data={'product_id': product_id},
+                                   headers={'X-Requested-With': 'XMLHttpRequest'})
+            assert response.status_code == 200, response.status_code
+        if i < orders:
+            own.post('/add_to_cart', data={'product_id': product_id})
+            response = own.post('/checkout', data={'name': f"Stress {number}", 'phone': '1'})
+            assert response.status_code == 302, response.status_code
+    # Процесс multiprocessing завершается без atexit - отложенные корзины дописываем сами
+    close_app(kenzo)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--adds', type=int, default=50)
+    parser.add_argument('--orders', type=int, default=10)
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    args = parser.parse_args()
+
+    workdir = copy_data('kenzo-stress-')
+
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.workers)
+    processes = [
+        ctx.Process(target=worker, args=(workdir, args.storage, n, args.adds, args.orders, barrier))
+        for n in range(args.workers)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    kenzo = load_app(workdir, KENZO_STORAGE=args.storage)
+
+    quantity = sum(item['quantity'] for item in kenzo.cart_store.get(SHARED_CART))
+    placed = sum(1 for order in kenzo.load_orders().values()
+                 if str(order.get('user_id', '')).startswith('stress-worker-'))
+    expected_quantity = args.workers * args.adds
+    expected_orders = args.workers * args.orders
+    print(f"shared cart quantity: {quantity} (expected {expected_quantity})")
+    print(f"orders placed:        {placed} (expected {expected_orders})")
+    failed = any(p.exitcode for p in processes) or quantity != expected_quantity or placed != expected_orders
+    close_app(kenzo)
+    shutil.rmtree(workdir, ignore_errors=True)
+    print("FAIL" if failed else "OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
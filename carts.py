@@ -0,0 +1,169 @@
+import copy
+import time
+import threading
+
+from storage import UNCHANGED
+
+# Префикс корзин неавторизованных посетителей
+ANONYMOUS_PREFIX = 'session_'
+
+
+def cart_items(record):
+    """Строки корзины из записи хранилища (старые записи - просто список строк)"""
+    if record is None:
+        return []
+    if isinstance(record, list):
+        return record
+    return record.get('items', [])
+
+
+def cart_item_matches(item, product_id, product_name):
+    """Строка корзины относится к товару (старые строки корзины хранят только название)"""
+    if product_id and item.get('product_id'):
+        return item['product_id'] == product_id
+    return item['name'] == product_name
+
+
+def cart_count(items):
+    """Количество единиц товара в корзине (для значка в шапке)"""
+    return sum(item['quantity'] for item in items)
+
+
+def add_item(items, product, quantity):
+    """Добавляет товар в строки корзины или увеличивает количество"""
+    for item in items:
+        if cart_item_matches(item, product.get('id'), product['name']):
+            item['product_id'] = product.get('id')
+            item['quantity'] += quantity
+            return items
+    items.append({
+        'product_id': product.get('id'),
+        'name': product['name'],
+        'quantity': quantity
+    })
+    return items
+
+
+def set_quantity(items, product_id, product_name, quantity):
+    """Задает количество товара в корзине"""
+    for item in items:
+        if cart_item_matches(item, product_id, product_name):
+            item['quantity'] = quantity
+            break
+    return items
+
+
+def remove_item(items, product_id, product_name):
+    """Убирает товар из корзины"""
+    return [item for item in items if not cart_item_matches(item, product_id, product_name)]
+
+
+def merge_items(target, source):
+    """Добавляет строки source в target, складывая количество одинаковых товаров"""
+    for item in source:
+        for existing in target:
+            if cart_item_matches(existing, item.get('product_id'), item['name']):
+                existing['quantity'] += item['quantity']
+                if item.get('product_id'):
+                    existing['product_id'] = item['product_id']
+                break
+        else:
+            target.append(dict(item))
+    return target
+
+
+class CartStore:
+    """Корзины в хранилище: создаются лениво, помнят время последнего изменения.
+
+    Пустые корзины не записываются вовсе, а брошенные анонимные корзины удаляются
+    по TTL и, если их больше max_anonymous, начиная с самых давно не изменявшихся.
+    """
+
+    def __init__(self, storage, anonymous_ttl=30 * 24 * 3600, max_anonymous=10000,
+                 evict_interval=3600.0):
+        self.storage = storage
+        self.anonymous_ttl = anonymous_ttl
+        self.max_anonymous = max_anonymous
+        self.evict_interval = evict_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get(self, cart_id):
+        """Строки корзины; отсутствующая корзина - пустой список без записи в хранилище"""
+        return cart_items(self.storage.get('carts', cart_id))
+
+    def update(self, cart_id, mutate):
+        """Изменяет корзину за одно чтение и не больше одной записи.
+
+        mutate получает список строк и возвращает новый список (или меняет переданный
+        и возвращает его же); если строки не изменились, запись пропускается.
+        Возвращает итоговые строки корзины.
+        """
+        result = []
+
+        def apply(record):
+            items = cart_items(record)
+            before = copy.deepcopy(items)
+            after = mutate(items)
+            result[:] = after
+            if after == before:
+                return UNCHANGED
+            if not after:
+                return None
+            return {'items': after, 'touched': time.time()}
+
+        self.storage.update('carts', cart_id, apply)
+        return result
+
+    def save(self, cart_id, items):
+        """Заменяет строки корзины; пустая корзина удаляется из хранилища"""
+        return self.update(cart_id, lambda _: list(items))
+
+    def merge(self, source_id, target_id):
+        """Переносит корзину source_id (анонимную) в target_id (пользователя).
+
+        Возвращает итоговые строки корзины target_id или None, если переносить нечего.
+        """
+        source = self.get(source_id)
+        if not source:
+            return None
+        items = self.update(target_id, lambda items: merge_items(items, source))
+        self.storage.delete('carts', source_id)
+        return items
+
+    def evict(self, now=None):
+        """Удаляет просроченные и лишние анонимные корзины; возвращает их число"""
+        now = time.time() if now is None else now
+        anonymous = []
+        for cart_id, record in self.storage.load_all('carts').items():
+            if not cart_id.startswith(ANONYMOUS_PREFIX):
+                continue
+            touched = record.get('touched', 0) if isinstance(record, dict) else 0
+            anonymous.append((touched, cart_id))
+        anonymous.sort(reverse=True)
+        expired = [cart_id for touched, cart_id in anonymous if now - touched > self.anonymous_ttl]
+        alive = [cart_id for touched, cart_id in anonymous if now - touched <= self.anonymous_ttl]
+        # Сверх лимита выбрасываем самые давно не изменявшиеся (LRU)
+        stale = expired + alive[self.max_anonymous:]
+        if stale:
+            self.storage.delete_many('carts', stale)
+        return len(stale)
+
+    def _evict_loop(self):
+        while not self._stop.wait(self.evict_interval):
+            try:
+                self.evict()
+            except (OSError, ValueError):
+                pass
+
+    def start(self):
+        """Запускает периодическую очистку анонимных корзин"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._evict_loop, name='carts-eviction', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,351 @@
+import gzip
+import time
+import hashlib
+import threading
+import uuid
+from collections import Counter, OrderedDict, namedtuple
+
+# Согласованное состояние кэша каталога: данные, версия в процессе, отпечаток
+# хранилища (одинаковый во всех процессах) и время изменения для Last-Modified
+CatalogSnapshot = namedtuple('CatalogSnapshot', 'products version stamp modified')
+
+# Готовый ответ API: тело JSON, ETag по содержимому и сжатое тело (None - не сжимаем)
+JSONPayload = namedtuple('JSONPayload', 'body etag gzipped')
+
+
+class CatalogCache:
+    """Кэш каталога в памяти процесса с инвалидацией по версии и отпечатку хранилища.
+
+    stamp - функция, возвращающая отпечаток данных (mtime/size файла или счетчик
+    версий в БД); по его изменению подхватываются записи из других процессов.
+    """
+
+    def __init__(self, loader, stamp):
+        self.loader = loader
+        self.stamp = stamp
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.modified = 0
+        self._data = None
+        self._stamp = None
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Возвращает разобранный каталог; перечитывает хранилище только если оно изменилось.
+
+        Результат общий для всех запросов - изменять его напрямую нельзя.
+        """
+        return self.snapshot().products
+
+    def snapshot(self):
+        """Каталог вместе с версией, отпечатком и временем изменения (CatalogSnapshot)"""
+        stamp = self.stamp()
+        with self._lock:
+            if self._data is not None and stamp == self._stamp:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._set(self.loader(), stamp)
+            return CatalogSnapshot(self._data, self.version, self._stamp, self.modified)
+
+    def _set(self, products, stamp):
+        self._data = products
+        self._stamp = stamp
+        self.version += 1
+        # Last-Modified с точностью до секунды: две смены каталога за одну секунду
+        # все равно должны дать разные значения
+        self.modified = max(int(time.time()), self.modified + 1)
+
+    def update(self, products, stamp):
+        """Кладет в кэш только что сохраненный каталог и увеличивает версию.
+
+        stamp - отпечаток, снятый под блокировкой записи: отпечаток, прочитанный позже,
+        мог бы уже принадлежать каталогу, сохраненному другим процессом.
+        """
+        with self._lock:
+            self._set(products, stamp)
+
+    def derived(self, name, build):
+        """Производные данные каталога (индексы и т.п.), пересчитываются только при его смене"""
+        products = self.get()
+        with self._lock:
+            entry = self._derived.get(name)
+            if entry is not None and entry[0] is products:
+                return entry[1]
+        value = build(products)
+        with self._lock:
+            self._derived[name] = (products, value)
+        return value
+
+    def invalidate(self):
+        """Сбрасывает кэш, следующий get() перечитает хранилище"""
+        with self._lock:
+            self._data = None
+            self._stamp = None
+
+    def stats(self):
+        """Счетчики кэша для мониторинга"""
+        with self._lock:
+            return {
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class FragmentCache:
+    """Ограниченный LRU кэш отрендеренных фрагментов страниц.
+
+    Ключ включает версию каталога, поэтому устаревшие фрагменты не инвалидируются
+    явно, а просто вытесняются новыми.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """Фрагмент по ключу; при промахе вызывает render() и запоминает результат"""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+        value = render()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+# Цены хранятся целым числом копеек (price_minor), в рублях показываются только при выводе
+MINOR_UNITS = 100
+
+
+def parse_price(price):
+    """Цена в копейках из строки старого формата каталога ("3.490" - 3490 рублей)"""
+    return int(str(price).replace('.', '')) * MINOR_UNITS
+
+
+def parse_price_input(raw):
+    """Цена в копейках из ввода администратора ("3490", "3 490 ₽", "3.490", "3490,50");
+    None, если в строке нет цифр.
+
+    Точка между тысячами - формат каталога, поэтому копейками считаются только одна-две
+    цифры после последнего разделителя.
+    """
+    text = str(raw).strip()
+    kopecks = 0
+    for separator in (',', '.'):
+        head, sep, tail = text.rpartition(separator)
+        if sep and tail.strip().isdigit() and len(tail.strip()) <= 2:
+            text, kopecks = head, int(tail.strip().ljust(2, '0'))
+            break
+    digits_only = ''.join(ch for ch in text if ch.isdigit())
+    if not digits_only:
+        return None
+    return int(digits_only) * MINOR_UNITS + kopecks
+
+
+def format_money(minor):
+    """Сумма в копейках для показа: 349000 -> 3.490, 349050 -> 3.490,50"""
+    rubles, kopecks = divmod(minor, MINOR_UNITS)
+    text = f"{rubles:,}".replace(',', '.')
+    return f"{text},{kopecks:02d}" if kopecks else text
+
+
+def replace_field(record, old, new, value):
+    """Заменяет поле записи на месте, сохраняя порядок полей (чтобы не перемешивать JSON-файлы)"""
+    fields = [(new, value) if key == old else (key, current) for key, current in record.items()]
+    record.clear()
+    record.update(fields)
+
+
+def migrate_product_prices(products):
+    """Переводит цены старого формата ("3.490") в копейки; возвращает True, если что-то изменилось"""
+    changed = False
+    for category_data in products.values():
+        for product in category_data['items']:
+            if 'price_minor' not in product:
+                replace_field(product, 'price', 'price_minor', parse_price(product['price']))
+                changed = True
+    return changed
+
+
+def name_key(name):
+    """Ключ названия для проверки дубликатов в категории (без регистра и крайних пробелов)"""
+    return name.strip().lower()
+
+
+def new_product_id(category_key, name, taken=()):
+    """Постоянный ID товара.
+
+    Выводится из категории и названия, поэтому разные процессы получают один и тот же
+    ID еще до сохранения миграции; при коллизии берется случайный.
+    """
+    product_id = hashlib.sha1(f"{category_key}/{name}".encode('utf-8')).hexdigest()[:12]
+    while product_id in taken:
+        product_id = uuid.uuid4().hex[:12]
+    return product_id
+
+
+def assign_product_ids(products):
+    """Проставляет ID товарам, у которых его нет; возвращает True, если что-то изменилось"""
+    taken = {item['id'] for category in products.values() for item in category['items'] if item.get('id')}
+    changed = False
+    for category_key, category_data in products.items():
+        for product in category_data['items']:
+            if not product.get('id'):
+                product['id'] = new_product_id(category_key, product['name'], taken)
+                taken.add(product['id'])
+                changed = True
+    return changed
+
+
+def image_refs(products):
+    """Счетчик ссылок на файлы изображений: одинаковые загрузки хранятся одним файлом"""
+    return Counter(
+        product['image']
+        for category_data in products.values()
+        for product in category_data['items']
+        if product.get('image')
+    )
+
+
+class ProductIndex:
+    """Индексы товаров по ID и по названию: значение - (категория, позиция, товар, цена в копейках).
+
+    При совпадении названий побеждает первый товар в порядке каталога.
+    """
+
+    def __init__(self, products):
+        self.by_id = {}
+        self.by_name = {}
+        for category_key, category_data in products.items():
+            for idx, product in enumerate(category_data['items']):
+                entry = (category_key, idx, product, product['price_minor'])
+                if product.get('id'):
+                    self.by_id[product['id']] = entry
+                if product['name'] not in self.by_name:
+                    self.by_name[product['name']] = entry
+        self.categories = products
+
+    def at(self, category_key, product_index):
+        """Товар по старой позиционной адресации (категория + индекс в списке)"""
+        category = self.categories.get(category_key)
+        if category is None or not 0 <= product_index < len(category['items']):
+            return None
+        product = category['items'][product_index]
+        if product.get('id'):
+            return self.by_id.get(product['id'])
+        return (category_key, product_index, product, product['price_minor'])
+
+    def for_cart_item(self, item):
+        """Товар для строки корзины: по product_id, а для старых корзин - по названию"""
+        if item.get('product_id'):
+            entry = self.by_id.get(item['product_id'])
+            if entry is not None:
+                return entry
+        return self.by_name.get(item['name'])
+
+
+def json_payload(body, compress=False):
+    """JSONPayload из сериализованного тела; gzip с mtime=0 одинаков во всех воркерах"""
+    etag = hashlib.sha1(body).hexdigest()[:20]
+    return JSONPayload(body, etag, gzip.compress(body, compresslevel=6, mtime=0) if compress else None)
+
+
+class CatalogJSON:
+    """Каталог, заранее сериализованный для API.
+
+    JSON каждого товара (payload - функция (entry, index) -> dict, как для модального
+    окна) сериализуется один раз на версию каталога; ответы /api/catalog (весь каталог
+    или категория) склеиваются из этих кусков и сжимаются gzip при первом запросе.
+    Запросы отдают готовые байты и ETag без сериализации и хеширования.
+    """
+
+    def __init__(self, index, payload, dumps):
+        self.index = index
+        self.dumps = dumps
+        self.products = {
+            product_id: json_payload(dumps(payload(entry, index)))
+            for product_id, entry in index.by_id.items()
+        }
+        self._bulk = {}
+        self._lock = threading.Lock()
+
+    @property
+    def categories(self):
+        return self.index.categories
+
+    def product(self, entry):
+        """Готовый JSON товара из индекса или None (товар без ID)"""
+        product_id = entry[2].get('id')
+        return self.products.get(product_id) if product_id else None
+
+    def bulk(self, category_key=None):
+        """Сжатый ответ с товарами всего каталога или одной категории"""
+        with self._lock:
+            payload = self._bulk.get(category_key)
+        if payload is None:
+            payload = json_payload(self._build_bulk(category_key), compress=True)
+            with self._lock:
+                self._bulk[category_key] = payload
+        return payload
+
+    def _build_bulk(self, category_key):
+        keys = [category_key] if category_key is not None else list(self.categories)
+        categories = []
+        ids = []
+        for key in keys:
+            category = self.categories[key]
+            category_ids = [item['id'] for item in category['items'] if item.get('id') in self.products]
+            categories.append({'key': key, 'name': category['name'], 'name_en': category['name_en'],
+                               'emoji': category['emoji'], 'products': category_ids})
+            ids.extend(category_ids)
+        # Товары не сериализуются заново: тело собирается из готовых кусков
+        products = b','.join(self.dumps(product_id) + b':' + self.products[product_id].body for product_id in ids)
+        return b'{"categories":' + self.dumps(categories) + b',"products":{' + products + b'}}'
+
+
+def build_product_index(products):
+    """Строит индекс товаров каталога"""
+    return ProductIndex(products)
+
+
+def price_cart(cart, index):
+    """Считает строки корзины и итоговую сумму в копейках; товары, которых нет в каталоге,
+    пропускаются. Цена берется из индекса уже числом - без разбора строк на каждый запрос"""
+    cart_items = []
+    total = 0
+    for item in cart:
+        entry = index.for_cart_item(item)
+        if entry is None:
+            continue
+        category_key, idx, product, price = entry
+        item_total = price * item['quantity']
+        total += item_total
+        cart_items.append({
+            'product_id': product.get('id', ''),
+            'name': product['name'],
+            'price_minor': price,
+            'quantity': item['quantity'],
+            'total_minor': item_total,
+            'image': product.get('image', ''),
+            'image_variants': product.get('image_variants', {}),
+            'category': category_key,
+            'index': idx
+        })
+    return cart_items, total
@@ -0,0 +1,177 @@
+import io
+import csv
+import json
+
+from catalog import format_money, name_key, new_product_id, parse_price_input
+
+# Колонки файла импорта/экспорта в порядке CSV. image только выгружается:
+# изображения загружаются отдельно, путь из файла при импорте не принимается
+FIELDS = ('id', 'category', 'name', 'price', 'description', 'specs', 'image')
+FORMATS = ('csv', 'jsonl')
+EXTENSIONS = {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}
+# В CSV характеристики - строки одной ячейки, как в форме редактирования товара
+SPECS_SEPARATOR = '\n'
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def detect_format(filename):
+    """Формат файла по расширению или None"""
+    if not filename or '.' not in filename:
+        return None
+    return EXTENSIONS.get(filename.rsplit('.', 1)[-1].lower())
+
+
+def _records(stream, fmt):
+    """Записи файла по одной: (номер строки, dict или None, ошибка или None)"""
+    # utf-8-sig: Excel сохраняет CSV с BOM
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(text)
+            for record in reader:
+                # У CSV номер строки - по последней строке записи (ячейки бывают многострочными)
+                yield reader.line_num, record, None
+        else:
+            for line_no, line in enumerate(text, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    yield line_no, None, 'Строка не является JSON'
+                    continue
+                if not isinstance(record, dict):
+                    yield line_no, None, 'Ожидается JSON-объект'
+                    continue
+                yield line_no, record, None
+    except UnicodeDecodeError:
+        yield None, None, 'Файл должен быть в кодировке UTF-8'
+    except csv.Error as exc:
+        yield None, None, f"Ошибка разбора CSV: {exc}"
+    finally:
+        # Поток принадлежит вызывающему - не даем обертке закрыть его
+        text.detach()
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def normalize_record(record):
+    """Поля товара из записи файла; ValueError с текстом ошибки для администратора"""
+    category = _text(record.get('category'))
+    name = _text(record.get('name'))
+    if not category:
+        raise ValueError('Не указана категория')
+    if not name:
+        raise ValueError('Не указано название товара')
+    price_minor = parse_price_input(_text(record.get('price')))
+    if price_minor is None:
+        raise ValueError('Неверный формат цены')
+    specs = record.get('specs') or []
+    if isinstance(specs, str):
+        specs = specs.split(SPECS_SEPARATOR)
+    elif not isinstance(specs, list):
+        raise ValueError('Характеристики должны быть строкой или списком')
+    return {
+        'id': _text(record.get('id')),
+        'category': category,
+        'name': name,
+        'price_minor': price_minor,
+        'description': _text(record.get('description')),
+        'specs': [_text(spec) for spec in specs if _text(spec)],
+    }
+
+
+def read_import(stream, fmt):
+    """Читает файл импорта потоком; возвращает (разобранные строки, ошибки).
+
+    Строки - [(номер строки, поля товара)], ошибки - [{'line', 'error'}]. Проверки,
+    которым нужен каталог (категория, дубликаты), делает apply_import.
+    """
+    rows, errors = [], []
+    for line_no, record, error in _records(stream, fmt):
+        if error is None:
+            try:
+                rows.append((line_no, normalize_record(record)))
+                continue
+            except ValueError as exc:
+                error = str(exc)
+        errors.append({'line': line_no, 'error': error})
+    return rows, errors
+
+
+def apply_import(products, rows):
+    """Добавляет разобранные строки в изменяемую копию каталога за один проход.
+
+    Дубликаты (та же категория и название без учета регистра - как в add_product)
+    ищутся по множеству ключей, поэтому импорт N товаров стоит O(N), а не O(N^2).
+    Возвращает (число добавленных, ошибки).
+    """
+    existing = {(key, name_key(item['name'])) for key, category in products.items() for item in category['items']}
+    taken = {item.get('id') for category in products.values() for item in category['items']}
+    added, errors = 0, []
+    for line_no, fields in rows:
+        category_key = fields['category']
+        if category_key not in products:
+            errors.append({'line': line_no, 'error': f"Категория {category_key!r} не найдена"})
+            continue
+        key = (category_key, name_key(fields['name']))
+        if key in existing:
+            errors.append({'line': line_no, 'error': 'Товар с таким названием уже существует в этой категории'})
+            continue
+        existing.add(key)
+        # ID из выгрузки сохраняем, чтобы ссылки на товар пережили перенос каталога
+        product_id = fields['id']
+        if not product_id or product_id in taken:
+            product_id = new_product_id(category_key, fields['name'], taken)
+        taken.add(product_id)
+        products[category_key]['items'].append({
+            'id': product_id,
+            'name': fields['name'],
+            'price_minor': fields['price_minor'],
+            'image': '',
+            'description': fields['description'],
+            'specs': fields['specs'],
+        })
+        added += 1
+    return added, errors
+
+
+def export_record(category_key, product):
+    return {
+        'id': product.get('id', ''),
+        'category': category_key,
+        'name': product['name'],
+        # Цена в том же виде, что видит администратор ("3.490"); импорт ее понимает
+        'price': format_money(product['price_minor']),
+        'description': product.get('description', ''),
+        'specs': product.get('specs', []),
+        'image': product.get('image', ''),
+    }
+
+
+def export_chunks(products, fmt):
+    """Выгрузка каталога по одному товару на кусок (для потокового ответа или файла)"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+
+        def flush():
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        writer.writeheader()
+        yield flush()
+        for category_key, category in products.items():
+            for product in category['items']:
+                record = export_record(category_key, product)
+                record['specs'] = SPECS_SEPARATOR.join(record['specs'])
+                writer.writerow(record)
+                yield flush()
+    else:
+        for category_key, category in products.items():
+            for product in category['items']:
+                yield json.dumps(export_record(category_key, product), ensure_ascii=False) + '\n'
@@ -0,0 +1,54 @@
+"""Быстрая сериализация JSON: orjson, если установлен, иначе стандартный json.
+
+Ответы те же, что у стандартного провайдера Flask (ключи отсортированы, даты в
+формате HTTP), только кириллица пишется как есть, а не \\uXXXX - ответ короче.
+"""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson не установлен: работает стандартный json
+    orjson = None
+
+if orjson is not None:
+    # Даты отдаем в default провайдера, чтобы формат не отличался от стандартного
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def dumps(obj):
+    """Компактный JSON в байтах UTF-8 (для заранее сериализованных ответов)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=ORJSON_OPTIONS)
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask (jsonify) на orjson; без orjson - стандартный"""
+
+    ensure_ascii = False
+
+    def _orjson(self, obj):
+        try:
+            return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # Чего orjson не умеет (целые числа больше 64 бит и т.п.) - стандартным json
+            return None
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            data = self._orjson(obj)
+            if data is not None:
+                return data.decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        # Отступы (отладка, compact=False) умеет только стандартный json
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        if orjson is None or pretty:
+            return super().response(*args, **kwargs)
+        data = self._orjson(self._prepare_response_obj(args, kwargs))
+        if data is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(data + b'\n', mimetype=self.mimetype)
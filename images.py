@@ -0,0 +1,301 @@
+import os
+import re
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow не установлен: варианты не строятся, отдаются оригиналы
+    Image = None
+
+log = logging.getLogger(__name__)
+
+# Варианты изображения товара: имя -> максимальная ширина в пикселях
+# (миниатюра для корзины, карточка каталога, модальное окно)
+VARIANTS = {'thumb': 240, 'card': 640, 'modal': 1280}
+# Форматы вариантов в порядке предпочтения; исходный файл остается запасным вариантом
+FORMATS = ('avif', 'webp')
+QUALITY = {'avif': 55, 'webp': 80}
+# Подкаталог для вариантов внутри каталога с оригиналами
+VARIANTS_DIR = 'variants'
+# Загрузки хранятся под хешем содержимого: <32 hex>.<расширение>
+CONTENT_NAME = re.compile(r'^[0-9a-f]{32}\.[a-z0-9]+$')
+CHUNK_SIZE = 64 * 1024
+
+
+def content_filename(digest, ext):
+    """Имя файла по хешу содержимого; jpeg и jpg считаются одним расширением"""
+    ext = ext.lower()
+    return f"{digest[:32]}.{'jpg' if ext == 'jpeg' else ext}"
+
+
+def file_digest(path):
+    """SHA-256 содержимого файла (hex)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Сигнатуры допустимых форматов: (смещение, байты, расширение)
+SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'jpg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'GIF87a', 'gif'),
+    (0, b'GIF89a', 'gif'),
+    (8, b'WEBP', 'webp'),
+)
+SNIFF_BYTES = 12
+
+
+def sniff_image(head):
+    """Расширение по первым байтам файла или None, если это не поддерживаемое изображение"""
+    if head[8:12] == b'WEBP' and head[:4] != b'RIFF':
+        return None
+    for offset, signature, ext in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return ext
+    return None
+
+
+class UploadSpool:
+    """Файл загрузки, который парсер форм пишет сразу на диск во временную папку
+    (spool_dir - вне static, чтобы недописанный файл нельзя было скачать).
+
+    По дороге считается хеш содержимого, после первых байтов проверяется сигнатура
+    формата, а превышение max_bytes или чужой формат обрывают разбор запроса
+    исключением - остаток тела запроса не читается и не пишется.
+    """
+
+    def __init__(self, spool_dir, max_bytes):
+        fd, self.path = tempfile.mkstemp(dir=spool_dir, prefix='.upload-', suffix='.tmp')
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.ext = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge()
+        if self.ext is None:
+            self._head += data[:SNIFF_BYTES - len(self._head)]
+            if len(self._head) >= SNIFF_BYTES:
+                self._sniff()
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def _sniff(self):
+        self.ext = sniff_image(self._head)
+        if self.ext is None:
+            raise UnsupportedMediaType()
+
+    def finish(self):
+        """Закрывает файл; возвращает (путь временного файла, hex хеша, расширение)"""
+        if self.ext is None:
+            self._sniff()  # файл короче SNIFF_BYTES
+        self._file.close()
+        return self.path, self._digest.hexdigest(), self.ext
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        """Закрывает файл и удаляет его, если он так и не был поставлен на место"""
+        self._file.close()
+        discard_upload(self.path)
+
+
+def place_upload(tmp_path, upload_dir, filename):
+    """Ставит временный файл на место; если такое содержимое уже есть, он не нужен"""
+    _move(tmp_path, os.path.join(upload_dir, filename))
+
+
+def discard_upload(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
+
+def available_formats():
+    """Форматы, которые умеет записывать установленный Pillow"""
+    if Image is None:
+        return ()
+    return tuple(fmt for fmt in FORMATS if features.check(fmt))
+
+
+def variant_path(image, name, fmt):
+    """Путь варианта относительно static: uploads/variants/<имя оригинала>-<вариант>.<формат>"""
+    directory, filename = os.path.split(image)
+    stem = os.path.splitext(filename)[0]
+    return '/'.join(part for part in (directory, VARIANTS_DIR, f"{stem}-{name}.{fmt}") if part)
+
+
+def _save(picture, path, fmt):
+    """Пишет вариант во временный файл и подменяет им целевой (без полузаписанных файлов)"""
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    picture.save(tmp_path, format=fmt.upper(), quality=QUALITY[fmt])
+    os.replace(tmp_path, path)
+
+
+def make_variants(static_dir, image, formats=None):
+    """Строит варианты изображения; возвращает {вариант: {'width', 'height', формат: путь}}.
+
+    Изображение никогда не увеличивается: если оригинал уже меньше варианта,
+    вариант получает размер оригинала, но все равно пересжимается.
+    """
+    formats = available_formats() if formats is None else formats
+    if not formats:
+        return {}
+    source = os.path.join(static_dir, image)
+    os.makedirs(os.path.dirname(os.path.join(static_dir, variant_path(image, 'thumb', formats[0]))),
+                exist_ok=True)
+    with Image.open(source) as original:
+        # Фото с телефонов часто повернуты только тегом EXIF
+        picture = ImageOps.exif_transpose(original)
+        picture = picture.convert('RGBA' if picture.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        variants = {}
+        for name, max_width in VARIANTS.items():
+            width = min(max_width, picture.width)
+            height = max(1, round(picture.height * width / picture.width))
+            resized = picture if width == picture.width else picture.resize((width, height), Image.LANCZOS)
+            entry = {'width': width, 'height': height}
+            for fmt in formats:
+                path = variant_path(image, name, fmt)
+                _save(resized, os.path.join(static_dir, path), fmt)
+                entry[fmt] = path
+            variants[name] = entry
+    return variants
+
+
+def remove_variants(static_dir, variants):
+    """Удаляет файлы вариантов изображения"""
+    for entry in (variants or {}).values():
+        for fmt in FORMATS:
+            if entry.get(fmt):
+                try:
+                    os.remove(os.path.join(static_dir, entry[fmt]))
+                except OSError:
+                    pass
+
+
+def _move(source, target):
+    """Переносит файл; если target уже есть (то же содержимое), source просто удаляется"""
+    if os.path.exists(target):
+        os.remove(source)
+    else:
+        os.replace(source, target)
+
+
+def rename_to_content(static_dir, image, variants):
+    """Переименовывает старую загрузку и ее варианты в имена по хешу содержимого.
+
+    Возвращает (новый путь изображения, новые варианты); дубликаты удаляются.
+    """
+    directory, filename = os.path.split(image)
+    new_name = content_filename(file_digest(os.path.join(static_dir, image)), filename.rsplit('.', 1)[-1])
+    new_image = '/'.join(part for part in (directory, new_name) if part)
+    new_variants = {}
+    for name, entry in (variants or {}).items():
+        new_entry = {'width': entry['width'], 'height': entry['height']}
+        for fmt in FORMATS:
+            if entry.get(fmt) and os.path.exists(os.path.join(static_dir, entry[fmt])):
+                new_entry[fmt] = variant_path(new_image, name, fmt)
+                _move(os.path.join(static_dir, entry[fmt]), os.path.join(static_dir, new_entry[fmt]))
+        new_variants[name] = new_entry
+    _move(os.path.join(static_dir, image), os.path.join(static_dir, new_image))
+    return new_image, new_variants
+
+
+def srcset_entries(variants, fmt):
+    """Пары (путь, ширина) для srcset в формате fmt, по возрастанию ширины без повторов"""
+    entries = {}
+    for entry in (variants or {}).values():
+        if entry.get(fmt):
+            entries.setdefault(entry['width'], entry[fmt])
+    return [(path, width) for width, path in sorted(entries.items())]
+
+
+class ImagePipeline:
+    """Фоновая обработка загруженных изображений в пуле потоков.
+
+    Запрос администратора только ставит задачу и сразу возвращается; on_done(image,
+    variants) вызывается из рабочего потока, когда варианты готовы. Pillow отпускает
+    GIL на масштабировании и кодировании, поэтому потоков здесь достаточно.
+    """
+
+    def __init__(self, static_dir, on_done, workers=2):
+        self.static_dir = static_dir
+        self.on_done = on_done
+        self.workers = workers
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(available_formats())
+
+    def _pool(self):
+        # Пул создается при первой задаче, чтобы не держать потоки в CLI-командах
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='images')
+            return self._executor
+
+    def _make(self, image):
+        try:
+            return make_variants(self.static_dir, image)
+        except Exception:
+            log.exception("Не удалось обработать изображение %s", image)
+            return None
+
+    def _process(self, image):
+        try:
+            variants = self._make(image)
+            if variants:
+                self.on_done(image, variants)
+            return variants
+        finally:
+            with self._lock:
+                self._pending.discard(image)
+
+    def submit(self, image):
+        """Ставит изображение в очередь (если оно еще не там); без Pillow ничего не делает"""
+        if not self.enabled:
+            return None
+        pool = self._pool()
+        with self._lock:
+            if image in self._pending:
+                return None
+            self._pending.add(image)
+        return pool.submit(self._process, image)
+
+    def process_many(self, images):
+        """Синхронно обрабатывает список изображений в пуле; возвращает {изображение: варианты}"""
+        if not self.enabled:
+            return {}
+        done = self._pool().map(self._make, images)
+        return {image: variants for image, variants in zip(images, done) if variants}
+
+    def close(self):
+        """Дожидается поставленных задач и останавливает пул"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import threading
+
+import metrics
+from storage import atomic_write_json, file_lock
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессной блокировки нет, работаем в одном процессе
+    fcntl = None
+
+# Политики fsync для журналов
+FSYNC_ALWAYS = 'always'      # fsync после каждого события
+FSYNC_INTERVAL = 'interval'  # не чаще одного раза в fsync_interval секунд
+FSYNC_NEVER = 'never'        # полагаемся на ОС
+
+
+class JSONJournal:
+    """Коллекция как снимок (обычный JSON-файл) + журнал событий (JSONL) только на дозапись.
+
+    Представление в памяти собирается из снимка и журнала, строки журнала,
+    дописанные другими процессами, подхватываются при чтении (_refresh). Компакция
+    переносит журнал в снимок. Подклассы задают _load (снимок -> представление),
+    _apply (событие -> представление) и _snapshot (представление -> снимок);
+    события должны быть идемпотентными.
+
+    write_behind - групповой коммит: событие сразу применяется к представлению (его
+    видят следующие чтения в этом процессе), а в журнал события пишутся пачкой раз в
+    flush_interval секунд или по flush_every штук - одна запись и один fsync на пачку.
+    Другие процессы видят события после записи пачки, поэтому так можно писать только
+    события, которым не нужна межпроцессная проверка в build (заказы, но не регистрации).
+    """
+
+    name = 'journal'
+
+    def __init__(self, snapshot_path, journal_path, fsync=FSYNC_INTERVAL,
+                 fsync_interval=1.0, compact_every=1000, compact_interval=60.0, compact_json=False,
+                 write_behind=False, flush_interval=0.2, flush_every=100):
+        self.snapshot_path = snapshot_path
+        self.compact_json = compact_json
+        self.journal_path = journal_path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self._buffer = []  # события, еще не записанные в журнал (write_behind)
+        self._offset = 0
+        self._journal_id = None
+        self._events = 0
+        self._last_fsync = 0.0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._flush_thread = None
+        self._rebuild()
+
+    # --- для подклассов ---
+
+    def _load(self, data):
+        raise NotImplementedError
+
+    def _apply(self, event):
+        raise NotImplementedError
+
+    def _snapshot(self):
+        raise NotImplementedError
+
+    # --- внутреннее ---
+
+    def _journal_identity(self):
+        try:
+            st = os.stat(self.journal_path)
+        except OSError:
+            return None, 0
+        return (st.st_dev, st.st_ino), st.st_size
+
+    def _rebuild(self):
+        """Полная сборка представления: снимок + весь журнал"""
+        data = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = metrics.load_json(f)
+        self._load(data)
+        self._offset = 0
+        self._events = 0
+        self._journal_id = None
+        self._read_tail()
+        # Незаписанные события этого процесса - поверх прочитанного с диска
+        for event in self._buffer:
+            self._apply(event)
+
+    def _read_tail(self):
+        """Применяет строки журнала, дописанные после последнего чтения"""
+        try:
+            f = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            journal_id = (st.st_dev, st.st_ino)
+            if self._journal_id is None:
+                self._journal_id = journal_id
+            elif journal_id != self._journal_id:
+                # Журнал заменен компакцией в другом процессе
+                f.close()
+                self._rebuild()
+                return
+            f.seek(self._offset)
+            metrics.count_read()
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # строка еще дописывается другим процессом
+                self._offset += len(line)
+                if line.strip():
+                    self._apply(metrics.parse_json(line))
+                    self._events += 1
+
+    def _refresh(self):
+        """Догоняет журнал; если его компактировал другой процесс - пересобирает представление"""
+        journal_id, size = self._journal_identity()
+        if journal_id != self._journal_id or size < self._offset:
+            self._rebuild()
+        elif size > self._offset:
+            self._read_tail()
+
+    def _open_journal(self):
+        """Открывает текущий журнал на дозапись под эксклюзивной блокировкой"""
+        while True:
+            f = open(self.journal_path, 'ab')
+            if fcntl is None:
+                return f
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            st = os.fstat(f.fileno())
+            current, _ = self._journal_identity()
+            if current == (st.st_dev, st.st_ino):
+                return f
+            # Пока ждали блокировку, журнал заменили - открываем новый
+            f.close()
+
+    def _commit(self, build):
+        """Записывает событие, построенное по актуальному состоянию.
+
+        build вызывается под блокировкой журнала после того, как догнали чужие
+        записи, и возвращает событие или None (записывать нечего). Так проверки
+        вида "имя еще свободно" атомарны и между процессами. Возвращает событие.
+        """
+        with self._lock:
+            if self.write_behind:
+                self._refresh()
+                event = build()
+                if event is not None:
+                    self._apply(event)
+                    self._buffer.append(event)
+                    if len(self._buffer) >= self.flush_every:
+                        self._wake.set()
+                return event
+            with self._open_journal() as f:
+                # Сначала догоняем чужие записи, чтобы смещение осталось согласованным
+                self._refresh()
+                event = build()
+                if event is None:
+                    return None
+                line = (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+                self._write(f, line)
+            self._offset += len(line)
+            self._apply(event)
+            self._events += 1
+            return event
+
+    def _append(self, event):
+        return self._commit(lambda: event)
+
+    def _write(self, f, data):
+        f.write(data)
+        f.flush()
+        metrics.count_write(len(data))
+        now = time.monotonic()
+        if self.fsync == FSYNC_ALWAYS or (
+                self.fsync == FSYNC_INTERVAL and now - self._last_fsync >= self.fsync_interval):
+            os.fsync(f.fileno())
+            self._last_fsync = now
+
+    def flush(self):
+        """Дописывает накопленные события (write_behind) одной записью; возвращает их число"""
+        with self._lock:
+            if not self._buffer:
+                return 0
+            with self._open_journal() as f:
+                self._refresh()
+                data = b''.join((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+                                for event in self._buffer)
+                self._write(f, data)
+            self._offset += len(data)
+            count = len(self._buffer)
+            self._events += count
+            self._buffer = []
+            return count
+
+    # --- обслуживание ---
+
+    def compact(self, force=False):
+        """Записывает представление в снимок и оставляет в журнале только новые события.
+
+        Снимок (долгая запись большого файла) пишется из копии представления без
+        блокировки журнала: чтение и запись в это время продолжаются, а события,
+        дописанные во время компакции, переносятся в новый журнал. Компакции разных
+        процессов не пересекаются благодаря блокировке на файле снимка.
+
+        force - переписать снимок, даже если журнал пуст (например, чтобы сохранить
+        записи, переведенные из старого формата при чтении).
+        """
+        self.flush()
+        if not force and not os.path.exists(self.journal_path):
+            return False
+        with file_lock(self.snapshot_path):
+            with self._lock:
+                self._refresh()
+                if self._offset == 0 and not force:
+                    return False
+                # Записи не меняются на месте (или меняются идемпотентными событиями),
+                # поэтому поверхностной копии достаточно
+                snapshot = dict(self._snapshot())
+                cut = self._offset
+            # События журнала идемпотентны, поэтому снимок новее журнала безопасен:
+            # повторное применение событий до cut даст то же состояние
+            atomic_write_json(self.snapshot_path, snapshot, self.compact_json)
+            with self._lock:
+                with self._open_journal():
+                    self._refresh()
+                    with open(self.journal_path, 'rb') as old:
+                        old.seek(cut)
+                        tail = old.read()
+                    tmp_journal = f"{self.journal_path}.tmp"
+                    with open(tmp_journal, 'wb') as new:
+                        new.write(tail)
+                        new.flush()
+                        os.fsync(new.fileno())
+                    os.replace(tmp_journal, self.journal_path)
+                self._offset = len(tail)
+                self._events = tail.count(b'\n')
+                self._journal_id, _ = self._journal_identity()
+            return True
+
+    def _compaction_loop(self):
+        last = time.monotonic()
+        while not self._stop.wait(1.0):
+            due = time.monotonic() - last >= self.compact_interval
+            if self._events >= self.compact_every or (due and self._events):
+                try:
+                    self.compact()
+                except OSError:
+                    pass
+                last = time.monotonic()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError:
+                pass  # события остались в буфере, повторим в следующий раз
+
+    def start(self):
+        """Запускает фоновую компакцию (и групповую запись при write_behind)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._compaction_loop, name=f"{self.name}-compaction",
+                                            daemon=True)
+            self._thread.start()
+        if self.write_behind and self._flush_thread is None:
+            self._flush_thread = threading.Thread(target=self._flush_loop, name=f"{self.name}-flush", daemon=True)
+            self._flush_thread.start()
+
+    def close(self):
+        """Останавливает фоновые потоки, дописывает накопленные события и сбрасывает журнал на диск"""
+        self._stop.set()
+        self._wake.set()
+        for thread in (self._thread, self._flush_thread):
+            if thread is not None:
+                thread.join()
+        self._thread = self._flush_thread = None
+        self.flush()
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'ab') as f:
+                os.fsync(f.fileno())
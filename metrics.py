@@ -0,0 +1,201 @@
+import json
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+# Счетчики текущего запроса. Хранилища вызывают count_read/count_write/parse_json
+# всегда; вне запроса (CLI, фоновые потоки) счетчиков нет и вызовы ничего не делают
+_current = ContextVar('kenzo_request_stats', default=None)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (0, 1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+# Гистограммы по маршрутам: имя -> (описание, границы корзин, поле RequestStats)
+HISTOGRAMS = (
+    ('kenzo_request_duration_seconds', 'Время обработки запроса', DURATION_BUCKETS, 'duration'),
+    ('kenzo_request_file_reads', 'Чтений хранилища за запрос', COUNT_BUCKETS, 'reads'),
+    ('kenzo_request_file_writes', 'Записей в хранилище за запрос', COUNT_BUCKETS, 'writes'),
+    ('kenzo_request_serialized_bytes', 'Байт JSON, записанных за запрос', BYTES_BUCKETS, 'bytes_written'),
+    ('kenzo_request_json_parse_seconds', 'Время разбора JSON из хранилища', DURATION_BUCKETS, 'json_seconds'),
+    ('kenzo_request_template_render_seconds', 'Время рендеринга шаблонов', DURATION_BUCKETS, 'render_seconds'),
+)
+
+
+class RequestStats:
+    """Счетчики одного запроса"""
+
+    __slots__ = ('started', 'duration', 'reads', 'writes', 'bytes_written', 'json_seconds',
+                 'render_seconds', '_render_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.reads = 0
+        self.writes = 0
+        self.bytes_written = 0
+        self.json_seconds = 0.0
+        self.render_seconds = 0.0
+        self._render_started = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def begin():
+    """Начинает учет запроса в текущем контексте; возвращает его счетчики"""
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+def current():
+    """Счетчики текущего запроса или None"""
+    return _current.get()
+
+
+def finish(stats):
+    """Заканчивает учет запроса: фиксирует длительность и отвязывает счетчики от контекста"""
+    stats.duration = stats.elapsed()
+    _current.set(None)
+    return stats
+
+
+def count_read():
+    stats = _current.get()
+    if stats is not None:
+        stats.reads += 1
+
+
+def count_write(nbytes=0):
+    """Одна запись в хранилище (замена файла, транзакция, строка журнала) размером nbytes"""
+    stats = _current.get()
+    if stats is not None:
+        stats.writes += 1
+        stats.bytes_written += nbytes
+
+
+def serialized(text):
+    """Учитывает размер сериализованного JSON (для записей из нескольких частей); возвращает text"""
+    stats = _current.get()
+    if stats is not None:
+        stats.bytes_written += len(text.encode('utf-8'))
+    return text
+
+
+def parse_json(text):
+    """json.loads с учетом времени разбора"""
+    stats = _current.get()
+    if stats is None:
+        return json.loads(text)
+    started = time.perf_counter()
+    try:
+        return json.loads(text)
+    finally:
+        stats.json_seconds += time.perf_counter() - started
+
+
+def load_json(f):
+    """Читает и разбирает JSON-файл целиком: одно чтение плюс время разбора"""
+    count_read()
+    return parse_json(f.read())
+
+
+def render_started():
+    stats = _current.get()
+    if stats is not None:
+        stats._render_started.append(time.perf_counter())
+
+
+def render_finished():
+    stats = _current.get()
+    if stats is not None and stats._render_started:
+        started = stats._render_started.pop()
+        # Вложенный шаблон уже входит во время внешнего
+        if not stats._render_started:
+            stats.render_seconds += time.perf_counter() - started
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(pairs):
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class MetricsRegistry:
+    """Гистограммы запросов по маршрутам и счетчик ответов в текстовом формате Prometheus.
+
+    Данные - в памяти процесса: при нескольких воркерах каждый отдает свои, а
+    Prometheus собирает их как отдельные цели (или суммирует по меткам).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (маршрут, метод) -> [Histogram по HISTOGRAMS]
+        self._responses = {}   # (маршрут, метод, статус) -> число ответов
+
+    def observe(self, route, method, status, stats):
+        key = (route, method)
+        with self._lock:
+            histograms = self._histograms.get(key)
+            if histograms is None:
+                histograms = self._histograms[key] = [Histogram(buckets) for _, _, buckets, _ in HISTOGRAMS]
+            for histogram, (_, _, _, field) in zip(histograms, HISTOGRAMS):
+                histogram.observe(getattr(stats, field))
+            response_key = (route, method, status)
+            self._responses[response_key] = self._responses.get(response_key, 0) + 1
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus 0.0.4"""
+        with self._lock:
+            snapshot = {key: [(h.buckets, list(h.counts), h.sum, h.count) for h in histograms]
+                        for key, histograms in self._histograms.items()}
+            responses = dict(self._responses)
+        lines = ['# HELP kenzo_responses_total Ответы по маршрутам и статусам',
+                 '# TYPE kenzo_responses_total counter']
+        for (route, method, status), count in sorted(responses.items()):
+            lines.append(f"kenzo_responses_total{_labels((('route', route), ('method', method), ('status', status)))} {count}")
+        for i, (name, description, _, _) in enumerate(HISTOGRAMS):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for (route, method), histograms in sorted(snapshot.items()):
+                buckets, counts, total, count = histograms[i]
+                base = (('route', route), ('method', method))
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(base + (('le', _format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(base + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_labels(base)} {_format_value(total)}")
+                lines.append(f"{name}_count{_labels(base)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+def server_timing(stats):
+    """Значение заголовка Server-Timing для счетчиков запроса (длительности в мс)"""
+    return ', '.join((
+        f"app;dur={stats.elapsed() * 1000:.2f}",
+        f"json;dur={stats.json_seconds * 1000:.2f}",
+        f"render;dur={stats.render_seconds * 1000:.2f}",
+        f'storage;desc="reads={stats.reads} writes={stats.writes} bytes={stats.bytes_written}"',
+    ))
@@ -0,0 +1,289 @@
+import json
+import base64
+import bisect
+
+from catalog import MINOR_UNITS, parse_price, replace_field
+from journal import JSONJournal
+from storage import UNCHANGED
+
+
+def order_key(order):
+    """Ключ сортировки заказа: дата создания, при равенстве - номер"""
+    return (order.get('created_at', ''), order['order_number'])
+
+
+def upgrade_order(order):
+    """Переводит суммы заказа старого формата (цена строкой, итоги в рублях) в копейки.
+
+    Меняет заказ на месте; возвращает True, если он был в старом формате.
+    """
+    if 'total_minor' in order:
+        return False
+    for item in order.get('items', []):
+        replace_field(item, 'price', 'price_minor', parse_price(item['price']))
+        replace_field(item, 'total', 'total_minor', item['total'] * MINOR_UNITS)
+    replace_field(order, 'total', 'total_minor', order['total'] * MINOR_UNITS)
+    return True
+
+
+def encode_cursor(key):
+    """Курсор страницы: непрозрачная строка из ключа последнего показанного заказа"""
+    raw = json.dumps(list(key), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Ключ из курсора или None, если курсор пустой или испорчен"""
+    if not cursor:
+        return None
+    try:
+        created_at, order_number = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    return (str(created_at), str(order_number))
+
+
+def date_bounds(date_from=None, date_to=None):
+    """Границы ключей для диапазона дат ГГГГ-ММ-ДД (обе включительно)"""
+    low = (date_from,) if date_from else None
+    high = (date_to + '\uffff',) if date_to else None
+    return low, high
+
+
+class OrderIndex:
+    """Вторичные индексы заказов: общая лента по дате и ленты по пользователям.
+
+    Ленты - отсортированные по возрастанию списки ключей order_key, новые заказы
+    почти всегда попадают в конец, поэтому вставка дешевая.
+    """
+
+    def __init__(self):
+        self.timeline = []
+        self.by_user = {}
+        self.by_status = {}
+
+    def rebuild(self, orders):
+        self.timeline = sorted(order_key(order) for order in orders.values())
+        self.by_user = {}
+        self.by_status = {}
+        for order in orders.values():
+            if order.get('user_id'):
+                self.by_user.setdefault(order['user_id'], []).append(order_key(order))
+            self.by_status.setdefault(order.get('status'), []).append(order_key(order))
+        for keys in self.by_user.values():
+            keys.sort()
+        for keys in self.by_status.values():
+            keys.sort()
+
+    def _insert(self, keys, key):
+        i = bisect.bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            keys.insert(i, key)
+
+    def add(self, order):
+        """Добавляет заказ в индексы (повторное добавление ничего не меняет)"""
+        key = order_key(order)
+        self._insert(self.timeline, key)
+        if order.get('user_id'):
+            self._insert(self.by_user.setdefault(order['user_id'], []), key)
+        self._insert(self.by_status.setdefault(order.get('status'), []), key)
+
+    def change_status(self, order, status):
+        """Переносит заказ в ленту нового статуса (вызывать до изменения самого заказа)"""
+        key = order_key(order)
+        old = self.by_status.get(order.get('status'), [])
+        i = bisect.bisect_left(old, key)
+        if i < len(old) and old[i] == key:
+            del old[i]
+        self._insert(self.by_status.setdefault(status, []), key)
+
+    def page(self, keys, before=None, date_from=None, date_to=None, limit=20, accept=None):
+        """Ключи из ленты от новых к старым: не больше limit штук строго раньше before.
+
+        Границы находятся бинарным поиском, поэтому стоимость страницы не зависит от
+        общего числа заказов; accept - дополнительный фильтр для коротких лент.
+        """
+        low, high = date_bounds(date_from, date_to)
+        hi = len(keys)
+        if before is not None:
+            hi = bisect.bisect_left(keys, before)
+        if high is not None:
+            hi = min(hi, bisect.bisect_left(keys, high))
+        lo = bisect.bisect_left(keys, low) if low is not None else 0
+        result = []
+        i = hi - 1
+        while i >= lo and len(result) < limit:
+            if accept is None or accept(keys[i]):
+                result.append(keys[i])
+            i -= 1
+        return result
+
+
+class StorageOrderStore:
+    """Заказы прямо в хранилище (для SQLite, где запись одной строки и так дешевая)"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get(self, order_number):
+        order = self.storage.get('orders', order_number)
+        if order is not None:
+            upgrade_order(order)
+        return order
+
+    def all(self):
+        orders = self.storage.load_all('orders')
+        for order in orders.values():
+            upgrade_order(order)
+        return orders
+
+    def create(self, order):
+        self.storage.put('orders', order['order_number'], order)
+
+    def set_status(self, order_number, status):
+        """Меняет статус за одно чтение-изменение-запись под блокировкой хранилища:
+        параллельные изменения заказа из других процессов не теряются"""
+        result = []
+
+        def apply(order):
+            if order is None:
+                return UNCHANGED
+            upgrade_order(order)
+            order['status'] = status
+            result[:] = [order]
+            return order
+
+        self.storage.update('orders', order_number, apply)
+        return result[0] if result else None
+
+    def page(self, user_id=None, status=None, date_from=None, date_to=None, before=None, limit=20):
+        rows = self.storage.query_orders(
+            user_id=user_id, status=status, date_from=date_from, date_to=date_to,
+            before=before, limit=limit + 1
+        )
+        next_key = order_key(rows[limit - 1][1]) if len(rows) > limit else None
+        for _, order in rows[:limit]:
+            upgrade_order(order)
+        return rows[:limit], next_key
+
+    def rewrite(self):
+        """Сохраняет заказы старого формата в текущем; возвращает число переписанных"""
+        count = 0
+        for order_number, order in self.storage.load_all('orders').items():
+            if upgrade_order(order):
+                self.storage.put('orders', order_number, order)
+                count += 1
+        return count
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class OrderJournal(JSONJournal):
+    """Заказы как журнал событий (JSONL) только на дозапись + представление в памяти.
+
+    Снимок - обычный orders_data.json, журнал хранит события после снимка. При запуске
+    представление собирается из снимка и журнала, новые строки журнала, дописанные
+    другими процессами, подхватываются при чтении. Компакция переносит журнал в снимок.
+    """
+
+    name = 'orders'
+
+    def __init__(self, snapshot_path, journal_path, **options):
+        self._orders = {}
+        self._index = OrderIndex()
+        self._legacy = 0
+        super().__init__(snapshot_path, journal_path, **options)
+
+    # --- чтение ---
+
+    def get(self, order_number):
+        """Заказ из представления (общий объект, только для чтения)"""
+        with self._lock:
+            self._refresh()
+            return self._orders.get(order_number)
+
+    def all(self):
+        """Все заказы из представления (общий словарь, только для чтения)"""
+        with self._lock:
+            self._refresh()
+            return self._orders
+
+    def page(self, user_id=None, status=None, date_from=None, date_to=None, before=None, limit=20):
+        """Страница заказов от новых к старым: ([(номер, заказ)], ключ для следующей страницы)"""
+        with self._lock:
+            self._refresh()
+            accept = None
+            if user_id is not None:
+                keys = self._index.by_user.get(user_id, [])
+                if status:
+                    accept = lambda key: self._orders[key[1]].get('status') == status
+            elif status:
+                keys = self._index.by_status.get(status, [])
+            else:
+                keys = self._index.timeline
+            found = self._index.page(keys, before, date_from, date_to, limit + 1, accept)
+            next_key = found[limit - 1] if len(found) > limit else None
+            return [(number, self._orders[number]) for _, number in found[:limit]], next_key
+
+    # --- запись ---
+
+    def create(self, order):
+        """Записывает событие создания заказа"""
+        self._append({'op': 'create', 'order': order})
+
+    def set_status(self, order_number, status):
+        """Записывает смену статуса; возвращает заказ или None, если его нет"""
+        def build():
+            if order_number not in self._orders:
+                return None
+            return {'op': 'status', 'order_number': order_number, 'status': status}
+
+        with self._lock:
+            if self._commit(build) is None:
+                return None
+            return self._orders[order_number]
+
+    # --- представление ---
+
+    def _load(self, orders):
+        self._legacy = sum(upgrade_order(order) for order in orders.values())
+        self._orders = orders
+        self._index.rebuild(orders)
+
+    def _apply(self, event):
+        if event['op'] == 'create':
+            order = event['order']
+            # События из журнала, записанные до перехода на копейки
+            if upgrade_order(order):
+                self._legacy += 1
+            self._orders[order['order_number']] = order
+            self._index.add(order)
+        elif event['op'] == 'status':
+            order = self._orders.get(event['order_number'])
+            if order is not None:
+                self._index.change_status(order, event['status'])
+                order['status'] = event['status']
+
+    def _snapshot(self):
+        return self._orders
+
+    def compact(self, force=False):
+        # Снимок пишется без блокировки представления (см. JSONJournal.compact)
+        compacted = super().compact(force)
+        if compacted:
+            with self._lock:
+                self._legacy = 0
+        return compacted
+
+    def rewrite(self):
+        """Сохраняет заказы старого формата в текущем; возвращает число переписанных"""
+        with self._lock:
+            self._refresh()
+            count = self._legacy
+        if count:
+            self.compact(force=True)
+        return count
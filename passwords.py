@@ -0,0 +1,157 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'scrypt'
+
+
+class HasherBusy(Exception):
+    """Очередь хеширования заполнена или ответ не пришел вовремя - запрос отклоняем"""
+
+
+def hash_method(password_hash):
+    """Метод с параметрами из хеша werkzeug: 'scrypt:32768:8:1$соль$хеш' -> 'scrypt:32768:8:1'"""
+    return password_hash.split('$', 1)[0]
+
+
+def full_method(method):
+    """Метод из настроек так, как werkzeug запишет его в хеш: 'scrypt' -> 'scrypt:32768:8:1'.
+
+    Параметры по умолчанию те же, что у generate_password_hash; неизвестный метод - ValueError.
+    """
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"неизвестный метод хеширования: {method}")
+
+
+# Задачи пула - функции модуля: процесс-исполнитель получает их по имени
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _verify(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher:
+    """Хеширование и проверка паролей в ограниченном пуле процессов.
+
+    scrypt намеренно дорогой (десятки мс процессора и 32 МБ памяти), поэтому при
+    всплеске входов он не должен занимать все ядра и потоки сервера: одновременно
+    считается не больше workers хешей, ждать в очереди может не больше max_pending
+    задач, а сверх того hash/verify сразу выбрасывают HasherBusy. workers=0 - считать
+    в потоке запроса (с тем же ограничением очереди), например в CLI и на платформах
+    без forkserver.
+
+    Процессы пула создаются через forkserver, а не fork: в сервере уже работают потоки
+    (пул запросов, write-behind, обработка изображений), и fork в момент, когда
+    какой-то из них держит блокировку (например, logging), оставил бы ее занятой в
+    дочернем процессе навсегда. Сервер процессов заранее загружает только этот модуль
+    с werkzeug. Как и при spawn, процесс пула импортирует __main__: под Gunicorn,
+    Waitress и Uvicorn это их запускающий скрипт, а при python app.py - app.py под
+    именем __mp_main__, и тогда app.py не создает хранилища и не запускает потоки
+    (init_stores).
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=2, max_pending=16, timeout=10.0):
+        self.method = method
+        # Метод с параметрами, как он записывается в хеш (для needs_rehash)
+        self._current_method = full_method(method)
+        self.workers = workers if 'forkserver' in multiprocessing.get_all_start_methods() else 0
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def capacity(self):
+        """Сколько задач может быть одновременно: считаются и ждут очереди"""
+        return max(self.workers, 1) + self.max_pending
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.capacity:
+                self.rejected += 1
+                raise HasherBusy()
+            self._pending += 1
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                self._release()
+        executor = self._pool()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._reset(executor)
+            raise HasherBusy()
+        # Место в очереди освобождается, когда задача досчитана, даже если запрос не дождался
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HasherBusy()
+        except BrokenProcessPool:
+            # Процесс пула убит (например, OOM) - следующий запрос создаст новый пул
+            self._reset(executor)
+            raise HasherBusy()
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def hash(self, password):
+        """Хеш пароля текущим методом"""
+        return self._run(_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(_verify, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Хеш посчитан другим методом или с другими параметрами, чем настроено сейчас"""
+        return hash_method(password_hash) != self._current_method
+
+    def stats(self):
+        return {
+            'method': self._current_method,
+            'workers': self.workers,
+            'pending': self._pending,
+            'capacity': self.capacity,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,147 @@
+import os
+import io
+import json
+import uuid
+import pstats
+import cProfile
+import threading
+from datetime import datetime
+
+from storage import atomic_write_json
+
+PROFILE_SUFFIX = '.prof'
+META_SUFFIX = '.json'
+TOP_FUNCTIONS = 10
+
+
+def start_profile():
+    """Включает cProfile в текущем потоке; None, если профилировщик уже занят.
+
+    С Python 3.12 одновременно может работать только один профилировщик на процесс,
+    поэтому параллельный профилируемый запрос просто пропускается.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+def _function_label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name  # встроенная функция: "<built-in method ...>"
+    # Последние два компонента пути: достаточно, чтобы отличить app.py от flask/app.py
+    short = '/'.join(filename.replace(os.sep, '/').rsplit('/', 2)[-2:])
+    return f"{short}:{line}({name})"
+
+
+def top_functions(stats, sort, limit=TOP_FUNCTIONS):
+    """Самые дорогие функции профиля: [{'function', 'calls', 'own_ms', 'total_ms'}]"""
+    index = {'own': 2, 'total': 3}[sort]
+    rows = sorted(stats.stats.items(), key=lambda row: row[1][index], reverse=True)[:limit]
+    return [
+        {
+            'function': _function_label(func),
+            'calls': calls,
+            'own_ms': round(own * 1000, 3),
+            'total_ms': round(total * 1000, 3),
+        }
+        for func, (_, calls, own, total, _) in rows
+    ]
+
+
+class ProfileStore:
+    """Профили запросов в папке с ограничением по размеру и числу файлов.
+
+    Каждый профиль - файл pstats (<имя>.prof, открывается snakeviz или
+    python -m pstats) и рядом <имя>.json с описанием запроса и самыми дорогими
+    функциями, чтобы список профилей не разбирал сами профили. При превышении
+    max_bytes или max_files удаляются самые старые.
+    """
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024, max_files=200):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def save(self, profiler, meta):
+        """Сохраняет остановленный профилировщик с описанием запроса; возвращает имя профиля"""
+        os.makedirs(self.directory, exist_ok=True)
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        # Время с микросекундами в начале имени - по нему профили сортируются по возрасту
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        name = f"{stamp}-{meta.get('endpoint') or 'unmatched'}-{uuid.uuid4().hex[:6]}"
+        meta = dict(
+            meta,
+            name=name,
+            calls=stats.total_calls,
+            top_own=top_functions(stats, 'own'),
+            top_total=top_functions(stats, 'total'),
+        )
+        stats.dump_stats(os.path.join(self.directory, name + PROFILE_SUFFIX))
+        # Описание пишем последним: профиль без описания в списке не появится
+        atomic_write_json(os.path.join(self.directory, name + META_SUFFIX), meta, compact=True)
+        self.rotate()
+        return name
+
+    def _entries(self):
+        """Профили от старых к новым: [(имя, суммарный размер файлов)]"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        sizes = {}
+        for filename in names:
+            stem, ext = os.path.splitext(filename)
+            if ext not in (PROFILE_SUFFIX, META_SUFFIX):
+                continue
+            try:
+                sizes[stem] = sizes.get(stem, 0) + os.path.getsize(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+        # Имя начинается с времени, поэтому сортировка по имени - по возрасту
+        return sorted(sizes.items())
+
+    def rotate(self):
+        """Удаляет самые старые профили сверх лимитов; возвращает их число"""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size in entries)
+            removed = 0
+            for name, size in entries:
+                if total <= self.max_bytes and len(entries) - removed <= self.max_files:
+                    break
+                self._remove(name)
+                total -= size
+                removed += 1
+            return removed
+
+    def _remove(self, name):
+        for suffix in (META_SUFFIX, PROFILE_SUFFIX):
+            try:
+                os.remove(os.path.join(self.directory, name + suffix))
+            except OSError:
+                pass
+
+    def recent(self, limit=50):
+        """Описания последних профилей, новые первыми"""
+        result = []
+        for name, _ in reversed(self._entries()):
+            if len(result) >= limit:
+                break
+            try:
+                with open(os.path.join(self.directory, name + META_SUFFIX), encoding='utf-8') as f:
+                    result.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # профиль еще пишется или удален ротацией
+        return result
+
+    def path(self, name):
+        """Путь к файлу профиля или None (имя проверяется - без выхода из папки)"""
+        if not name or name != os.path.basename(name) or name.startswith('.'):
+            return None
+        path = os.path.join(self.directory, name + PROFILE_SUFFIX)
+        return path if os.path.exists(path) else None
@@ -0,0 +1,41 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """Token bucket на каждый ключ (IP, имя пользователя): burst попыток сразу, дальше rate в секунду.
+
+    Корзины хранятся в памяти процесса, самые давно не использованные вытесняются
+    сверх max_keys (вытесненная корзина начинается заново полной - к этому времени
+    она обычно и так успела наполниться).
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # ключ -> (токены, время обновления)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def hit(self, key, now=None):
+        """Тратит токен ключа. 0, если попытка разрешена, иначе - через сколько секунд повторить"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                self.rejected += 1
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def stats(self):
+        return {'keys': len(self._buckets), 'rejected': self.rejected}
@@ -0,0 +1,248 @@
+import re
+import bisect
+import heapq
+import threading
+from collections import Counter
+from functools import lru_cache
+
+TOKEN = re.compile(r'[0-9a-zа-яё]+')
+
+# Транслитерация: термины хранятся латиницей, поэтому "наушники" и "naushniki",
+# "эйрподс" и "airpods" (через нечеткий поиск) находят одно и то же
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'c',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya',
+})
+
+# Запрос, набранный не в той раскладке: "фшкзщвы" -> "airpods" и обратно
+RU_KEYS = 'йцукенгшщзхъфывапролджэячсмитьбю'
+EN_KEYS = "qwertyuiop[]asdfghjkl;'zxcvbnm,."
+TO_EN_LAYOUT = str.maketrans(RU_KEYS + RU_KEYS.upper(), EN_KEYS + EN_KEYS.upper())
+TO_RU_LAYOUT = str.maketrans(EN_KEYS + EN_KEYS.upper(), RU_KEYS + RU_KEYS.upper())
+
+# Вес поля: совпадение в названии важнее, чем в описании
+FIELD_WEIGHTS = (('name', 3.0), ('category', 2.0), ('specs', 1.0), ('description', 1.0))
+PREFIX_MIN = 2       # автодополнение последнего слова - с двух символов
+PREFIX_LIMIT = 50    # сколько терминов берет одно автодополнение
+FUZZY_MIN = 4        # опечатки исправляем в словах от четырех символов
+FUZZY_LIMIT = 8      # сколько похожих терминов берем на одно слово
+FUZZY_SIMILARITY = 0.4
+PREFIX_FACTOR = 0.8
+FUZZY_FACTOR = 0.6
+
+
+@lru_cache(maxsize=65536)
+def normalize(token):
+    # Словарь каталога невелик, поэтому транслитерация слова почти всегда берется из кеша
+    return token.translate(TRANSLIT)
+
+
+def tokenize(text):
+    """Слова текста в нормальной форме: нижний регистр, латиница"""
+    return list(map(normalize, TOKEN.findall(text.lower())))
+
+
+def trigrams(term):
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def product_fields(category, product):
+    """Текстовые поля товара для индекса; они же - отпечаток для инкрементального обновления"""
+    return (
+        product['name'],
+        f"{category.get('name', '')} {category.get('name_en', '')}",
+        ' '.join(product.get('specs', [])),
+        product.get('description', ''),
+    )
+
+
+class SearchIndex:
+    """Инвертированный индекс товаров в памяти: термин -> {ID товара: вес}.
+
+    Поддерживает автодополнение последнего слова запроса (отсортированный словарь
+    терминов), исправление опечаток через триграммы терминов и неверную раскладку.
+    sync() сравнивает каталог с проиндексированным и переиндексирует только
+    изменившиеся товары, поэтому правка одного товара не перестраивает индекс.
+
+    Кроме словаря весов у каждого термина есть корзины "вес -> товары" в порядке
+    индексации: поиск идет от лучших корзин к худшим и останавливается, как только
+    оставшиеся товары уже не могут попасть в первые limit, - популярное слово не
+    заставляет пересчитывать десятки тысяч товаров.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.buckets = {}
+        self.terms = []
+        self.grams = {}
+        self._doc_terms = {}
+        self._doc_fields = {}
+        self._seq = {}
+        self._next_seq = 0
+        self._lock = threading.RLock()
+
+    # --- обновление ---
+
+    def add(self, doc_id, fields):
+        """Индексирует товар (повторный вызов заменяет старую версию)"""
+        with self._lock:
+            self.remove(doc_id)
+            weights = {}
+            for (_, weight), text in zip(FIELD_WEIGHTS, fields):
+                for term in set(tokenize(text)):
+                    weights[term] = weights.get(term, 0.0) + weight
+            for term, weight in weights.items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = {}
+                    self.buckets[term] = {}
+                    bisect.insort(self.terms, term)
+                    for gram in trigrams(term):
+                        self.grams.setdefault(gram, set()).add(term)
+                posting[doc_id] = weight
+                bucket = self.buckets[term].get(weight)
+                if bucket is None:
+                    bucket = self.buckets[term][weight] = {}
+                bucket[doc_id] = None
+            self._doc_terms[doc_id] = weights
+            self._doc_fields[doc_id] = fields
+            # При равной релевантности выше товар, проиндексированный раньше
+            self._seq[doc_id] = self._next_seq
+            self._next_seq += 1
+
+    def remove(self, doc_id):
+        """Убирает товар из индекса"""
+        with self._lock:
+            for term, weight in self._doc_terms.pop(doc_id, {}).items():
+                posting = self.postings[term]
+                del posting[doc_id]
+                buckets = self.buckets[term]
+                del buckets[weight][doc_id]
+                if not buckets[weight]:
+                    del buckets[weight]
+                if not posting:
+                    del self.postings[term]
+                    del self.buckets[term]
+                    del self.terms[bisect.bisect_left(self.terms, term)]
+                    for gram in trigrams(term):
+                        self.grams[gram].discard(term)
+            self._doc_fields.pop(doc_id, None)
+            self._seq.pop(doc_id, None)
+
+    def sync(self, products):
+        """Приводит индекс к каталогу, переиндексируя только изменившиеся товары; возвращает self"""
+        with self._lock:
+            seen = set()
+            for category in products.values():
+                for product in category['items']:
+                    doc_id = product.get('id')
+                    if not doc_id:
+                        continue
+                    seen.add(doc_id)
+                    fields = product_fields(category, product)
+                    if self._doc_fields.get(doc_id) != fields:
+                        self.add(doc_id, fields)
+            for doc_id in [doc_id for doc_id in self._doc_fields if doc_id not in seen]:
+                self.remove(doc_id)
+        return self
+
+    # --- поиск ---
+
+    def _expand(self, token, prefix):
+        """Термины для слова запроса: {термин: множитель веса}"""
+        found = {}
+        if token in self.postings:
+            found[token] = 1.0
+        if prefix and len(token) >= PREFIX_MIN:
+            start = bisect.bisect_left(self.terms, token)
+            for term in self.terms[start:start + PREFIX_LIMIT]:
+                if not term.startswith(token):
+                    break
+                found.setdefault(term, PREFIX_FACTOR)
+        if not found and len(token) >= FUZZY_MIN:
+            found = self._fuzzy(token)
+        return found
+
+    def _fuzzy(self, token):
+        """Похожие термины по доле общих триграмм (коэффициент Дайса)"""
+        grams = trigrams(token)
+        common = Counter()
+        for gram in grams:
+            common.update(self.grams.get(gram, ()))
+        similar = []
+        for term, shared in common.items():
+            # У термина с рамкой $...$ ровно len(term) триграмм
+            similarity = 2.0 * shared / (len(grams) + len(term))
+            if similarity >= FUZZY_SIMILARITY:
+                similar.append((similarity, term))
+        return {term: FUZZY_FACTOR * similarity for similarity, term in heapq.nlargest(FUZZY_LIMIT, similar)}
+
+    def _groups(self, terms):
+        """Корзины кандидатов одного слова: [(вес с множителем, товары)] от лучших к худшим"""
+        groups = [(weight * factor, docs) for term, factor in terms.items()
+                  for weight, docs in self.buckets[term].items()]
+        groups.sort(key=lambda group: group[0], reverse=True)
+        return groups
+
+    def _search(self, tokens, limit):
+        expanded = [self._expand(token, i == len(tokens) - 1) for i, token in enumerate(tokens)]
+        if not expanded or not all(expanded):
+            return []
+        # Кандидатов дает самое редкое слово, остальные только проверяем у них
+        expanded.sort(key=lambda terms: sum(len(self.postings[term]) for term in terms))
+        others = [[(self.postings[term], factor) for term, factor in terms.items()] for terms in expanded[1:]]
+        # Больше этого остальные слова добавить не могут
+        rest = sum(max(max(self.buckets[term]) * factor for term, factor in terms.items())
+                   for terms in expanded[1:])
+        seq = self._seq
+        top = []  # куча худших из лучших: (релевантность, -порядок, ID)
+        seen = set()
+        for score, docs in self._groups(expanded[0]):
+            bound = score + rest
+            if len(top) == limit and top[0][0] > bound:
+                break
+            for doc_id in docs:
+                if len(top) == limit and top[0][0] >= bound and -top[0][1] < seq[doc_id]:
+                    break  # дальше в корзине только товары с большим порядком
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                total = score
+                for postings in others:
+                    best = max(posting.get(doc_id, 0.0) * factor for posting, factor in postings)
+                    if not best:
+                        break
+                    total += best
+                else:
+                    item = (total, -seq[doc_id], doc_id)
+                    if len(top) < limit:
+                        heapq.heappush(top, item)
+                    elif item > top[0]:
+                        heapq.heapreplace(top, item)
+        return [(doc_id, total) for total, _, doc_id in sorted(top, reverse=True)]
+
+    def search(self, query, limit=20):
+        """Товары по запросу: [(ID товара, релевантность)] от лучших к худшим.
+
+        Все слова запроса должны найтись (последнее - как префикс); если ничего не
+        нашлось, запрос повторяется в другой раскладке клавиатуры.
+        """
+        with self._lock:
+            results = self._search(tokenize(query), limit)
+            if results:
+                return results
+            for layout in (TO_EN_LAYOUT, TO_RU_LAYOUT):
+                swapped = query.translate(layout)
+                if swapped != query:
+                    results = self._search(tokenize(swapped), limit)
+                    if results:
+                        return results
+            return []
+
+    def stats(self):
+        with self._lock:
+            return {'documents': len(self._doc_fields), 'terms': len(self.terms)}
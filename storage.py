@@ -0,0 +1,509 @@
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессной блокировки нет, работаем в одном процессе
+    fcntl = None
+
+# Коллекции "ключ -> запись", которые хранятся одинаково во всех бэкендах
+COLLECTIONS = ('users', 'carts', 'orders')
+
+# Результат функции для update(): запись не менялась, сохранять нечего
+UNCHANGED = object()
+
+
+def email_key(email):
+    """Email для поиска и проверки уникальности: без пробелов по краям и без учета регистра"""
+    return (email or '').strip().lower()
+
+
+def dump_json(data, f, compact=False):
+    """Пишет JSON в файл: с отступами для чтения глазами или компактно"""
+    if compact:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    else:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def atomic_write_json(path, data, compact=False):
+    """Атомарная запись JSON: временный файл рядом, fsync, затем os.replace.
+
+    Читатель всегда видит либо старый, либо новый файл целиком, а сбой посреди
+    записи оставляет на месте прежнюю версию.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            dump_json(data, f, compact)
+            f.flush()
+            metrics.count_write(f.tell())
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if hasattr(os, 'O_DIRECTORY'):
+        # Фиксируем на диске и саму замену файла в каталоге
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+@contextmanager
+def file_lock(path):
+    """Эксклюзивная межпроцессная блокировка на файле path + '.lock'"""
+    with open(f"{path}.lock", 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class JSONStorage:
+    """Хранилище в JSON файлах: каждая коллекция - отдельный файл целиком.
+
+    Запись атомарная, а циклы чтение-изменение-запись выполняются под межпроцессной
+    блокировкой, поэтому параллельные воркеры не теряют изменения друг друга.
+    """
+
+    def __init__(self, products_file, files, compact=False):
+        self.products_file = products_file
+        self.files = files
+        self.compact = compact
+
+    def _read(self, path):
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return metrics.load_json(f)
+        return None
+
+    def _write(self, path, data):
+        atomic_write_json(path, data, self.compact)
+
+    def _load(self, collection):
+        data = self._read(self.files[collection])
+        return data if data is not None else {}
+
+    def load_all(self, collection):
+        """Все записи коллекции в виде словаря"""
+        return self._load(collection)
+
+    def save_all(self, collection, data):
+        """Полностью перезаписывает коллекцию"""
+        with file_lock(self.files[collection]):
+            self._write(self.files[collection], data)
+
+    def get(self, collection, key, default=None):
+        """Одна запись по ключу"""
+        return self._load(collection).get(key, default)
+
+    def put(self, collection, key, value):
+        """Сохраняет одну запись (для JSON - перезапись всего файла)"""
+        with file_lock(self.files[collection]):
+            data = self._load(collection)
+            data[key] = value
+            self._write(self.files[collection], data)
+
+    def delete(self, collection, key):
+        """Удаляет одну запись"""
+        with file_lock(self.files[collection]):
+            data = self._load(collection)
+            if key in data:
+                del data[key]
+                self._write(self.files[collection], data)
+
+    def update(self, collection, key, fn):
+        """Чтение-изменение-запись одной записи: fn(текущая или None) -> новая, None (удалить)
+        или UNCHANGED. Файл читается один раз и записывается не больше одного раза."""
+        with file_lock(self.files[collection]):
+            data = self._load(collection)
+            value = fn(data.get(key))
+            if value is UNCHANGED:
+                return
+            if value is None:
+                if data.pop(key, None) is None:
+                    return
+            else:
+                data[key] = value
+            self._write(self.files[collection], data)
+
+    def update_many(self, collection, fns):
+        """update() для нескольких записей сразу: {ключ: fn}. Одна блокировка, одно чтение и
+        не больше одной перезаписи файла на всю группу."""
+        with file_lock(self.files[collection]):
+            data = self._load(collection)
+            changed = False
+            for key, fn in fns.items():
+                value = fn(data.get(key))
+                if value is UNCHANGED:
+                    continue
+                if value is None:
+                    if data.pop(key, None) is None:
+                        continue
+                else:
+                    data[key] = value
+                changed = True
+            if changed:
+                self._write(self.files[collection], data)
+
+    def delete_many(self, collection, keys):
+        """Удаляет несколько записей за одну перезапись файла"""
+        with file_lock(self.files[collection]):
+            data = self._load(collection)
+            removed = [key for key in keys if data.pop(key, None) is not None]
+            if removed:
+                self._write(self.files[collection], data)
+
+    def load_products(self):
+        """Каталог целиком или None, если он еще не сохранялся"""
+        return self._read(self.products_file)
+
+    def save_products(self, products):
+        """Сохраняет каталог целиком"""
+        with file_lock(self.products_file):
+            self._write(self.products_file, products)
+
+    def update_products(self, fn):
+        """Чтение-изменение-запись каталога под блокировкой: fn(каталог или None) -> новый
+        каталог или UNCHANGED. Возвращает (результат fn, отпечаток после записи) - отпечаток
+        снят под той же блокировкой и соответствует именно этому каталогу."""
+        with file_lock(self.products_file):
+            products = fn(self._read(self.products_file))
+            if products is not UNCHANGED:
+                self._write(self.products_file, products)
+            return products, self.products_stamp()
+
+    def products_stamp(self):
+        """Отпечаток каталога: меняется при любой записи, в том числе из других процессов"""
+        try:
+            st = os.stat(self.products_file)
+        except OSError:
+            return None
+        # Атомарная запись подменяет файл, поэтому меняется и inode
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class SQLiteStorage:
+    """Хранилище в SQLite (режим WAL): каждая запись - отдельная строка"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            # Схема создается и дополняется под блокировкой записи: воркеры, одновременно
+            # открывшие новую БД, иначе оба добавили бы столбцы (duplicate column name)
+            conn.execute("BEGIN IMMEDIATE")
+            for collection in COLLECTIONS:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {collection} "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS categories ("
+                "key TEXT PRIMARY KEY, position INTEGER NOT NULL, "
+                "emoji TEXT, name TEXT, name_en TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                "category_key TEXT NOT NULL, position INTEGER NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (category_key, position))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            # Вторичные индексы заказов: по пользователю и по дате создания
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(orders)")}
+            added = False
+            for column, ddl in (('user_id', "TEXT"),
+                                ('created_at', "TEXT NOT NULL DEFAULT ''"),
+                                ('status', "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE orders ADD COLUMN {column} {ddl}")
+                    added = True
+            if added:
+                conn.execute(
+                    "UPDATE orders SET user_id = json_extract(value, '$.user_id'), "
+                    "created_at = COALESCE(json_extract(value, '$.created_at'), ''), "
+                    "status = json_extract(value, '$.status')"
+                )
+            conn.execute("CREATE INDEX IF NOT EXISTS orders_by_user ON orders (user_id, created_at, key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS orders_by_date ON orders (created_at, key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS orders_by_status ON orders (status, created_at, key)")
+            # Индекс пользователей по email (нормализованному email_key). Не UNIQUE: в старых
+            # данных дубликаты возможны, уникальность новых проверяет create_user
+            if 'email' not in {row[1] for row in conn.execute("PRAGMA table_info(users)")}:
+                conn.execute("ALTER TABLE users ADD COLUMN email TEXT")
+                conn.executemany(
+                    "UPDATE users SET email = ? WHERE key = ?",
+                    [(email_key(json.loads(value).get('email')), key)
+                     for key, value in conn.execute("SELECT key, value FROM users").fetchall()]
+                )
+            conn.execute("CREATE INDEX IF NOT EXISTS users_by_email ON users (email)")
+
+    def _conn(self):
+        """Отдельное соединение на каждый поток"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _check(self, collection):
+        if collection not in COLLECTIONS:
+            raise ValueError(f"Неизвестная коллекция: {collection}")
+
+    def _insert_sql(self, collection):
+        if collection == 'orders':
+            return ("INSERT OR REPLACE INTO orders (key, value, user_id, created_at, status) "
+                    "VALUES (?, ?, ?, ?, ?)")
+        if collection == 'users':
+            return "INSERT OR REPLACE INTO users (key, value, email) VALUES (?, ?, ?)"
+        return f"INSERT OR REPLACE INTO {collection} (key, value) VALUES (?, ?)"
+
+    def _row(self, collection, key, value):
+        row = (key, metrics.serialized(json.dumps(value, ensure_ascii=False)))
+        if collection == 'orders':
+            row += (value.get('user_id'), value.get('created_at', ''), value.get('status'))
+        elif collection == 'users':
+            row += (email_key(value.get('email')),)
+        return row
+
+    def load_all(self, collection):
+        self._check(collection)
+        rows = self._conn().execute(f"SELECT key, value FROM {collection}")
+        metrics.count_read()
+        return {key: metrics.parse_json(value) for key, value in rows}
+
+    def save_all(self, collection, data):
+        self._check(collection)
+        conn = self._conn()
+        with conn:
+            conn.execute(f"DELETE FROM {collection}")
+            conn.executemany(
+                self._insert_sql(collection),
+                (self._row(collection, key, value) for key, value in data.items())
+            )
+            metrics.count_write()
+
+    def get(self, collection, key, default=None):
+        self._check(collection)
+        row = self._conn().execute(
+            f"SELECT value FROM {collection} WHERE key = ?", (key,)
+        ).fetchone()
+        metrics.count_read()
+        return metrics.parse_json(row[0]) if row else default
+
+    def put(self, collection, key, value):
+        self._check(collection)
+        conn = self._conn()
+        with conn:
+            conn.execute(self._insert_sql(collection), self._row(collection, key, value))
+            metrics.count_write()
+
+    def delete(self, collection, key):
+        self._check(collection)
+        conn = self._conn()
+        with conn:
+            conn.execute(f"DELETE FROM {collection} WHERE key = ?", (key,))
+            metrics.count_write()
+
+    def update(self, collection, key, fn):
+        self._check(collection)
+        conn = self._conn()
+        with conn:
+            # BEGIN IMMEDIATE сразу берет блокировку на запись: параллельные
+            # изменения той же записи из других процессов не потеряются
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(f"SELECT value FROM {collection} WHERE key = ?", (key,)).fetchone()
+            metrics.count_read()
+            value = fn(metrics.parse_json(row[0]) if row else None)
+            if value is UNCHANGED:
+                return
+            if value is None:
+                conn.execute(f"DELETE FROM {collection} WHERE key = ?", (key,))
+            else:
+                conn.execute(self._insert_sql(collection), self._row(collection, key, value))
+            metrics.count_write()
+
+    def update_many(self, collection, fns):
+        self._check(collection)
+        conn = self._conn()
+        with conn:
+            # Вся группа - одна транзакция: один коммит и одна синхронизация WAL
+            conn.execute("BEGIN IMMEDIATE")
+            for key, fn in fns.items():
+                row = conn.execute(f"SELECT value FROM {collection} WHERE key = ?", (key,)).fetchone()
+                metrics.count_read()
+                value = fn(metrics.parse_json(row[0]) if row else None)
+                if value is UNCHANGED:
+                    continue
+                if value is None:
+                    conn.execute(f"DELETE FROM {collection} WHERE key = ?", (key,))
+                else:
+                    conn.execute(self._insert_sql(collection), self._row(collection, key, value))
+            metrics.count_write()
+
+    def delete_many(self, collection, keys):
+        self._check(collection)
+        conn = self._conn()
+        with conn:
+            conn.executemany(f"DELETE FROM {collection} WHERE key = ?", ((key,) for key in keys))
+            metrics.count_write()
+
+    def query_orders(self, user_id=None, status=None, date_from=None, date_to=None,
+                     before=None, limit=None):
+        """Заказы от новых к старым по индексам (keyset: строго раньше before): [(номер, заказ)]"""
+        where = []
+        params = []
+        if user_id is not None:
+            where.append("user_id = ?")
+            params.append(user_id)
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if date_from:
+            where.append("created_at >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("created_at < ?")
+            params.append(date_to + '\uffff')
+        if before is not None:
+            where.append("(created_at, key) < (?, ?)")
+            params += list(before)
+        sql = "SELECT key, value FROM orders"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, key DESC LIMIT ?"
+        params.append(-1 if limit is None else limit)
+        rows = self._conn().execute(sql, params)
+        metrics.count_read()
+        return [(key, metrics.parse_json(value)) for key, value in rows]
+
+    def find_user_by_email(self, email):
+        """Пользователь по email через индекс: (имя, запись) или None"""
+        row = self._conn().execute(
+            "SELECT key, value FROM users WHERE email = ? LIMIT 1", (email_key(email),)
+        ).fetchone()
+        metrics.count_read()
+        return (row[0], metrics.parse_json(row[1])) if row else None
+
+    def create_user(self, username, user):
+        """Добавляет пользователя, если имя и email свободны.
+
+        Проверка и вставка - в одной транзакции BEGIN IMMEDIATE, поэтому параллельные
+        регистрации из разных процессов не создадут дубликат. Возвращает None или
+        то, что уже занято: 'username' или 'email'.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            metrics.count_read()
+            if conn.execute("SELECT 1 FROM users WHERE key = ?", (username,)).fetchone():
+                return 'username'
+            if conn.execute("SELECT 1 FROM users WHERE email = ? LIMIT 1",
+                            (email_key(user.get('email')),)).fetchone():
+                return 'email'
+            conn.execute(self._insert_sql('users'), self._row('users', username, user))
+            metrics.count_write()
+            return None
+
+    def load_products(self):
+        conn = self._conn()
+        categories = conn.execute(
+            "SELECT key, emoji, name, name_en FROM categories ORDER BY position"
+        ).fetchall()
+        metrics.count_read()
+        if not categories:
+            return None
+        products = {}
+        for key, emoji, name, name_en in categories:
+            products[key] = {"emoji": emoji, "name": name, "name_en": name_en, "items": []}
+        rows = conn.execute(
+            "SELECT category_key, value FROM products ORDER BY category_key, position"
+        )
+        for category_key, value in rows:
+            if category_key in products:
+                products[category_key]['items'].append(metrics.parse_json(value))
+        return products
+
+    def save_products(self, products):
+        conn = self._conn()
+        with conn:
+            self._write_products(conn, products)
+
+    def update_products(self, fn):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            products = fn(self.load_products())
+            if products is not UNCHANGED:
+                self._write_products(conn, products)
+            # Версия читается в той же транзакции: другой процесс не успеет ее сменить
+            return products, self.products_stamp()
+
+    def _write_products(self, conn, products):
+        conn.execute("DELETE FROM categories")
+        conn.execute("DELETE FROM products")
+        for position, (key, category) in enumerate(products.items()):
+            conn.execute(
+                "INSERT INTO categories (key, position, emoji, name, name_en) VALUES (?, ?, ?, ?, ?)",
+                (key, position, category.get('emoji'), category.get('name'), category.get('name_en'))
+            )
+            conn.executemany(
+                "INSERT INTO products (category_key, position, value) VALUES (?, ?, ?)",
+                ((key, idx, metrics.serialized(json.dumps(item, ensure_ascii=False)))
+                 for idx, item in enumerate(category.get('items', [])))
+            )
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('products_version', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+        metrics.count_write()
+
+    def products_stamp(self):
+        row = self._conn().execute(
+            "SELECT value FROM meta WHERE key = 'products_version'"
+        ).fetchone()
+        return row[0] if row else None
+
+
+def create_storage(backend, products_file, files, sqlite_path, compact=False):
+    """Создает хранилище по имени бэкенда ('json' или 'sqlite')"""
+    if backend == 'json':
+        return JSONStorage(products_file, files, compact)
+    if backend == 'sqlite':
+        return SQLiteStorage(sqlite_path)
+    raise ValueError(f"Неизвестный бэкенд хранилища: {backend}")
+
+
+def migrate(source, target):
+    """Переносит все данные из одного хранилища в другое, возвращает число записей"""
+    counts = {}
+    products = source.load_products()
+    if products is not None:
+        target.save_products(products)
+        counts['products'] = sum(len(c.get('items', [])) for c in products.values())
+    for collection in COLLECTIONS:
+        data = source.load_all(collection)
+        target.save_all(collection, data)
+        counts[collection] = len(data)
+    return counts
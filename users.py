@@ -0,0 +1,168 @@
+import copy
+
+from journal import JSONJournal
+from storage import UNCHANGED, email_key
+
+# Ответы create() и conflict(): что уже занято
+USERNAME_TAKEN = 'username'
+EMAIL_TAKEN = 'email'
+
+
+class UserJournal(JSONJournal):
+    """Пользователи в памяти с индексами по имени и email; изменения - в журнал.
+
+    Снимок - обычный users_data.json ({имя: запись}), журнал хранит записи
+    пользователей целиком (событие put), поэтому регистрация дописывает одну строку,
+    а не переписывает файл со всеми пользователями. Поиск по имени и по email и
+    проверка дубликатов - обращения к словарям, без чтения файла.
+    """
+
+    name = 'users'
+
+    def __init__(self, snapshot_path, journal_path, **options):
+        self._users = {}
+        self._by_email = {}
+        super().__init__(snapshot_path, journal_path, **options)
+
+    # --- чтение ---
+
+    def get(self, username):
+        """Запись пользователя (общий объект, только для чтения) или None"""
+        with self._lock:
+            self._refresh()
+            return self._users.get(username)
+
+    def find_by_email(self, email):
+        """(имя, запись) пользователя с этим email без учета регистра или None"""
+        with self._lock:
+            self._refresh()
+            username = self._by_email.get(email_key(email))
+            return (username, self._users[username]) if username is not None else None
+
+    def conflict(self, username, email):
+        """Что уже занято: USERNAME_TAKEN, EMAIL_TAKEN или None"""
+        with self._lock:
+            self._refresh()
+            return self._conflict(username, email)
+
+    def all(self):
+        """Все пользователи (общий словарь, только для чтения)"""
+        with self._lock:
+            self._refresh()
+            return self._users
+
+    # --- запись ---
+
+    def create(self, username, user):
+        """Добавляет пользователя, если имя и email свободны; иначе возвращает, что занято.
+
+        Проверка выполняется под блокировкой журнала по актуальному состоянию, поэтому
+        параллельные регистрации (в том числе из других процессов) дубликат не создадут.
+        """
+        conflict = []
+
+        def build():
+            conflict.append(self._conflict(username, user.get('email')))
+            if conflict[0] is not None:
+                return None
+            return {'op': 'put', 'username': username, 'user': user}
+
+        self._commit(build)
+        return conflict[0]
+
+    def update(self, username, fn):
+        """Изменяет запись пользователя: fn получает копию и возвращает новую запись или UNCHANGED.
+
+        Возвращает итоговую запись или None, если пользователя нет.
+        """
+        result = []
+
+        def build():
+            user = self._users.get(username)
+            if user is None:
+                return None
+            updated = fn(copy.deepcopy(user))
+            if updated is UNCHANGED:
+                result.append(user)
+                return None
+            return {'op': 'put', 'username': username, 'user': updated}
+
+        event = self._commit(build)
+        if event is not None:
+            return event['user']
+        return result[0] if result else None
+
+    # --- представление ---
+
+    def _conflict(self, username, email):
+        if username in self._users:
+            return USERNAME_TAKEN
+        if email_key(email) in self._by_email:
+            return EMAIL_TAKEN
+        return None
+
+    def _index(self, username, user):
+        # При дубликатах email в старых данных индекс указывает на первого пользователя
+        self._by_email.setdefault(email_key(user.get('email')), username)
+
+    def _load(self, users):
+        self._users = users
+        self._by_email = {}
+        for username, user in users.items():
+            self._index(username, user)
+
+    def _apply(self, event):
+        username = event['username']
+        previous = self._users.get(username)
+        if previous is not None and self._by_email.get(email_key(previous.get('email'))) == username:
+            del self._by_email[email_key(previous.get('email'))]
+        self._users[username] = event['user']
+        self._index(username, event['user'])
+
+    def _snapshot(self):
+        return self._users
+
+
+class StorageUserStore:
+    """Пользователи прямо в SQLite: поиск по первичному ключу и индексу users_by_email"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get(self, username):
+        return self.storage.get('users', username)
+
+    def find_by_email(self, email):
+        return self.storage.find_user_by_email(email)
+
+    def conflict(self, username, email):
+        if self.storage.get('users', username) is not None:
+            return USERNAME_TAKEN
+        if self.storage.find_user_by_email(email) is not None:
+            return EMAIL_TAKEN
+        return None
+
+    def all(self):
+        return self.storage.load_all('users')
+
+    def create(self, username, user):
+        return self.storage.create_user(username, user)
+
+    def update(self, username, fn):
+        result = []
+
+        def apply(user):
+            if user is None:
+                return UNCHANGED
+            updated = fn(user)
+            result.append(user if updated is UNCHANGED else updated)
+            return updated
+
+        self.storage.update('users', username, apply)
+        return result[0] if result else None
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,204 @@
+import copy
+import logging
+import threading
+
+from storage import UNCHANGED
+
+log = logging.getLogger(__name__)
+
+
+def _replay(fns):
+    """Функция для update(): применяет отложенные изменения записи по порядку"""
+    def apply(value):
+        changed = False
+        for fn in fns:
+            result = fn(value)
+            if result is not UNCHANGED:
+                value = result
+                changed = True
+        return value if changed else UNCHANGED
+    return apply
+
+
+class WriteBehindStorage:
+    """Хранилище с отложенной групповой записью выбранных коллекций.
+
+    Изменения записей из collections не пишутся сразу: в памяти процесса остаются
+    итоговое значение записи (его видят следующие чтения - read-your-writes) и сами
+    функции изменения. Раз в interval секунд или при max_pending измененных записях
+    фоновый поток записывает всю группу одним update_many - одна перезапись файла
+    JSON или одна транзакция SQLite вместо записи на каждый клик. Функции изменения
+    применяются заново к данным на диске, поэтому изменения той же записи из других
+    процессов не теряются; видны другим процессам изменения становятся после записи
+    группы. close() дописывает все накопленное; вызвать его должен владелец (в app.py -
+    close_stores при выходе и при остановке ASGI-сервера), при аварийном завершении
+    процесса теряется последняя группа.
+
+    Остальные коллекции и методы передаются хранилищу без изменений.
+    """
+
+    def __init__(self, storage, collections, interval=0.2, max_pending=100):
+        self.storage = storage
+        self.collections = frozenset(collections)
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}   # (коллекция, ключ) -> [значение после изменений, [fn, ...]]
+        self._flushing = {}  # группа, которая пишется прямо сейчас (для чтений)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._generation = 0  # растет после каждой записанной группы
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.written = 0
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    # --- чтение ---
+
+    def _lookup(self, collection, key):
+        """[значение] из накопленных изменений или None, если их нет (вызывать под _lock)"""
+        for pending in (self._pending, self._flushing):
+            entry = pending.get((collection, key))
+            if entry is not None:
+                return [entry[0]]
+        return None
+
+    def get(self, collection, key, default=None):
+        if collection in self.collections:
+            with self._lock:
+                found = self._lookup(collection, key)
+            if found is not None:
+                return copy.deepcopy(found[0]) if found[0] is not None else default
+        return self.storage.get(collection, key, default)
+
+    def load_all(self, collection):
+        data = self.storage.load_all(collection)
+        if collection in self.collections:
+            with self._lock:
+                overlay = [(key, entry[0]) for pending in (self._flushing, self._pending)
+                           for (name, key), entry in pending.items() if name == collection]
+            for key, value in overlay:
+                if value is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = copy.deepcopy(value)
+        return data
+
+    def query_orders(self, *args, **kwargs):
+        # Запрос по индексам SQLite накопленных заказов не увидит - сначала записываем их
+        if 'orders' in self.collections:
+            self.flush()
+        return self.storage.query_orders(*args, **kwargs)
+
+    # --- запись ---
+
+    def update(self, collection, key, fn):
+        if collection not in self.collections:
+            return self.storage.update(collection, key, fn)
+        while True:
+            with self._lock:
+                found = self._lookup(collection, key)
+                generation = self._generation
+            if found is None:
+                # Файл читаем без блокировки: чтение не задерживает изменения других записей
+                current = self.storage.get(collection, key)
+            with self._lock:
+                if found is None:
+                    found = self._lookup(collection, key)
+                    if found is None and self._generation != generation:
+                        continue  # пока читали, записалась группа с этой записью - читаем заново
+                if found is not None:
+                    current = found[0]
+                value = fn(copy.deepcopy(current))
+                if value is UNCHANGED:
+                    return
+                entry = self._pending.setdefault((collection, key), [None, []])
+                entry[0] = value
+                entry[1].append(fn)
+                if len(self._pending) >= self.max_pending:
+                    self._wake.set()
+                return
+
+    def put(self, collection, key, value):
+        value = copy.deepcopy(value)
+        self.update(collection, key, lambda _: copy.deepcopy(value))
+
+    def delete(self, collection, key):
+        self.update(collection, key, lambda _: None)
+
+    def delete_many(self, collection, keys):
+        if collection not in self.collections:
+            return self.storage.delete_many(collection, keys)
+        for key in keys:
+            self.delete(collection, key)
+
+    def save_all(self, collection, data):
+        self.flush()
+        self.storage.save_all(collection, data)
+
+    # --- групповая запись ---
+
+    def flush(self):
+        """Записывает накопленные изменения: по одному update_many на коллекцию"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+            if not batch:
+                return 0
+            groups = {}
+            for (collection, key), (_, fns) in batch.items():
+                groups.setdefault(collection, {})[key] = _replay(fns)
+            written = set()
+            try:
+                for collection, fns in groups.items():
+                    self.storage.update_many(collection, fns)
+                    written.add(collection)
+            except Exception:
+                # Незаписанные коллекции возвращаем в очередь перед новыми изменениями
+                # (записанные - нет: повторное "+1 к количеству" удвоило бы товар)
+                with self._lock:
+                    for item, (value, fns) in batch.items():
+                        if item[0] in written:
+                            continue
+                        newer = self._pending.get(item)
+                        self._pending[item] = [newer[0], fns + newer[1]] if newer else [value, fns]
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+                self._generation += 1
+            self.flushes += 1
+            self.written += len(batch)
+            return len(batch)
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Не удалось записать отложенные изменения")
+
+    def start(self):
+        """Запускает фоновую групповую запись"""
+        if self._thread is None and self.collections:
+            self._thread = threading.Thread(target=self._flush_loop, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Останавливает фоновую запись и дописывает все накопленное"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        return {'collections': sorted(self.collections), 'pending': len(self._pending),
+                'flushes': self.flushes, 'written': self.written}